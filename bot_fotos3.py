@@ -12,13 +12,23 @@
 #   python bot_fotos.py
 
 import os
+import sys
 import json
+import asyncio
+import functools
 import sqlite3
 import logging
 import time
 import uuid
+import hashlib
 import re
+import threading
+import socket
+import queue
+import itertools
+from concurrent.futures import ThreadPoolExecutor, Future
 from datetime import datetime, timezone, timedelta
+from collections import OrderedDict
 from typing import Optional, Dict, Any, List, Tuple
 
 import gspread
@@ -45,6 +55,30 @@ ROUTING_JSON = os.getenv("ROUTING_JSON", "").strip()
 
 MAX_MEDIA_PER_STEP = 8
 
+# SQLite (conexiones persistentes por hilo)
+DB_BUSY_TIMEOUT_SEC = float(os.getenv("DB_BUSY_TIMEOUT_SEC", "10"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))        # 16 MB de page cache por conexión
+DB_CACHED_STATEMENTS = int(os.getenv("DB_CACHED_STATEMENTS", "256"))  # sentencias preparadas reutilizadas
+DB_READ_WORKERS = int(os.getenv("DB_READ_WORKERS", "4"))
+OPEN_CASE_CACHE_MAX = int(os.getenv("OPEN_CASE_CACHE_MAX", "5000"))  # claves (chat_id, user_id) en memoria
+CACHE_STATS_LOG_SEC = int(os.getenv("CACHE_STATS_LOG_SEC", "600"))
+PENDING_INPUT_TTL_MIN = int(os.getenv("PENDING_INPUT_TTL_MIN", "60"))  # vigencia de un texto esperado (código/motivo)
+
+# Retención de sheet_outbox (filas SENT/DEAD -> sheet_outbox_archive)
+OUTBOX_RETENTION_DAYS = float(os.getenv("OUTBOX_RETENTION_DAYS", "3"))
+OUTBOX_RETENTION_BATCH = int(os.getenv("OUTBOX_RETENTION_BATCH", "500"))
+OUTBOX_RETENTION_INTERVAL_SEC = int(os.getenv("OUTBOX_RETENTION_INTERVAL_SEC", "3600"))
+DB_INCREMENTAL_VACUUM_PAGES = int(os.getenv("DB_INCREMENTAL_VACUUM_PAGES", "2000"))
+# VACUUM completo (conversión a auto_vacuum=INCREMENTAL) al arrancar: solo si se pide explícitamente.
+# Alternativa sin tocar el arranque: `python bot_fotos3.py --db-maintenance` con el bot detenido.
+DB_MAINTENANCE_ON_START = os.getenv("DB_MAINTENANCE_ON_START", "0").strip() == "1"
+
+# Archivo frío: casos CLOSED/CANCELLED antiguos -> DB separada (ATTACH ... AS archive). Vacío = deshabilitado.
+ARCHIVE_DB_PATH = os.getenv("ARCHIVE_DB_PATH", f"{os.path.splitext(DB_PATH)[0]}_archive.sqlite3").strip()
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_BATCH_CASES = int(os.getenv("ARCHIVE_BATCH_CASES", "200"))
+ARCHIVE_INTERVAL_SEC = int(os.getenv("ARCHIVE_INTERVAL_SEC", "21600"))  # 6 h
+
 # Perú (UTC-5)
 PERU_TZ = timezone(timedelta(hours=-5))
 
@@ -139,7 +173,45 @@ PAIRING_COLUMNS = ["code", "origin_chat_id", "purpose", "expires_at", "used", "c
 # Cache/refresh
 TECH_CACHE_TTL_SEC = int(os.getenv("TECH_CACHE_TTL_SEC", "180"))     # 3 min default
 ROUTING_CACHE_TTL_SEC = int(os.getenv("ROUTING_CACHE_TTL_SEC", "180"))  # 3 min default
+# La sonda de TECNICOS/ROUTING solo lee clave + updated_at; cada tanto se recarga completo igual
+CONFIG_FULL_RELOAD_SEC = int(os.getenv("CONFIG_FULL_RELOAD_SEC", "1800"))  # 30 min default
 PAIRING_TTL_MINUTES = int(os.getenv("PAIRING_TTL_MINUTES", "10"))    # 10 min default
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "200"))         # filas por tick inicial (se adapta)
+OUTBOX_BATCH_MIN = int(os.getenv("OUTBOX_BATCH_MIN", "20"))
+OUTBOX_BATCH_MAX = int(os.getenv("OUTBOX_BATCH_MAX", "1000"))
+OUTBOX_BATCH_STEP = int(os.getenv("OUTBOX_BATCH_STEP", "50"))          # crecimiento aditivo por tick sano
+OUTBOX_COALESCE_SEC = float(os.getenv("OUTBOX_COALESCE_SEC", "1"))     # ventana para juntar ráfagas antes de enviar
+OUTBOX_STALL_RECHECK_SEC = float(os.getenv("OUTBOX_STALL_RECHECK_SEC", "30"))  # reintento si el lote no avanzó
+# Leases del outbox (varios workers/procesos): el lease debe superar el timeout de Sheets.
+# Sin OUTBOX_WORKER_ID el id es único por proceso (host:pid:azar) y lo en vuelo de una caída se
+# recupera al vencer el lease. Con un id fijo (uno por worker) el arranque libera sus leases al instante.
+OUTBOX_WORKER_ID_FIXED = os.getenv("OUTBOX_WORKER_ID", "").strip()
+OUTBOX_WORKER_ID = OUTBOX_WORKER_ID_FIXED or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+# Prioridad de carriles (menor = primero en tomar cuota). 0 queda para llamadas interactivas (/config, vinculación).
+# Ej: OUTBOX_LANE_PRIORITY="CASOS:1,DETALLE_PASOS:2,EVIDENCIAS:3"
+OUTBOX_LANE_PRIORITY: Dict[str, int] = {
+    k.strip(): int(v)
+    for k, v in (p.split(":", 1) for p in os.getenv("OUTBOX_LANE_PRIORITY", "").split(",") if ":" in p)
+}
+
+# Gateway Sheets (gspread fuera del event loop)
+# Hilos para llamadas gspread. 0 = automático: un hilo por carril del outbox + SHEETS_INTERACTIVE_WORKERS,
+# así un carril dormido esperando cuota nunca deja sin hilo a CASOS ni a los handlers interactivos.
+SHEETS_WORKERS = int(os.getenv("SHEETS_WORKERS", "0"))
+SHEETS_INTERACTIVE_WORKERS = int(os.getenv("SHEETS_INTERACTIVE_WORKERS", "3"))  # handlers + jobs (config, índice)
+SHEETS_CALL_TIMEOUT_SEC = float(os.getenv("SHEETS_CALL_TIMEOUT_SEC", "60"))  # espera máx. por operación
+SHEETS_HTTP_TIMEOUT_SEC = float(os.getenv("SHEETS_HTTP_TIMEOUT_SEC", "30"))  # timeout HTTP por request
+WS_SNAPSHOT_TTL_SEC = float(os.getenv("WS_SNAPSHOT_TTL_SEC", "30"))       # vigencia del snapshot de hojas de config
+OUTBOX_LEASE_SEC = float(os.getenv("OUTBOX_LEASE_SEC", str(max(300.0, 3 * SHEETS_CALL_TIMEOUT_SEC))))
+SHEET_INDEX_VERIFY_SEC = int(os.getenv("SHEET_INDEX_VERIFY_SEC", "3600"))    # verificación de sheet_row_index
+SHEETS_CONNECT_TIMEOUT_SEC = float(os.getenv("SHEETS_CONNECT_TIMEOUT_SEC", "180"))  # conexión inicial (en segundo plano)
+SHEETS_CONNECT_RETRY_SEC = int(os.getenv("SHEETS_CONNECT_RETRY_SEC", "60"))         # reintento si Sheets no responde
+
+# Cuotas Google Sheets (por usuario/service account: 60 lecturas y 60 escrituras por minuto)
+SHEETS_READS_PER_MIN = int(os.getenv("SHEETS_READS_PER_MIN", "60"))
+SHEETS_WRITES_PER_MIN = int(os.getenv("SHEETS_WRITES_PER_MIN", "60"))
+SHEETS_QUOTA_BACKOFF_SEC = float(os.getenv("SHEETS_QUOTA_BACKOFF_SEC", "30"))  # pausa ante 429 sin Retry-After
+SHEETS_LATENCY_TARGET_SEC = float(os.getenv("SHEETS_LATENCY_TARGET_SEC", "5"))  # sobre esto, el lote se achica
 
 # =========================
 # Logging
@@ -199,12 +271,97 @@ async def safe_edit_message_text(q, text: str, **kwargs) -> None:
 # =========================
 # DB helpers
 # =========================
-def db() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+_db_local = threading.local()
+_db_conns: List[sqlite3.Connection] = []
+_db_conns_lock = threading.Lock()
+_db_gen = 0  # db_close_all() lo incrementa: cada hilo descarta su conexión cerrada en el próximo db()
+
+
+def _db_connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=DB_BUSY_TIMEOUT_SEC,
+        cached_statements=DB_CACHED_STATEMENTS,
+        check_same_thread=False,  # cada hilo usa la suya; solo db_close_all() cruza hilos
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB};")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    if ARCHIVE_DB_PATH:
+        conn.execute("ATTACH DATABASE ? AS archive;", (ARCHIVE_DB_PATH,))
+        conn.execute("PRAGMA archive.journal_mode=WAL;")
+        conn.execute("PRAGMA archive.synchronous=NORMAL;")
+        try:
+            _create_archive_views(conn)
+        except sqlite3.Error:
+            pass  # primer arranque: init_db crea el esquema del archivo y las vistas
+    return conn
+
+
+def db() -> sqlite3.Connection:
+    """
+    Conexión persistente por hilo (WAL + pragmas), reutilizada entre llamadas.
+    `with db() as conn:` hace commit/rollback pero NO cierra la conexión.
+    """
+    conn = getattr(_db_local, "conn", None)
+    if conn is None or getattr(_db_local, "gen", None) != _db_gen:
+        conn = _db_connect()
+        with _db_conns_lock:
+            _db_conns.append(conn)
+            _db_local.gen = _db_gen
+        _db_local.conn = conn
     return conn
 
 
+def db_close_all() -> None:
+    """
+    Cierra las conexiones de todos los hilos (lectores/escritor incluidos). Cada hilo abre
+    una nueva en su próximo db(): la generación guardada en su thread-local ya no coincide.
+    """
+    global _db_gen
+    with _db_conns_lock:
+        conns = list(_db_conns)
+        _db_conns.clear()
+        _db_gen += 1
+    for conn in conns:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    _db_local.conn = None
+
+# =========================
+# DB executor (SQLite fuera del event loop)
+#   - 1 hilo escritor: serializa INSERT/UPDATE/DELETE (sin esperas por lock)
+#   - N hilos lectores: WAL permite leer en paralelo al escritor
+# =========================
+_db_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+_db_read_executor = ThreadPoolExecutor(max_workers=DB_READ_WORKERS, thread_name_prefix="db-reader")
+
+
+async def db_read(fn, *args, **kwargs):
+    """
+    Ejecuta un helper de solo lectura en el pool de lectores.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_read_executor, functools.partial(fn, *args, **kwargs))
+
+
+async def db_write(fn, *args, **kwargs):
+    """
+    Ejecuta un helper que escribe en el hilo escritor único (orden FIFO).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_write_executor, functools.partial(fn, *args, **kwargs))
+
+
+def db_executors_shutdown() -> None:
+    _db_write_executor.shutdown(wait=True)
+    _db_read_executor.shutdown(wait=True)
+
+
 def now_utc() -> str:
     return datetime.now(timezone.utc).isoformat()
 
@@ -240,168 +397,550 @@ def _col_exists(conn: sqlite3.Connection, table: str, col: str) -> bool:
     return any(r["name"] == col for r in rows)
 
 
-def init_db():
-    with db() as conn:
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS cases (
-                case_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                username TEXT,
-                created_at TEXT NOT NULL,
-                finished_at TEXT,
-                status TEXT NOT NULL,
-                step_index INTEGER NOT NULL,
-                phase TEXT,
-                pending_step_no INTEGER,
-                technician_name TEXT,
-                service_type TEXT,
-                abonado_code TEXT,
-                location_lat REAL,
-                location_lon REAL,
-                location_at TEXT,
-                install_mode TEXT
-            );
-            """
+def _ensure_incremental_vacuum(conn: sqlite3.Connection, allow_vacuum: bool = False) -> bool:
+    """
+    auto_vacuum=INCREMENTAL permite devolver páginas libres (tras archivar outbox) sin VACUUM completo.
+    DB nueva (sin tablas): PRAGMA + VACUUM instantáneo. DB existente: requiere un VACUUM único que reescribe
+    todo el archivo, así que solo corre con allow_vacuum (comando de mantenimiento / opt-in);
+    si no, se avisa en el log. Retorna True si el modo quedó activo.
+    """
+    mode = int(conn.execute("PRAGMA auto_vacuum;").fetchone()[0])
+    if mode == 2:
+        return True
+    empty = not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' LIMIT 1").fetchone()
+    if not empty and not allow_vacuum:
+        log.warning(
+            "SQLite: auto_vacuum=INCREMENTAL pendiente (requiere VACUUM completo). "
+            "Ejecuta `python bot_fotos3.py --db-maintenance` con el bot detenido, o DB_MAINTENANCE_ON_START=1."
         )
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_cases_open ON cases(chat_id, user_id, status);")
+        return False
+    if not empty:
+        log.info("SQLite: activando auto_vacuum=INCREMENTAL (VACUUM único)...")
+    t0 = time.monotonic()
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+    conn.execute("VACUUM;")
+    if not empty:
+        log.info(f"SQLite: VACUUM terminado en {time.monotonic() - t0:.1f}s.")
+    return True
 
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS chat_config (
-                chat_id INTEGER PRIMARY KEY,
-                approval_required INTEGER NOT NULL DEFAULT 1,
-                updated_at TEXT
-            );
-            """
-        )
 
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS step_state (
-                case_id INTEGER NOT NULL,
-                step_no INTEGER NOT NULL,
-                attempt INTEGER NOT NULL DEFAULT 1,
-                submitted INTEGER NOT NULL DEFAULT 0,
-                approved INTEGER,
-                reviewed_by INTEGER,
-                reviewed_at TEXT,
-                created_at TEXT NOT NULL,
-                reject_reason TEXT,
-                reject_reason_by INTEGER,
-                reject_reason_at TEXT,
-                PRIMARY KEY(case_id, step_no, attempt),
-                FOREIGN KEY(case_id) REFERENCES cases(case_id)
-            );
-            """
-        )
+# =========================
+# Esquema: migraciones versionadas (PRAGMA user_version)
+#   Cada migración corre UNA sola vez, dentro de una transacción, y deja user_version = su número.
+#   Para cambiar el esquema: agregar _migration_N y registrarla al final de MIGRATIONS.
+#   Pasos que no pueden ir en una transacción (VACUUM): la migración solo los registra en
+#   db_maintenance y _run_db_maintenance los ejecuta después (ver MAINTENANCE_STEPS).
+# =========================
+def _migration_1_base_schema(conn: sqlite3.Connection) -> None:
+    """
+    Esquema base. Incluye las soft-migrations históricas (columnas agregadas sobre DBs antiguas).
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cases (
+            case_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            created_at TEXT NOT NULL,
+            finished_at TEXT,
+            status TEXT NOT NULL,
+            step_index INTEGER NOT NULL,
+            phase TEXT,
+            pending_step_no INTEGER,
+            technician_name TEXT,
+            service_type TEXT,
+            abonado_code TEXT,
+            location_lat REAL,
+            location_lon REAL,
+            location_at TEXT,
+            install_mode TEXT
+        );
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cases_open ON cases(chat_id, user_id, status);")
+
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS chat_config (
+            chat_id INTEGER PRIMARY KEY,
+            approval_required INTEGER NOT NULL DEFAULT 1,
+            updated_at TEXT
+        );
+        """
+    )
 
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS media (
-                media_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                case_id INTEGER NOT NULL,
-                step_no INTEGER NOT NULL,
-                attempt INTEGER NOT NULL,
-                file_type TEXT NOT NULL,
-                file_id TEXT NOT NULL,
-                file_unique_id TEXT,
-                tg_message_id INTEGER NOT NULL,
-                meta_json TEXT,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY(case_id) REFERENCES cases(case_id)
-            );
-            """
-        )
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_media_case_step ON media(case_id, step_no, attempt);")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS step_state (
+            case_id INTEGER NOT NULL,
+            step_no INTEGER NOT NULL,
+            attempt INTEGER NOT NULL DEFAULT 1,
+            submitted INTEGER NOT NULL DEFAULT 0,
+            approved INTEGER,
+            reviewed_by INTEGER,
+            reviewed_at TEXT,
+            created_at TEXT NOT NULL,
+            reject_reason TEXT,
+            reject_reason_by INTEGER,
+            reject_reason_at TEXT,
+            PRIMARY KEY(case_id, step_no, attempt),
+            FOREIGN KEY(case_id) REFERENCES cases(case_id)
+        );
+        """
+    )
 
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS auth_text (
-                auth_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                case_id INTEGER NOT NULL,
-                step_no INTEGER NOT NULL,
-                attempt INTEGER NOT NULL,
-                text TEXT NOT NULL,
-                tg_message_id INTEGER NOT NULL,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY(case_id) REFERENCES cases(case_id)
-            );
-            """
-        )
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_auth_text_case_step ON auth_text(case_id, step_no, attempt);")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS media (
+            media_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            case_id INTEGER NOT NULL,
+            step_no INTEGER NOT NULL,
+            attempt INTEGER NOT NULL,
+            file_type TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            file_unique_id TEXT,
+            tg_message_id INTEGER NOT NULL,
+            meta_json TEXT,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY(case_id) REFERENCES cases(case_id)
+        );
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_case_step ON media(case_id, step_no, attempt);")
+
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS auth_text (
+            auth_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            case_id INTEGER NOT NULL,
+            step_no INTEGER NOT NULL,
+            attempt INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            tg_message_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY(case_id) REFERENCES cases(case_id)
+        );
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_auth_text_case_step ON auth_text(case_id, step_no, attempt);")
+
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pending_inputs (
+            pending_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            case_id INTEGER NOT NULL,
+            step_no INTEGER NOT NULL,
+            attempt INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            reply_to_message_id INTEGER,
+            tech_user_id INTEGER
+        );
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pending_inputs ON pending_inputs(chat_id, user_id, kind);")
+
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sheet_outbox (
+            outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sheet_name TEXT NOT NULL,
+            op_type TEXT NOT NULL,
+            dedupe_key TEXT NOT NULL,
+            row_json TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'PENDING',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            next_retry_at TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT
+        );
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pending ON sheet_outbox(status, next_retry_at);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_key ON sheet_outbox(sheet_name, dedupe_key);")
+
+    # Soft migrations
+    for col, ddl in [
+        ("finished_at", "TEXT"),
+        ("phase", "TEXT"),
+        ("pending_step_no", "INTEGER"),
+        ("technician_name", "TEXT"),
+        ("service_type", "TEXT"),
+        ("abonado_code", "TEXT"),
+        ("location_lat", "REAL"),
+        ("location_lon", "REAL"),
+        ("location_at", "TEXT"),
+        ("install_mode", "TEXT"),
+    ]:
+        if not _col_exists(conn, "cases", col):
+            conn.execute(f"ALTER TABLE cases ADD COLUMN {col} {ddl};")
+
+    for col, ddl in [
+        ("reject_reason", "TEXT"),
+        ("reject_reason_by", "INTEGER"),
+        ("reject_reason_at", "TEXT"),
+    ]:
+        if not _col_exists(conn, "step_state", col):
+            conn.execute(f"ALTER TABLE step_state ADD COLUMN {col} {ddl};")
+
+    for col, ddl in [
+        ("reply_to_message_id", "INTEGER"),
+        ("tech_user_id", "INTEGER"),
+    ]:
+        if not _col_exists(conn, "pending_inputs", col):
+            conn.execute(f"ALTER TABLE pending_inputs ADD COLUMN {col} {ddl};")
+
+
+def _migration_2_case_stats(conn: sqlite3.Connection) -> None:
+    case_stats_exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='case_stats'"
+    ).fetchone()
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS case_stats (
+            case_id INTEGER PRIMARY KEY,
+            approved_steps INTEGER NOT NULL DEFAULT 0,
+            rejected_steps INTEGER NOT NULL DEFAULT 0,
+            total_media INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY(case_id) REFERENCES cases(case_id)
+        );
+        """
+    )
 
+    # Contadores por caso: backfill único al crear la tabla (luego se mantienen en add_media/set_review)
+    if not case_stats_exists:
         conn.execute(
             """
-            CREATE TABLE IF NOT EXISTS pending_inputs (
-                pending_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                kind TEXT NOT NULL,
-                case_id INTEGER NOT NULL,
-                step_no INTEGER NOT NULL,
-                attempt INTEGER NOT NULL,
-                created_at TEXT NOT NULL,
-                reply_to_message_id INTEGER,
-                tech_user_id INTEGER
-            );
+            INSERT INTO case_stats(case_id, approved_steps, rejected_steps, total_media)
+            SELECT c.case_id,
+                   (SELECT COUNT(*) FROM step_state s WHERE s.case_id=c.case_id AND s.step_no > 0 AND s.approved=1),
+                   (SELECT COUNT(*) FROM step_state s WHERE s.case_id=c.case_id AND s.step_no > 0 AND s.approved=0),
+                   (SELECT COUNT(*) FROM media m WHERE m.case_id=c.case_id AND m.step_no > 0)
+            FROM cases c
             """
         )
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_pending_inputs ON pending_inputs(chat_id, user_id, kind);")
 
+
+def _migration_3_outbox_retention(conn: sqlite3.Connection) -> None:
+    # Índices parciales: solo cubren filas vivas (PENDING/FAILED), no el historial SENT/DEAD
+    conn.execute("DROP INDEX IF EXISTS idx_outbox_pending;")
+    conn.execute("DROP INDEX IF EXISTS idx_outbox_key;")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_live ON sheet_outbox(created_at) WHERE status IN ('PENDING','FAILED');"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_live_key ON sheet_outbox(sheet_name, dedupe_key) WHERE status IN ('PENDING','FAILED');"
+    )
+
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sheet_outbox_archive (
+            outbox_id INTEGER PRIMARY KEY,
+            sheet_name TEXT NOT NULL,
+            op_type TEXT NOT NULL,
+            dedupe_key TEXT NOT NULL,
+            row_json TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT,
+            archived_at TEXT NOT NULL
+        );
+        """
+    )
+
+
+def _migration_4_sheet_row_index(conn: sqlite3.Connection) -> None:
+    # Fila de Sheets por dedupe_key: evita descargar la hoja completa en cada arranque
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sheet_row_index (
+            sheet_name TEXT NOT NULL,
+            dedupe_key TEXT NOT NULL,
+            row_no INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY(sheet_name, dedupe_key)
+        ) WITHOUT ROWID;
+        """
+    )
+    # Última verificación completa por hoja (si no hay fila, la hoja aún no está sembrada)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sheet_index_meta (
+            sheet_name TEXT PRIMARY KEY,
+            verified_at TEXT NOT NULL,
+            row_count INTEGER NOT NULL
+        );
+        """
+    )
+
+
+def _migration_5_evidencias_append_only(conn: sqlite3.Connection) -> None:
+    # EVIDENCIAS pasa a append-only: su índice de filas ya no se usa
+    conn.execute("DELETE FROM sheet_row_index WHERE sheet_name='EVIDENCIAS';")
+    conn.execute("DELETE FROM sheet_index_meta WHERE sheet_name='EVIDENCIAS';")
+
+
+def _migration_6_outbox_lanes(conn: sqlite3.Connection) -> None:
+    # Un carril por hoja: fetch por (sheet_name, created_at) solo sobre filas vivas
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_live_sheet ON sheet_outbox(sheet_name, created_at) WHERE status IN ('PENDING','FAILED');"
+    )
+
+
+def _migration_7_outbox_leases(conn: sqlite3.Connection) -> None:
+    # Reclamo con lease: IN_FLIGHT + dueño + vencimiento
+    if not _col_exists(conn, "sheet_outbox", "lease_owner"):
+        conn.execute("ALTER TABLE sheet_outbox ADD COLUMN lease_owner TEXT;")
+    if not _col_exists(conn, "sheet_outbox", "lease_until"):
+        conn.execute("ALTER TABLE sheet_outbox ADD COLUMN lease_until TEXT;")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_inflight ON sheet_outbox(sheet_name, dedupe_key, lease_until) WHERE status='IN_FLIGHT';"
+    )
+
+
+def _migration_8_pairing_codes(conn: sqlite3.Connection) -> None:
+    # Códigos de vinculación locales (la hoja PAIRING queda como auditoría)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pairing_codes (
+            code TEXT PRIMARY KEY,
+            origin_chat_id INTEGER NOT NULL,
+            purpose TEXT NOT NULL,
+            expires_at TEXT NOT NULL,
+            used INTEGER NOT NULL DEFAULT 0,
+            created_by TEXT,
+            created_at TEXT NOT NULL,
+            used_by TEXT,
+            used_at TEXT,
+            dest_chat_id INTEGER
+        );
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pairing_codes_expires ON pairing_codes(expires_at);")
+
+
+def _migration_9_config_snapshot(conn: sqlite3.Connection) -> None:
+    # Última copia buena de tech_cache / routing_cache para arrancar sin esperar a Google
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS config_snapshot (
+            name TEXT PRIMARY KEY,
+            data_json TEXT NOT NULL,
+            saved_at TEXT NOT NULL
+        );
+        """
+    )
+
+
+def _migration_10_db_maintenance(conn: sqlite3.Connection) -> None:
+    # VACUUM no puede correr dentro del BEGIN IMMEDIATE de la migración: aquí solo se registra
+    # el paso (versionado); _run_db_maintenance lo ejecuta fuera de la transacción.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS db_maintenance (
+            step TEXT PRIMARY KEY,
+            migration INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+        """
+    )
+    mode = int(conn.execute("PRAGMA auto_vacuum;").fetchone()[0])
+    conn.execute(
+        "INSERT OR IGNORE INTO db_maintenance(step, migration, status, updated_at) VALUES(?,?,?,?)",
+        ("auto_vacuum_incremental", 10, "DONE" if mode == 2 else "PENDING", now_utc()),
+    )
+
+
+def _migration_11_outbox_history_indexes(conn: sqlite3.Connection) -> None:
+    # Retención: SENT/DEAD por antigüedad sin recorrer la tabla; DEAD también se archiva
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_done ON sheet_outbox(updated_at) WHERE status IN ('SENT','DEAD');"
+    )
+    # outbox_live_rows (overlay de ROUTING, warm start) incluye IN_FLIGHT: índice por carril que lo cubre
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_open_sheet ON sheet_outbox(sheet_name, created_at) "
+        "WHERE status IN ('PENDING','FAILED','IN_FLIGHT');"
+    )
+
+
+MIGRATIONS: List[Tuple[int, str, Any]] = [
+    (1, "esquema base", _migration_1_base_schema),
+    (2, "case_stats", _migration_2_case_stats),
+    (3, "outbox: índices parciales + archivo", _migration_3_outbox_retention),
+    (4, "sheet_row_index", _migration_4_sheet_row_index),
+    (5, "EVIDENCIAS append-only", _migration_5_evidencias_append_only),
+    (6, "outbox: carriles por hoja", _migration_6_outbox_lanes),
+    (7, "outbox: leases IN_FLIGHT", _migration_7_outbox_leases),
+    (8, "pairing_codes", _migration_8_pairing_codes),
+    (9, "config_snapshot", _migration_9_config_snapshot),
+    (10, "db_maintenance: auto_vacuum INCREMENTAL", _migration_10_db_maintenance),
+    (11, "outbox: índices de historial y en vuelo", _migration_11_outbox_history_indexes),
+]
+
+
+def _run_migrations(conn: sqlite3.Connection) -> None:
+    current = int(conn.execute("PRAGMA user_version;").fetchone()[0])
+    for version, name, fn in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            fn(conn)
+            conn.execute(f"PRAGMA user_version={int(version)};")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        log.info(f"SQLite: migración {version} aplicada ({name}).")
+
+
+# Pasos de mantenimiento fuera de transacción: step -> fn(conn, allow_vacuum) -> True si quedó hecho
+MAINTENANCE_STEPS: Dict[str, Any] = {
+    "auto_vacuum_incremental": _ensure_incremental_vacuum,
+}
+
+
+def _run_db_maintenance(conn: sqlite3.Connection, allow_vacuum: bool) -> None:
+    """
+    Hook post-migraciones: ejecuta los pasos PENDING de db_maintenance y los marca DONE.
+    Los que reescriben la DB solo corren con allow_vacuum; si no, quedan PENDING y se avisa.
+    """
+    pending = conn.execute("SELECT step FROM db_maintenance WHERE status='PENDING' ORDER BY migration").fetchall()
+    for r in pending:
+        fn = MAINTENANCE_STEPS.get(r["step"])
+        if fn is None or not fn(conn, allow_vacuum):
+            continue
+        conn.execute("UPDATE db_maintenance SET status='DONE', updated_at=? WHERE step=?", (now_utc(), r["step"]))
+        conn.commit()
+        log.info(f"SQLite: mantenimiento {r['step']} completado.")
+
+
+# =========================
+# Archivo frío (hot/cold split)
+#   main    -> casos vivos + recientes (índices chicos, backups chicos)
+#   archive -> casos CLOSED/CANCELLED con más de ARCHIVE_AFTER_DAYS días
+#   Reportes: vistas TEMP <tabla>_all = main UNION ALL archive (por conexión)
+#   get_case / aget_case leen solo main: un caso archivado es None para los handlers
+# =========================
+ARCHIVE_TABLES = ["cases", "step_state", "media", "auth_text", "case_stats"]
+
+ARCHIVE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS archive.idx_arch_cases_chat ON cases(chat_id, user_id);",
+    "CREATE INDEX IF NOT EXISTS archive.idx_arch_media_case_step ON media(case_id, step_no, attempt);",
+    "CREATE INDEX IF NOT EXISTS archive.idx_arch_auth_text_case_step ON auth_text(case_id, step_no, attempt);",
+]
+
+
+def _table_columns(conn: sqlite3.Connection, schema: str, table: str) -> List[Tuple[str, str]]:
+    return [(r["name"], r["type"]) for r in conn.execute(f"PRAGMA {schema}.table_info({table})").fetchall()]
+
+
+def _ensure_archive_schema(conn: sqlite3.Connection) -> None:
+    """
+    Replica en `archive` las tablas de casos con el mismo DDL (PKs incluidas, para copias idempotentes)
+    y agrega columnas que migraciones posteriores hayan sumado en main.
+    """
+    for table in ARCHIVE_TABLES:
+        row = conn.execute("SELECT sql FROM main.sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+        if not row:
+            continue
+        ddl = re.sub(
+            r"^CREATE TABLE\s+(IF NOT EXISTS\s+)?\"?\w+\"?",
+            f"CREATE TABLE IF NOT EXISTS archive.{table}",
+            row["sql"],
+            count=1,
+        )
+        conn.execute(ddl)
+        have = {c for c, _t in _table_columns(conn, "archive", table)}
+        for col, typ in _table_columns(conn, "main", table):
+            if col not in have:
+                conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {col} {typ};")
+    for ddl in ARCHIVE_INDEXES:
+        conn.execute(ddl)
+    conn.commit()
+
+
+def _create_archive_views(conn: sqlite3.Connection) -> None:
+    for table in ARCHIVE_TABLES:
+        cols = ", ".join(c for c, _t in _table_columns(conn, "main", table))
+        if not cols or not _table_columns(conn, "archive", table):
+            raise sqlite3.OperationalError(f"archive.{table} no existe")
         conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS sheet_outbox (
-                outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sheet_name TEXT NOT NULL,
-                op_type TEXT NOT NULL,
-                dedupe_key TEXT NOT NULL,
-                row_json TEXT NOT NULL,
-                status TEXT NOT NULL DEFAULT 'PENDING',
-                attempts INTEGER NOT NULL DEFAULT 0,
-                last_error TEXT,
-                next_retry_at TEXT,
-                created_at TEXT NOT NULL,
-                updated_at TEXT
-            );
-            """
+            f"CREATE TEMP VIEW IF NOT EXISTS {table}_all AS "
+            f"SELECT {cols} FROM main.{table} UNION ALL SELECT {cols} FROM archive.{table}"
         )
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pending ON sheet_outbox(status, next_retry_at);")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_key ON sheet_outbox(sheet_name, dedupe_key);")
-
-        # Soft migrations
-        for col, ddl in [
-            ("finished_at", "TEXT"),
-            ("phase", "TEXT"),
-            ("pending_step_no", "INTEGER"),
-            ("technician_name", "TEXT"),
-            ("service_type", "TEXT"),
-            ("abonado_code", "TEXT"),
-            ("location_lat", "REAL"),
-            ("location_lon", "REAL"),
-            ("location_at", "TEXT"),
-            ("install_mode", "TEXT"),
-        ]:
-            if not _col_exists(conn, "cases", col):
-                conn.execute(f"ALTER TABLE cases ADD COLUMN {col} {ddl};")
-
-        for col, ddl in [
-            ("reject_reason", "TEXT"),
-            ("reject_reason_by", "INTEGER"),
-            ("reject_reason_at", "TEXT"),
-        ]:
-            if not _col_exists(conn, "step_state", col):
-                conn.execute(f"ALTER TABLE step_state ADD COLUMN {col} {ddl};")
-
-        for col, ddl in [
-            ("reply_to_message_id", "INTEGER"),
-            ("tech_user_id", "INTEGER"),
-        ]:
-            if not _col_exists(conn, "pending_inputs", col):
-                conn.execute(f"ALTER TABLE pending_inputs ADD COLUMN {col} {ddl};")
 
+
+def archive_finished_cases(older_than: str, limit: int) -> int:
+    """
+    Mueve hasta `limit` casos CLOSED/CANCELLED (finished_at < older_than) con sus pasos, media,
+    textos y contadores a la DB de archivo. Copia y borrado van en transacciones separadas:
+    si el proceso cae en medio, el reintento re-copia (INSERT OR REPLACE) sin perder filas.
+    """
+    with db() as conn:
+        ids = [
+            int(r["case_id"])
+            for r in conn.execute(
+                """
+                SELECT case_id FROM main.cases
+                WHERE status IN ('CLOSED','CANCELLED') AND finished_at IS NOT NULL AND finished_at < ?
+                ORDER BY case_id ASC
+                LIMIT ?
+                """,
+                (older_than, limit),
+            ).fetchall()
+        ]
+        if not ids:
+            return 0
+        marks = ",".join("?" * len(ids))
+
+        for table in ARCHIVE_TABLES:
+            cols = ", ".join(c for c, _t in _table_columns(conn, "main", table))
+            conn.execute(
+                f"INSERT OR REPLACE INTO archive.{table}({cols}) SELECT {cols} FROM main.{table} WHERE case_id IN ({marks})",
+                ids,
+            )
+        conn.commit()
+
+        for table in ARCHIVE_TABLES:
+            conn.execute(f"DELETE FROM main.{table} WHERE case_id IN ({marks})", ids)
         conn.commit()
+        return len(ids)
+
+
+async def archive_cases_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+    total = 0
+    try:
+        while True:
+            moved = await db_write(archive_finished_cases, cutoff, ARCHIVE_BATCH_CASES)
+            total += moved
+            if moved < ARCHIVE_BATCH_CASES:
+                break
+        if total:
+            free_pages = await db_write(db_incremental_vacuum, DB_INCREMENTAL_VACUUM_PAGES)
+            log.info(f"Archivo: {total} casos movidos a {ARCHIVE_DB_PATH}. Páginas libres restantes: {free_pages}.")
+    except Exception as e:
+        log.warning(f"Archivo de casos error: {e}")
+
+
+def init_db(maintenance: bool = DB_MAINTENANCE_ON_START):
+    with db() as conn:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' LIMIT 1").fetchone():
+            # DB nueva: el modo se fija antes de crear tablas (VACUUM de una DB vacía es instantáneo)
+            _ensure_incremental_vacuum(conn)
+        _run_migrations(conn)
+        _run_db_maintenance(conn, allow_vacuum=maintenance)
+        if ARCHIVE_DB_PATH:
+            _ensure_archive_schema(conn)
+            _create_archive_views(conn)
 
 
 def set_approval_required(chat_id: int, required: bool):
@@ -416,32 +955,161 @@ def set_approval_required(chat_id: int, required: bool):
             (chat_id, 1 if required else 0, now_utc()),
         )
         conn.commit()
+    chat_settings_invalidate(chat_id)
 
 
 def get_approval_required(chat_id: int) -> bool:
+    """
+    Sin fila en chat_config = aprobación ON (default).
+    """
     with db() as conn:
         row = conn.execute("SELECT approval_required FROM chat_config WHERE chat_id=?", (chat_id,)).fetchone()
+    if row is None:
+        return True
+    return bool(row["approval_required"])
+
+
+# =========================
+# Cache de casos OPEN (write-through)
+#   key (chat_id, user_id) -> fila del caso abierto (dict) o None si no hay caso abierto.
+#   update_case / create_or_reset_case mantienen la cache coherente; al cerrar/cancelar queda None.
+#   Las lecturas devuelven una copia: quien modifique el dict no corrompe la cache compartida.
+# =========================
+_open_cases: "OrderedDict[Tuple[int, int], Optional[Dict[str, Any]]]" = OrderedDict()
+_open_case_keys: Dict[int, Tuple[int, int]] = {}  # case_id -> (chat_id, user_id)
+_open_cases_lock = threading.Lock()
+_open_cases_gen = 0  # se incrementa en cada escritura; evita cachear lecturas que compiten con un UPDATE
+_open_case_stats = {"hits": 0, "misses": 0}
+
+
+def _open_case_cache_get(chat_id: int, user_id: int) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    key = (int(chat_id), int(user_id))
+    with _open_cases_lock:
+        if key in _open_cases:
+            _open_cases.move_to_end(key)
+            _open_case_stats["hits"] += 1
+            row = _open_cases[key]
+            return True, (dict(row) if row is not None else None)
+    return False, None
+
+
+def _open_case_cache_set_locked(key: Tuple[int, int], row: Optional[Dict[str, Any]]) -> None:
+    prev = _open_cases.pop(key, None)
+    if prev is not None:
+        _open_case_keys.pop(int(prev["case_id"]), None)
+    _open_cases[key] = dict(row) if row is not None else None  # copia propia: el llamador conserva la suya
+    if row is not None:
+        _open_case_keys[int(row["case_id"])] = key
+    while len(_open_cases) > OPEN_CASE_CACHE_MAX:
+        _k, old = _open_cases.popitem(last=False)
+        if old is not None:
+            _open_case_keys.pop(int(old["case_id"]), None)
+
+
+def _open_case_cache_put(chat_id: int, user_id: int, row: Optional[Dict[str, Any]], gen: Optional[int] = None) -> None:
+    """
+    Guarda la fila (o None). Si `gen` no coincide, hubo una escritura concurrente y no se cachea.
+    """
+    global _open_cases_gen
+    with _open_cases_lock:
+        if gen is not None and gen != _open_cases_gen:
+            return
+        if gen is None:
+            _open_cases_gen += 1
+        _open_case_cache_set_locked((int(chat_id), int(user_id)), row)
+
+
+def _open_case_cache_patch(case_id: int, fields: Dict[str, Any]) -> None:
+    """
+    Aplica un UPDATE ya confirmado en SQLite sobre la fila cacheada (si existe).
+    """
+    global _open_cases_gen
+    with _open_cases_lock:
+        _open_cases_gen += 1
+        key = _open_case_keys.get(int(case_id))
+        if key is None:
+            return
+        row = dict(_open_cases[key])
+        row.update(fields)
+        _open_case_cache_set_locked(key, row if row["status"] == "OPEN" else None)
+
+
+def _open_case_cache_by_id(case_id: int) -> Optional[Dict[str, Any]]:
+    with _open_cases_lock:
+        key = _open_case_keys.get(int(case_id))
+        row = _open_cases.get(key) if key is not None else None
         if row is None:
-            conn.execute(
-                "INSERT OR IGNORE INTO chat_config(chat_id, approval_required, updated_at) VALUES(?,?,?)",
-                (chat_id, 1, now_utc()),
-            )
-            conn.commit()
-            return True
-        return bool(row["approval_required"])
+            _open_case_stats["misses"] += 1
+            return None
+        _open_case_stats["hits"] += 1
+        return dict(row)
+
+
+def open_case_cache_stats() -> Dict[str, int]:
+    with _open_cases_lock:
+        return {
+            "hits": _open_case_stats["hits"],
+            "misses": _open_case_stats["misses"],
+            "size": len(_open_cases),
+        }
 
 
-def get_open_case(chat_id: int, user_id: int) -> Optional[sqlite3.Row]:
+def _fetch_case(conn: sqlite3.Connection, case_id: int) -> Optional[Dict[str, Any]]:
+    row = conn.execute("SELECT * FROM cases WHERE case_id=?", (case_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def get_open_case(chat_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+    hit, row = _open_case_cache_get(chat_id, user_id)
+    if hit:
+        return row
+    with _open_cases_lock:
+        _open_case_stats["misses"] += 1
+        gen = _open_cases_gen
     with db() as conn:
-        return conn.execute(
+        r = conn.execute(
             "SELECT * FROM cases WHERE chat_id=? AND user_id=? AND status='OPEN' ORDER BY case_id DESC LIMIT 1",
             (chat_id, user_id),
         ).fetchone()
+    row = dict(r) if r else None
+    _open_case_cache_put(chat_id, user_id, row, gen=gen)
+    return row
 
 
-def get_case(case_id: int) -> Optional[sqlite3.Row]:
+def _get_case_db(case_id: int) -> Optional[Dict[str, Any]]:
     with db() as conn:
-        return conn.execute("SELECT * FROM cases WHERE case_id=?", (case_id,)).fetchone()
+        return _fetch_case(conn, case_id)
+
+
+def get_case(case_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Caso por id, solo en la DB principal: un caso ya movido al archivo frío (CLOSED/CANCELLED
+    con más de ARCHIVE_AFTER_DAYS días) devuelve None, igual que uno inexistente. Es a propósito:
+    los handlers que lo llaman (revisión, botones viejos) modifican el caso y no deben tocar
+    el archivo. Para consultas históricas están las vistas cases_all / step_state_all / media_all.
+    """
+    row = _open_case_cache_by_id(case_id)
+    if row is not None:
+        return row
+    return _get_case_db(case_id)
+
+
+async def aget_open_case(chat_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Hit de cache: se resuelve en el event loop sin saltar al executor.
+    """
+    hit, row = _open_case_cache_get(chat_id, user_id)
+    if hit:
+        return row
+    return await db_read(get_open_case, chat_id, user_id)
+
+
+async def aget_case(case_id: int) -> Optional[Dict[str, Any]]:
+    """Versión async de get_case (casos archivados -> None)."""
+    row = _open_case_cache_by_id(case_id)
+    if row is not None:
+        return row
+    return await db_read(_get_case_db, case_id)
 
 
 def update_case(case_id: int, **fields):
@@ -453,9 +1121,10 @@ def update_case(case_id: int, **fields):
     with db() as conn:
         conn.execute(f"UPDATE cases SET {sets} WHERE case_id=?", (*vals, case_id))
         conn.commit()
+    _open_case_cache_patch(case_id, fields)
 
 
-def create_or_reset_case(chat_id: int, user_id: int, username: str) -> sqlite3.Row:
+def create_or_reset_case(chat_id: int, user_id: int, username: str) -> Dict[str, Any]:
     with db() as conn:
         row = conn.execute(
             "SELECT * FROM cases WHERE chat_id=? AND user_id=? AND status='OPEN' ORDER BY case_id DESC LIMIT 1",
@@ -484,18 +1153,21 @@ def create_or_reset_case(chat_id: int, user_id: int, username: str) -> sqlite3.R
                 (now_utc(), row["case_id"]),
             )
             conn.commit()
-            return get_case(int(row["case_id"]))
+            case_id = int(row["case_id"])
+        else:
+            cur = conn.execute(
+                """
+                INSERT INTO cases(chat_id, user_id, username, created_at, finished_at, status, step_index, phase, pending_step_no)
+                VALUES(?,?,?,?,NULL,'OPEN',0,'WAIT_TECHNICIAN',NULL)
+                """,
+                (chat_id, user_id, username, now_utc()),
+            )
+            conn.commit()
+            case_id = int(cur.lastrowid)
 
-        conn.execute(
-            """
-            INSERT INTO cases(chat_id, user_id, username, created_at, finished_at, status, step_index, phase, pending_step_no)
-            VALUES(?,?,?,?,NULL,'OPEN',0,'WAIT_TECHNICIAN',NULL)
-            """,
-            (chat_id, user_id, username, now_utc()),
-        )
-        conn.commit()
-        new_id = conn.execute("SELECT last_insert_rowid() AS id").fetchone()["id"]
-        return get_case(int(new_id))
+        case_row = _fetch_case(conn, case_id)
+    _open_case_cache_put(chat_id, user_id, case_row)
+    return case_row
 
 # =========================
 # Routing (Sheets cache + fallback)
@@ -512,7 +1184,26 @@ def _safe_int(v: Any) -> Optional[int]:
         return None
 
 
-def get_route_for_chat_cached(application: Application, origin_chat_id: int) -> Dict[str, Optional[int]]:
+_routing_json_map: Optional[Dict[str, Any]] = None
+
+
+def _get_routing_json_map() -> Dict[str, Any]:
+    """
+    ROUTING_JSON se parsea una sola vez por proceso.
+    """
+    global _routing_json_map
+    if _routing_json_map is None:
+        mapping: Dict[str, Any] = {}
+        if ROUTING_JSON:
+            try:
+                mapping = json.loads(ROUTING_JSON)
+            except Exception as e:
+                log.warning(f"ROUTING_JSON inválido: {e}")
+        _routing_json_map = mapping
+    return _routing_json_map
+
+
+def _resolve_routes(application: Application, origin_chat_id: int) -> Dict[str, Any]:
     """
     Ruta principal: cache de ROUTING en Sheets.
     Fallback opcional: ROUTING_JSON.
@@ -524,22 +1215,62 @@ def get_route_for_chat_cached(application: Application, origin_chat_id: int) ->
             return {
                 "evidence": _safe_int(row.get("evidence_chat_id")),
                 "summary": _safe_int(row.get("summary_chat_id")),
+                "alias": _safe_str(row.get("alias")),
             }
     except Exception:
         pass
 
     # Fallback a variable (migración / emergencia)
-    if ROUTING_JSON:
-        try:
-            mapping = json.loads(ROUTING_JSON)
-            cfg = mapping.get(str(origin_chat_id)) or {}
-            ev = cfg.get("evidence")
-            sm = cfg.get("summary")
-            return {"evidence": int(ev) if ev else None, "summary": int(sm) if sm else None}
-        except Exception as e:
-            log.warning(f"ROUTING_JSON inválido: {e}")
+    try:
+        cfg = _get_routing_json_map().get(str(origin_chat_id)) or {}
+        ev = cfg.get("evidence")
+        sm = cfg.get("summary")
+        return {"evidence": int(ev) if ev else None, "summary": int(sm) if sm else None, "alias": ""}
+    except Exception as e:
+        log.warning(f"ROUTING_JSON inválido para {origin_chat_id}: {e}")
+
+    return {"evidence": None, "summary": None, "alias": ""}
+
+# =========================
+# Settings por chat (cache)
+#   {chat_id: {"approval_required", "evidence", "summary", "alias"}}
+#   Se invalida en set_approval_required (ese chat) y en load_routing_cache (todos).
+# =========================
+_chat_settings: Dict[int, Dict[str, Any]] = {}
+_chat_settings_lock = threading.Lock()
+_chat_settings_gen = 0
+
+
+def chat_settings_invalidate(chat_id: Optional[int] = None) -> None:
+    global _chat_settings_gen
+    with _chat_settings_lock:
+        _chat_settings_gen += 1
+        if chat_id is None:
+            _chat_settings.clear()
+        else:
+            _chat_settings.pop(int(chat_id), None)
+
+
+def get_chat_settings(application: Application, chat_id: int) -> Dict[str, Any]:
+    with _chat_settings_lock:
+        hit = _chat_settings.get(int(chat_id))
+        if hit is not None:
+            return hit
+        gen = _chat_settings_gen
+    settings = {"approval_required": get_approval_required(chat_id)}
+    settings.update(_resolve_routes(application, chat_id))
+    with _chat_settings_lock:
+        if gen == _chat_settings_gen:
+            _chat_settings[int(chat_id)] = settings
+    return settings
 
-    return {"evidence": None, "summary": None}
+
+async def aget_chat_settings(application: Application, chat_id: int) -> Dict[str, Any]:
+    with _chat_settings_lock:
+        hit = _chat_settings.get(int(chat_id))
+    if hit is not None:
+        return hit
+    return await db_read(get_chat_settings, application, chat_id)
 
 
 async def maybe_copy_to_group(
@@ -600,15 +1331,11 @@ def ensure_step_state(case_id: int, step_no: int) -> sqlite3.Row:
         ).fetchone()
 
 
-def get_latest_submitted_state(case_id: int, step_no: int) -> Optional[sqlite3.Row]:
+def get_step_state(case_id: int, step_no: int, attempt: int) -> Optional[sqlite3.Row]:
     with db() as conn:
         return conn.execute(
-            """
-            SELECT * FROM step_state
-            WHERE case_id=? AND step_no=? AND submitted=1
-            ORDER BY attempt DESC LIMIT 1
-            """,
-            (case_id, step_no),
+            "SELECT * FROM step_state WHERE case_id=? AND step_no=? AND attempt=?",
+            (case_id, step_no, attempt),
         ).fetchone()
 
 
@@ -630,31 +1357,66 @@ def media_message_ids(case_id: int, step_no: int, attempt: int) -> List[int]:
         return [int(r["tg_message_id"]) for r in rows] if rows else []
 
 
-def total_media_for_case(case_id: int) -> int:
-    with db() as conn:
-        row = conn.execute(
-            "SELECT COUNT(*) AS c FROM media WHERE case_id=? AND step_no > 0",
-            (case_id,),
-        ).fetchone()
-        return int(row["c"] or 0)
+def _case_stats_bump(conn: sqlite3.Connection, case_id: int, approved: int = 0, rejected: int = 0, media: int = 0) -> None:
+    """
+    Ajusta los contadores del caso. Se llama dentro de la misma transacción que el cambio de media/step_state.
+    """
+    if not (approved or rejected or media):
+        return
+    conn.execute(
+        """
+        INSERT INTO case_stats(case_id, approved_steps, rejected_steps, total_media)
+        VALUES(?,?,?,?)
+        ON CONFLICT(case_id) DO UPDATE
+          SET approved_steps=approved_steps+excluded.approved_steps,
+              rejected_steps=rejected_steps+excluded.rejected_steps,
+              total_media=total_media+excluded.total_media
+        """,
+        (case_id, approved, rejected, media),
+    )
 
 
-def total_rejects_for_case(case_id: int) -> int:
-    with db() as conn:
-        row = conn.execute(
-            "SELECT COUNT(*) AS c FROM step_state WHERE case_id=? AND step_no > 0 AND approved=0",
-            (case_id,),
-        ).fetchone()
-        return int(row["c"] or 0)
+def _set_step_approved(conn: sqlite3.Connection, case_id: int, step_no: int, attempt: int, approved: int, sets_sql: str, params: Tuple[Any, ...]) -> None:
+    """
+    UPDATE de step_state.approved + delta en case_stats (solo pasos reales, step_no > 0).
+    """
+    prev = conn.execute(
+        "SELECT approved FROM step_state WHERE case_id=? AND step_no=? AND attempt=?",
+        (case_id, step_no, attempt),
+    ).fetchone()
+    conn.execute(
+        f"UPDATE step_state SET {sets_sql} WHERE case_id=? AND step_no=? AND attempt=?",
+        (*params, case_id, step_no, attempt),
+    )
+    if prev is None or step_no <= 0:
+        return
+    d_ok = 0
+    d_bad = 0
+    if prev["approved"] is not None:
+        if int(prev["approved"]) == 1:
+            d_ok -= 1
+        else:
+            d_bad -= 1
+    if int(approved) == 1:
+        d_ok += 1
+    else:
+        d_bad += 1
+    _case_stats_bump(conn, case_id, approved=d_ok, rejected=d_bad)
 
 
-def total_approved_steps_for_case(case_id: int) -> int:
+def get_case_stats(case_id: int) -> Dict[str, int]:
     with db() as conn:
         row = conn.execute(
-            "SELECT COUNT(*) AS c FROM step_state WHERE case_id=? AND step_no > 0 AND approved=1",
+            "SELECT approved_steps, rejected_steps, total_media FROM case_stats WHERE case_id=?",
             (case_id,),
         ).fetchone()
-        return int(row["c"] or 0)
+    if not row:
+        return {"approved_steps": 0, "rejected_steps": 0, "total_media": 0}
+    return {
+        "approved_steps": int(row["approved_steps"]),
+        "rejected_steps": int(row["rejected_steps"]),
+        "total_media": int(row["total_media"]),
+    }
 
 
 def add_media(
@@ -685,6 +1447,8 @@ def add_media(
                 now_utc(),
             ),
         )
+        if step_no > 0:
+            _case_stats_bump(conn, case_id, media=1)
         conn.commit()
 
 
@@ -699,13 +1463,10 @@ def mark_submitted(case_id: int, step_no: int, attempt: int):
 
 def set_review(case_id: int, step_no: int, attempt: int, approved: int, reviewer_id: int):
     with db() as conn:
-        conn.execute(
-            """
-            UPDATE step_state
-            SET approved=?, reviewed_by=?, reviewed_at=?
-            WHERE case_id=? AND step_no=? AND attempt=?
-            """,
-            (approved, reviewer_id, now_utc(), case_id, step_no, attempt),
+        _set_step_approved(
+            conn, case_id, step_no, attempt, approved,
+            "approved=?, reviewed_by=?, reviewed_at=?",
+            (approved, reviewer_id, now_utc()),
         )
         conn.commit()
 
@@ -738,55 +1499,181 @@ def save_auth_text(case_id: int, auth_step_no: int, attempt: int, text: str, tg_
         conn.commit()
 
 
-def set_pending_input(
-    chat_id: int,
-    user_id: int,
-    kind: str,
-    case_id: int,
-    step_no: int,
-    attempt: int,
-    reply_to_message_id: Optional[int] = None,
-    tech_user_id: Optional[int] = None,
-):
-    with db() as conn:
-        conn.execute("DELETE FROM pending_inputs WHERE chat_id=? AND user_id=? AND kind=?", (chat_id, user_id, kind))
-        conn.execute(
+# =========================
+# Pending inputs (texto esperado por usuario)
+#   Estado en memoria {(chat_id, user_id): {kind: fila}} con write-through a pending_inputs.
+#   Un mensaje de texto sin pendientes cuesta un dict lookup; SQLite solo se toca al crear/consumir.
+# =========================
+PENDING_TEXT_KINDS = ["PAIR_CODE_EVID", "PAIR_CODE_SUM", "AUTH_REJECT_REASON", "EVID_REJECT_REASON"]
+
+_pending: Dict[Tuple[int, int], Dict[str, Dict[str, Any]]] = {}
+_pending_lock = threading.Lock()
+
+
+def _pending_expired(entry: Dict[str, Any], now_dt: datetime) -> bool:
+    created = parse_iso(entry.get("created_at") or "")
+    return created is None or now_dt - created > timedelta(minutes=PENDING_INPUT_TTL_MIN)
+
+
+def load_pending_inputs() -> None:
+    """
+    Carga pending_inputs vigentes a memoria (al arrancar) y borra los vencidos.
+    """
+    now_dt = datetime.now(timezone.utc)
+    expired: List[int] = []
+    loaded: Dict[Tuple[int, int], Dict[str, Dict[str, Any]]] = {}
+    with db() as conn:
+        for r in conn.execute("SELECT * FROM pending_inputs ORDER BY pending_id ASC").fetchall():
+            entry = dict(r)
+            if _pending_expired(entry, now_dt):
+                expired.append(int(entry["pending_id"]))
+                continue
+            loaded.setdefault((int(entry["chat_id"]), int(entry["user_id"])), {})[entry["kind"]] = entry
+        if expired:
+            delete_pending_inputs(expired)
+    with _pending_lock:
+        _pending.clear()
+        _pending.update(loaded)
+    log.info(f"Pending inputs cargados: {sum(len(v) for v in loaded.values())} (vencidos borrados: {len(expired)}).")
+
+
+def set_pending_input(
+    chat_id: int,
+    user_id: int,
+    kind: str,
+    case_id: int,
+    step_no: int,
+    attempt: int,
+    reply_to_message_id: Optional[int] = None,
+    tech_user_id: Optional[int] = None,
+):
+    created_at = now_utc()
+    with db() as conn:
+        conn.execute("DELETE FROM pending_inputs WHERE chat_id=? AND user_id=? AND kind=?", (chat_id, user_id, kind))
+        cur = conn.execute(
             """
             INSERT INTO pending_inputs(chat_id, user_id, kind, case_id, step_no, attempt, created_at, reply_to_message_id, tech_user_id)
             VALUES(?,?,?,?,?,?,?,?,?)
             """,
-            (chat_id, user_id, kind, case_id, step_no, attempt, now_utc(), reply_to_message_id, tech_user_id),
+            (chat_id, user_id, kind, case_id, step_no, attempt, created_at, reply_to_message_id, tech_user_id),
         )
         conn.commit()
+    entry = {
+        "pending_id": int(cur.lastrowid),
+        "chat_id": chat_id,
+        "user_id": user_id,
+        "kind": kind,
+        "case_id": case_id,
+        "step_no": step_no,
+        "attempt": attempt,
+        "created_at": created_at,
+        "reply_to_message_id": reply_to_message_id,
+        "tech_user_id": tech_user_id,
+    }
+    with _pending_lock:
+        _pending.setdefault((int(chat_id), int(user_id)), {})[kind] = entry
 
 
-def pop_pending_input(chat_id: int, user_id: int, kind: str) -> Optional[sqlite3.Row]:
+def delete_pending_inputs(pending_ids: List[int]) -> None:
+    if not pending_ids:
+        return
     with db() as conn:
-        row = conn.execute(
-            "SELECT * FROM pending_inputs WHERE chat_id=? AND user_id=? AND kind=? ORDER BY pending_id DESC LIMIT 1",
-            (chat_id, user_id, kind),
-        ).fetchone()
-        if row:
-            conn.execute("DELETE FROM pending_inputs WHERE pending_id=?", (row["pending_id"],))
-            conn.commit()
-        return row
+        conn.executemany("DELETE FROM pending_inputs WHERE pending_id=?", [(int(i),) for i in pending_ids])
+        conn.commit()
+
+
+def _pending_take(chat_id: int, user_id: int, kinds: List[str]) -> Tuple[Optional[Dict[str, Any]], List[int]]:
+    """
+    Saca de memoria el primer pendiente vigente según el orden de `kinds`.
+    Retorna (fila o None, pending_ids a borrar en SQLite: la consumida + vencidas).
+    """
+    key = (int(chat_id), int(user_id))
+    with _pending_lock:
+        by_kind = _pending.get(key)
+        if not by_kind:
+            return None, []
+        now_dt = datetime.now(timezone.utc)
+        to_delete: List[int] = []
+        found: Optional[Dict[str, Any]] = None
+        for kind in kinds:
+            entry = by_kind.get(kind)
+            if entry is None:
+                continue
+            del by_kind[kind]
+            to_delete.append(int(entry["pending_id"]))
+            if _pending_expired(entry, now_dt):
+                continue
+            found = entry
+            break
+        if not by_kind:
+            del _pending[key]
+        return found, to_delete
+
+
+async def apop_pending_input(chat_id: int, user_id: int, kinds: List[str]) -> Optional[Dict[str, Any]]:
+    entry, to_delete = _pending_take(chat_id, user_id, kinds)
+    if to_delete:
+        await db_write(delete_pending_inputs, to_delete)
+    return entry
 
 # =========================
 # Outbox helpers (Google Sheets - historial)
 # =========================
+def _merge_patch(base: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Combina un PATCH sobre otro (o sobre una fila completa): columnas nuevas ganan,
+    "_if_empty" se une (la primera sugerencia se conserva).
+    """
+    out = dict(base)
+    if_empty = {**(patch.get("_if_empty") or {}), **(base.get("_if_empty") or {})}
+    out.update({k: v for k, v in patch.items() if k != "_if_empty"})
+    if if_empty:
+        out["_if_empty"] = if_empty
+    return out
+
+
+def _resolve_if_empty(row: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fila completa (UPSERT): "_if_empty" se resuelve contra la propia fila; llena las columnas
+    ausentes o vacías y desaparece (row_to_values lo ignoraría).
+    """
+    if "_if_empty" not in row:
+        return row
+    out = {k: v for k, v in row.items() if k != "_if_empty"}
+    for k, v in (row.get("_if_empty") or {}).items():
+        if not _safe_str(out.get(k)):
+            out[k] = v
+    return out
+
+
 def outbox_enqueue(sheet_name: str, op_type: str, dedupe_key: str, row: Dict[str, Any]):
+    """
+    op_type:
+      UPSERT -> fila completa (reemplaza la versión pendiente)
+      PATCH  -> solo columnas {header: valor} (+ "_if_empty": {header: valor} si la celda está vacía);
+                se combina con lo pendiente de la misma clave para no perder columnas
+    """
     now = now_utc()
-    row_json = json.dumps(row, ensure_ascii=False)
     with db() as conn:
         existing = conn.execute(
             """
-            SELECT outbox_id, status FROM sheet_outbox
+            SELECT outbox_id, status, op_type, row_json FROM sheet_outbox
             WHERE sheet_name=? AND dedupe_key=? AND status IN ('PENDING','FAILED')
             ORDER BY outbox_id DESC LIMIT 1
             """,
             (sheet_name, dedupe_key),
         ).fetchone()
 
+        if existing and op_type == "PATCH":
+            try:
+                row = _merge_patch(json.loads(existing["row_json"]), row)
+                op_type = existing["op_type"]  # PATCH sobre UPSERT pendiente sigue siendo UPSERT
+                if op_type != "PATCH":
+                    row = _resolve_if_empty(row)
+            except Exception:
+                pass
+        row_json = json.dumps(row, ensure_ascii=False)
+
         if existing:
             conn.execute(
                 """
@@ -805,29 +1692,172 @@ def outbox_enqueue(sheet_name: str, op_type: str, dedupe_key: str, row: Dict[str
                 (sheet_name, op_type, dedupe_key, row_json, now),
             )
         conn.commit()
+    outbox_notify(sheet_name)
 
 
-def outbox_fetch_batch(limit: int = 20) -> List[sqlite3.Row]:
+# Despertador de carriles: outbox_enqueue corre en el hilo escritor, los carriles en el event loop
+_outbox_wakeup: Dict[str, Any] = {"loop": None, "events": {}}
+
+
+def outbox_notify(sheet_name: str) -> None:
+    loop = _outbox_wakeup["loop"]
+    event = _outbox_wakeup["events"].get(sheet_name)
+    if loop is None or event is None:
+        return
+    try:
+        loop.call_soon_threadsafe(event.set)
+    except RuntimeError:
+        pass  # loop cerrado (apagado)
+
+
+def outbox_next_due_sec(sheet_name: str) -> Optional[float]:
+    """
+    Segundos hasta la próxima fila enviable de la hoja: 0 si hay PENDING/FAILED vencidas, None si no hay nada vivo.
+    Las filas IN_FLIGHT cuentan hasta su lease_until (recuperación si su worker cayó).
+    """
+    with db() as conn:
+        r = conn.execute(
+            """
+            SELECT COUNT(*) AS n, MIN(COALESCE(next_retry_at, '')) AS due
+            FROM sheet_outbox WHERE sheet_name=? AND status IN ('PENDING','FAILED')
+            """,
+            (sheet_name,),
+        ).fetchone()
+        lease = conn.execute(
+            "SELECT MIN(lease_until) AS due FROM sheet_outbox WHERE sheet_name=? AND status='IN_FLIGHT'",
+            (sheet_name,),
+        ).fetchone()
+    dues = []
+    if r and int(r["n"]):
+        dues.append(r["due"] or "")
+    if lease and lease["due"]:
+        dues.append(lease["due"])
+    if not dues:
+        return None
+    due = min(dues)
+    dt = parse_iso(due) if due else None
+    if dt is None:
+        return 0.0
+    return max(0.0, (dt - datetime.now(timezone.utc)).total_seconds())
+
+
+def outbox_claim_batch(limit: int, sheet_name: str, owner: str) -> List[sqlite3.Row]:
+    """
+    Reclama atómicamente hasta `limit` filas enviables de la hoja: pasan a IN_FLIGHT con
+    lease_owner/lease_until. También recupera IN_FLIGHT con lease vencido (worker caído).
+    No reclama una clave que otro worker tiene en vuelo (evita append duplicado).
+    """
     now = now_utc()
+    lease_until = (datetime.now(timezone.utc) + timedelta(seconds=OUTBOX_LEASE_SEC)).isoformat()
+    with db() as conn:
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            ids = [
+                int(r["outbox_id"])
+                for r in conn.execute(
+                    """
+                    SELECT o.outbox_id FROM sheet_outbox o
+                    WHERE o.sheet_name=?
+                      AND (
+                        (o.status IN ('PENDING','FAILED') AND (o.next_retry_at IS NULL OR o.next_retry_at <= ?))
+                        OR (o.status='IN_FLIGHT' AND o.lease_until < ?)
+                      )
+                      AND NOT EXISTS (
+                        SELECT 1 FROM sheet_outbox f
+                        WHERE f.status='IN_FLIGHT' AND f.sheet_name=o.sheet_name AND f.dedupe_key=o.dedupe_key
+                          AND f.lease_until >= ? AND f.outbox_id<>o.outbox_id
+                      )
+                    ORDER BY o.created_at ASC
+                    LIMIT ?
+                    """,
+                    (sheet_name, now, now, now, limit),
+                ).fetchall()
+            ]
+            if not ids:
+                conn.commit()
+                return []
+            marks = ",".join("?" * len(ids))
+            conn.execute(
+                f"UPDATE sheet_outbox SET status='IN_FLIGHT', lease_owner=?, lease_until=? WHERE outbox_id IN ({marks})",
+                (owner, lease_until, *ids),
+            )
+            rows = conn.execute(
+                f"SELECT * FROM sheet_outbox WHERE outbox_id IN ({marks}) ORDER BY created_at ASC", ids
+            ).fetchall()
+            conn.commit()
+            return rows
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def outbox_live_rows(sheet_name: str) -> List[Dict[str, Any]]:
+    """
+    row_json de filas aún no escritas en la hoja (PENDING/FAILED/IN_FLIGHT), en orden.
+    """
     with db() as conn:
         rows = conn.execute(
             """
-            SELECT * FROM sheet_outbox
-            WHERE status IN ('PENDING','FAILED')
-              AND (next_retry_at IS NULL OR next_retry_at <= ?)
+            SELECT row_json FROM sheet_outbox
+            WHERE sheet_name=? AND status IN ('PENDING','FAILED','IN_FLIGHT')
             ORDER BY created_at ASC
-            LIMIT ?
             """,
-            (now, limit),
+            (sheet_name,),
         ).fetchall()
-        return rows
+    out: List[Dict[str, Any]] = []
+    for r in rows:
+        try:
+            out.append(json.loads(r["row_json"]))
+        except Exception:
+            continue
+    return out
 
 
-def outbox_mark_sent(outbox_id: int):
+def outbox_release_leases(owner: str) -> int:
+    """
+    Devuelve a la cola las filas IN_FLIGHT de `owner` (arranque tras caída de este mismo worker).
+    """
     with db() as conn:
-        conn.execute(
-            "UPDATE sheet_outbox SET status='SENT', updated_at=? WHERE outbox_id=?",
-            (now_utc(), outbox_id),
+        cur = conn.execute(
+            """
+            UPDATE sheet_outbox
+            SET status=CASE WHEN attempts > 0 THEN 'FAILED' ELSE 'PENDING' END, lease_owner=NULL, lease_until=NULL
+            WHERE status='IN_FLIGHT' AND lease_owner=?
+            """,
+            (owner,),
+        )
+        conn.commit()
+        return cur.rowcount
+
+
+def outbox_fail_unknown_sheets(known: List[str]) -> int:
+    """
+    Filas vivas cuyo sheet_name no tiene carril: nunca se enviarían, pasan a DEAD.
+    """
+    marks = ",".join("?" * len(known))
+    with db() as conn:
+        cur = conn.execute(
+            f"""
+            UPDATE sheet_outbox SET status='DEAD', last_error='Hoja desconocida', updated_at=?
+            WHERE status IN ('PENDING','FAILED') AND sheet_name NOT IN ({marks})
+            """,
+            (now_utc(), *known),
+        )
+        conn.commit()
+        return cur.rowcount
+
+
+def outbox_mark_sent(outbox_ids: List[int], owner: str):
+    if not outbox_ids:
+        return
+    now = now_utc()
+    with db() as conn:
+        conn.executemany(
+            """
+            UPDATE sheet_outbox SET status='SENT', lease_owner=NULL, lease_until=NULL, updated_at=?
+            WHERE outbox_id=? AND status='IN_FLIGHT' AND lease_owner=?
+            """,
+            [(now, int(i), owner) for i in outbox_ids],
         )
         conn.commit()
 
@@ -839,20 +1869,185 @@ def _next_retry_time(attempts: int) -> str:
     return dt.isoformat()
 
 
-def outbox_mark_failed(outbox_id: int, attempts: int, err: str, dead: bool = False):
+def outbox_mark_failed(
+    outbox_id: int,
+    attempts: int,
+    err: str,
+    dead: bool = False,
+    retry_at: Optional[str] = None,
+    owner: Optional[str] = None,
+):
+    """
+    owner: si se indica, solo actualiza si la fila sigue en vuelo con nuestro lease.
+    """
     status = "DEAD" if dead else "FAILED"
-    next_retry_at = None if dead else _next_retry_time(attempts)
+    next_retry_at = None if dead else (retry_at or _next_retry_time(attempts))
+    lease_sql = " AND status='IN_FLIGHT' AND lease_owner=?" if owner else ""
     with db() as conn:
         conn.execute(
-            """
+            f"""
             UPDATE sheet_outbox
-            SET status=?, attempts=?, last_error=?, next_retry_at=?, updated_at=?
-            WHERE outbox_id=?
+            SET status=?, attempts=?, last_error=?, next_retry_at=?, lease_owner=NULL, lease_until=NULL, updated_at=?
+            WHERE outbox_id=?{lease_sql}
             """,
-            (status, attempts, err[:500], next_retry_at, now_utc(), outbox_id),
+            (status, attempts, err[:500], next_retry_at, now_utc(), outbox_id, *([owner] if owner else [])),
         )
         conn.commit()
 
+
+def outbox_archive_done(older_than: str, limit: int) -> int:
+    """
+    Mueve hasta `limit` filas terminadas SENT/DEAD (updated_at < older_than) a sheet_outbox_archive,
+    recorriendo idx_outbox_done. Retorna cuántas movió; lotes cortos para no retener el hilo escritor.
+    """
+    with db() as conn:
+        ids = [
+            int(r["outbox_id"])
+            for r in conn.execute(
+                """
+                SELECT outbox_id FROM sheet_outbox
+                WHERE status IN ('SENT','DEAD') AND updated_at < ?
+                ORDER BY updated_at ASC
+                LIMIT ?
+                """,
+                (older_than, limit),
+            ).fetchall()
+        ]
+        if not ids:
+            return 0
+        marks = ",".join("?" * len(ids))
+        conn.execute(
+            f"""
+            INSERT OR REPLACE INTO sheet_outbox_archive(
+                outbox_id, sheet_name, op_type, dedupe_key, row_json, status, attempts, last_error, created_at, updated_at, archived_at
+            )
+            SELECT outbox_id, sheet_name, op_type, dedupe_key, row_json, status, attempts, last_error, created_at, updated_at, ?
+            FROM sheet_outbox WHERE outbox_id IN ({marks})
+            """,
+            (now_utc(), *ids),
+        )
+        conn.execute(f"DELETE FROM sheet_outbox WHERE outbox_id IN ({marks})", ids)
+        conn.commit()
+        return len(ids)
+
+
+def db_incremental_vacuum(max_pages: int) -> int:
+    """
+    Libera hasta `max_pages` páginas del freelist. Retorna las páginas libres restantes.
+    """
+    with db() as conn:
+        conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)});").fetchall()
+        return int(conn.execute("PRAGMA freelist_count;").fetchone()[0])
+
+
+async def outbox_retention_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Job: archiva filas SENT/DEAD antiguas y compacta la DB, para que sheet_outbox solo tenga trabajo vivo.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=OUTBOX_RETENTION_DAYS)).isoformat()
+    total = 0
+    try:
+        while True:
+            moved = await db_write(outbox_archive_done, cutoff, OUTBOX_RETENTION_BATCH)
+            total += moved
+            if moved < OUTBOX_RETENTION_BATCH:
+                break
+        await db_write(pairing_codes_purge, cutoff)
+        free_pages = await db_write(db_incremental_vacuum, DB_INCREMENTAL_VACUUM_PAGES)
+        if total:
+            log.info(f"Outbox retención: {total} filas SENT/DEAD archivadas. Páginas libres restantes: {free_pages}.")
+    except Exception as e:
+        log.warning(f"Outbox retención error: {e}")
+
+# =========================
+# Sheet row index (persistente en SQLite)
+#   - dedupe_key -> fila de Sheets; se consulta por clave antes de cada flush
+#   - sheet_upsert_batch lo mantiene (appends nuevos)
+#   - sheet_index_verify_job lo siembra y corrige drift (ediciones/orden manual)
+#   - hojas append_only (EVIDENCIAS) no usan índice
+# =========================
+def sheet_row_index_get(sheet_name: str, keys: List[str]) -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    uniq = list(dict.fromkeys(keys))
+    with db() as conn:
+        for i in range(0, len(uniq), 500):
+            chunk = uniq[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            for r in conn.execute(
+                f"SELECT dedupe_key, row_no FROM sheet_row_index WHERE sheet_name=? AND dedupe_key IN ({marks})",
+                (sheet_name, *chunk),
+            ).fetchall():
+                out[r["dedupe_key"]] = int(r["row_no"])
+    return out
+
+
+def sheet_row_index_put(sheet_name: str, entries: Dict[str, int]) -> None:
+    if not entries:
+        return
+    now = now_utc()
+    with db() as conn:
+        conn.executemany(
+            """
+            INSERT INTO sheet_row_index(sheet_name, dedupe_key, row_no, updated_at) VALUES(?,?,?,?)
+            ON CONFLICT(sheet_name, dedupe_key) DO UPDATE SET row_no=excluded.row_no, updated_at=excluded.updated_at
+            """,
+            [(sheet_name, k, int(r), now) for k, r in entries.items()],
+        )
+        conn.commit()
+
+
+def sheet_row_index_sync(sheet_name: str, index: Dict[str, int]) -> Tuple[int, int]:
+    """
+    Deja sheet_row_index igual a `index` (leído de la hoja). Retorna (cambiadas, eliminadas).
+    """
+    now = now_utc()
+    with db() as conn:
+        current = {
+            r["dedupe_key"]: int(r["row_no"])
+            for r in conn.execute(
+                "SELECT dedupe_key, row_no FROM sheet_row_index WHERE sheet_name=?", (sheet_name,)
+            ).fetchall()
+        }
+        changed = [(sheet_name, k, int(r), now) for k, r in index.items() if current.get(k) != r]
+        removed = [(sheet_name, k) for k in current if k not in index]
+        if changed:
+            conn.executemany(
+                """
+                INSERT INTO sheet_row_index(sheet_name, dedupe_key, row_no, updated_at) VALUES(?,?,?,?)
+                ON CONFLICT(sheet_name, dedupe_key) DO UPDATE SET row_no=excluded.row_no, updated_at=excluded.updated_at
+                """,
+                changed,
+            )
+        if removed:
+            conn.executemany("DELETE FROM sheet_row_index WHERE sheet_name=? AND dedupe_key=?", removed)
+        conn.execute(
+            """
+            INSERT INTO sheet_index_meta(sheet_name, verified_at, row_count) VALUES(?,?,?)
+            ON CONFLICT(sheet_name) DO UPDATE SET verified_at=excluded.verified_at, row_count=excluded.row_count
+            """,
+            (sheet_name, now, len(index)),
+        )
+        conn.commit()
+        return len(changed), len(removed)
+
+
+def sheet_index_seeded_sheets() -> set:
+    with db() as conn:
+        return {r["sheet_name"] for r in conn.execute("SELECT sheet_name FROM sheet_index_meta").fetchall()}
+
+
+_sheet_locks: Dict[str, asyncio.Lock] = {}
+
+
+def _sheet_lock(sheet_name: str) -> asyncio.Lock:
+    """
+    Serializa flush del worker y verificación del índice por hoja (sin carreras de fila).
+    """
+    lock = _sheet_locks.get(sheet_name)
+    if lock is None:
+        lock = _sheet_locks.setdefault(sheet_name, asyncio.Lock())
+    return lock
+
 # =========================
 # Google Sheets helpers
 # =========================
@@ -873,41 +2068,362 @@ def sheets_client():
         creds = Credentials.from_service_account_file(GOOGLE_CREDS_JSON, scopes=scopes)
 
     gc = gspread.authorize(creds)
+    try:
+        # Sin timeout HTTP un hilo del gateway puede quedar colgado indefinidamente
+        gc.set_timeout(SHEETS_HTTP_TIMEOUT_SEC)
+    except Exception:
+        pass
+    _install_sheets_limiter(gc)
     sh = gc.open_by_key(SHEET_ID)
     return sh
 
 
+# =========================
+# Rate limiter Sheets (token bucket por tipo de cuota)
+#   - toda request HTTP de gspread pasa por aquí (GET = lectura, resto = escritura)
+#   - 429: pausa el bucket según Retry-After (o SHEETS_QUOTA_BACKOFF_SEC)
+#   - espera con time.sleep: corre en hilos del gateway, nunca en el event loop
+# =========================
+class SheetsCallCancelled(RuntimeError):
+    """La llamada venció (sheets_call) antes de enviar esta request HTTP: no se envió."""
+
+
+class _TokenBucket:
+    """
+    Token bucket con prioridad: un hilo solo toma token si no espera nadie de prioridad
+    más alta (número menor). Así CASOS pasa delante de un backlog de EVIDENCIAS.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until", "lock", "waiting", "clock")
+
+    def __init__(self, per_min: int, clock=time.monotonic):
+        self.clock = clock  # inyectable (tests)
+        self.rate = max(1, per_min) / 60.0
+        self.capacity = max(1.0, per_min / 4.0)  # ráfaga: ~15s de cuota
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.waiting: Dict[int, int] = {}  # prioridad -> hilos esperando
+
+    def acquire(self, priority: int = 0, cancel: Optional[threading.Event] = None) -> None:
+        with self.lock:
+            self.waiting[priority] = self.waiting.get(priority, 0) + 1
+        try:
+            while True:
+                if cancel is not None and cancel.is_set():
+                    raise SheetsCallCancelled("Sheets: llamada cancelada esperando cuota")
+                with self.lock:
+                    now = self.clock()
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    ahead = any(p < priority and n > 0 for p, n in self.waiting.items())
+                    if not ahead and now >= self.paused_until and self.tokens >= 1.0:
+                        self.tokens -= 1.0
+                        return
+                    delay = max(self.paused_until - now, (1.0 - self.tokens) / self.rate, 0.05)
+                if cancel is not None:
+                    cancel.wait(min(delay, 5.0))
+                else:
+                    time.sleep(min(delay, 5.0))
+        finally:
+            with self.lock:
+                self.waiting[priority] -= 1
+
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+            self.tokens = 0.0
+
+    def pause_remaining(self) -> float:
+        with self.lock:
+            return max(0.0, self.paused_until - self.clock())
+
+
+# Llamada en curso (por hilo del gateway), la fija sheets_call:
+#   .value  = prioridad
+#   .cancel = threading.Event que se activa al vencer el timeout (no enviar más requests)
+_sheets_priority = threading.local()
+
+_sheets_buckets: Dict[str, _TokenBucket] = {
+    "read": _TokenBucket(SHEETS_READS_PER_MIN),
+    "write": _TokenBucket(SHEETS_WRITES_PER_MIN),
+}
+
+
+class SheetsQuotaError(RuntimeError):
+    """Cuota agotada (HTTP 429 / RESOURCE_EXHAUSTED), detectada por status en el limitador."""
+
+
+# Prefijo fijo del mensaje de SheetsQuotaError: el outbox guarda errores como texto
+_QUOTA_ERR_PREFIX = "[cuota Sheets]"
+
+
+def _is_quota_exception(e: Exception) -> bool:
+    """
+    Por status, nunca por texto (un rango 'A429' o un ID con 429 no es cuota).
+    """
+    resp = getattr(e, "response", None)
+    if getattr(resp, "status_code", None) == 429 or getattr(e, "code", None) == 429:
+        return True
+    error = getattr(e, "error", None)
+    return isinstance(error, dict) and error.get("status") == "RESOURCE_EXHAUSTED"
+
+
+def _is_quota_sheet_error(err: str) -> bool:
+    return str(err).startswith(_QUOTA_ERR_PREFIX)
+
+
+def _retry_after_sec(e: Exception) -> float:
+    resp = getattr(e, "response", None)
+    headers = getattr(resp, "headers", None) or {}
+    try:
+        return max(1.0, float(headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return SHEETS_QUOTA_BACKOFF_SEC
+
+
+def sheets_quota_wait_sec() -> float:
+    """
+    Segundos que faltan para que termine una pausa por cuota (0 si no hay).
+    """
+    return max(b.pause_remaining() for b in _sheets_buckets.values())
+
+
+def _install_sheets_limiter(gc) -> None:
+    # gspread >= 6: gc.http_client.request; gspread 5: gc.request
+    target = getattr(gc, "http_client", None) or gc
+    raw_request = target.request
+
+    def limited_request(method, *args, **kwargs):
+        kind = "read" if str(method).lower() == "get" else "write"
+        bucket = _sheets_buckets[kind]
+        cancel = getattr(_sheets_priority, "cancel", None)
+        bucket.acquire(getattr(_sheets_priority, "value", 0), cancel)
+        if cancel is not None and cancel.is_set():
+            raise SheetsCallCancelled(f"Sheets: llamada vencida, {method} no enviado")
+        try:
+            return raw_request(method, *args, **kwargs)
+        except Exception as e:
+            if _is_quota_exception(e):
+                wait = _retry_after_sec(e)
+                bucket.pause(wait)
+                log.warning(f"Sheets: cuota de {kind} agotada, pausa {wait:g}s.")
+                raise SheetsQuotaError(f"{_QUOTA_ERR_PREFIX} {kind}: {e}") from e
+            raise
+
+    target.request = limited_request
+
+
+# =========================
+# Sheets gateway (gspread fuera del event loop)
+#   - pool acotado: una API lenta no consume hilos ilimitados
+#   - cola por prioridad delante del pool (interactivo 0, CASOS 1, ... índice 9) y un
+#     hilo por carril: la prioridad no se pierde antes de llegar al token bucket
+#   - timeout por operación: el handler/job deja de esperar y sigue
+#   - token de cancelación: al vencer (o cancelarse la tarea) el hilo no envía más requests
+#     HTTP; la que ya estaba en curso termina (acotada por SHEETS_HTTP_TIMEOUT_SEC)
+# =========================
+class _PriorityExecutor:
+    """
+    Pool de hilos con cola por prioridad (número menor primero; FIFO dentro de la misma).
+    Los hilos se crean a demanda hasta size_fn(). Junto con el tamaño automático del pool,
+    un trabajo de baja prioridad esperando cuota no retiene a los de prioridad alta.
+    """
+
+    def __init__(self, size_fn, thread_name_prefix: str):
+        self._size_fn = size_fn
+        self._prefix = thread_name_prefix
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._threads: List[threading.Thread] = []
+        self._idle = 0
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, priority: int, fn, *args, **kwargs) -> Future:
+        fut: Future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("Sheets: pool detenido")
+            self._queue.put((priority, next(self._seq), fut, fn, args, kwargs))
+            if self._queue.qsize() > self._idle and len(self._threads) < max(1, self._size_fn()):
+                t = threading.Thread(target=self._worker, name=f"{self._prefix}_{len(self._threads)}", daemon=True)
+                self._threads.append(t)
+                t.start()
+        return fut
+
+    def _worker(self) -> None:
+        while True:
+            with self._lock:
+                self._idle += 1
+            _prio, _seq, fut, fn, args, kwargs = self._queue.get()
+            with self._lock:
+                self._idle -= 1
+            if fut is None:
+                return
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                fut.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                fut.set_exception(e)
+
+    def shutdown(self, cancel_futures: bool = True) -> None:
+        with self._lock:
+            self._shutdown = True
+            threads = list(self._threads)
+        if cancel_futures:
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item[2] is not None:
+                    item[2].cancel()
+        for _ in threads:
+            self._queue.put((float("inf"), next(self._seq), None, None, (), {}))
+
+
+def _sheets_pool_size() -> int:
+    return SHEETS_WORKERS or (len(HISTORY_SHEETS) + SHEETS_INTERACTIVE_WORKERS)
+
+
+_sheets_executor = _PriorityExecutor(_sheets_pool_size, thread_name_prefix="sheets")
+
+
+class SheetsCallTimeout(TimeoutError):
+    """
+    sheets_call venció. `pending` es el future del hilo: ya no envía requests nuevas, pero
+    lo que estaba en curso pudo escribirse. Quien necesite el resultado real (outbox) lo espera.
+    """
+
+    def __init__(self, msg: str, pending: "asyncio.Future"):
+        super().__init__(msg)
+        self.pending = pending
+
+
+def _sheets_run(priority: int, cancel: threading.Event, fn, *args, **kwargs):
+    _sheets_priority.value = priority
+    _sheets_priority.cancel = cancel
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _sheets_priority.value = 0
+        _sheets_priority.cancel = None
+
+
+def _sheets_late_done(fut: "asyncio.Future") -> None:
+    # resultado de una llamada abandonada: solo se consume (evita "exception was never retrieved")
+    if not fut.cancelled() and fut.exception() is not None:
+        log.debug(f"Sheets: llamada vencida terminó con error: {fut.exception()}")
+
+
+async def sheets_call(fn, *args, timeout: Optional[float] = None, priority: int = 0, **kwargs):
+    """
+    Ejecuta una función que usa gspread en el pool de Sheets, con timeout.
+    priority: 0 = interactivo (por defecto); los carriles del outbox usan su prioridad.
+    Al vencer lanza SheetsCallTimeout y el hilo deja de enviar requests.
+    """
+    loop = asyncio.get_running_loop()
+    limit = SHEETS_CALL_TIMEOUT_SEC if timeout is None else timeout
+    cancel = threading.Event()
+    fut = asyncio.wrap_future(_sheets_executor.submit(priority, _sheets_run, priority, cancel, fn, *args, **kwargs), loop=loop)
+    fut.add_done_callback(_sheets_late_done)
+    try:
+        return await asyncio.wait_for(asyncio.shield(fut), timeout=limit)
+    except asyncio.TimeoutError:
+        cancel.set()
+        name = getattr(fn, "__name__", "sheets")
+        raise SheetsCallTimeout(f"Sheets: {name} excedió {limit:g}s", fut) from None
+    except asyncio.CancelledError:
+        cancel.set()
+        raise
+
+
+async def sheets_call_settled(fn, *args, priority: int = 0, **kwargs):
+    """
+    Como sheets_call, pero si vence espera a que el hilo termine de verdad (sin requests
+    nuevas tras el timeout) y devuelve su resultado. Para escrituras del outbox: las filas
+    siguen IN_FLIGHT (lease) hasta saber qué se escribió, en vez de darlas por fallidas y duplicarlas.
+    """
+    try:
+        return await sheets_call(fn, *args, priority=priority, **kwargs)
+    except SheetsCallTimeout as e:
+        log.warning(f"{e}; esperando a que el hilo termine antes de resolver el lote.")
+        return await e.pending
+
+
+def sheets_executor_shutdown() -> None:
+    _sheets_executor.shutdown(cancel_futures=True)
+
+
+# Cache de headers por worksheet: {ws_key: {header: col 1-based}}.
+# Se valida una vez (arranque) y se invalida ante error de esquema/escritura.
+_header_maps: Dict[Any, Dict[str, int]] = {}
+_header_maps_lock = threading.Lock()
+
+
+def _ws_key(ws) -> Any:
+    return getattr(ws, "id", None) or id(ws)
+
+
+def header_cache_invalidate(ws=None) -> None:
+    with _header_maps_lock:
+        if ws is None:
+            _header_maps.clear()
+        else:
+            _header_maps.pop(_ws_key(ws), None)
+
+
 def _ensure_headers(ws, expected_headers: List[str]):
-    values = ws.get_all_values()
-    if not values:
-        ws.append_row(expected_headers, value_input_option="RAW")
+    """
+    Valida headers leyendo solo la fila 1 (row_values) y deja el mapa en cache.
+    Llamadas posteriores no tocan la API mientras el cache siga válido.
+    """
+    with _header_maps_lock:
+        cached = _header_maps.get(_ws_key(ws))
+    if cached is not None and all(h in cached for h in expected_headers):
         return
-    headers = values[0]
+
+    headers = ws.row_values(1)
+    if not headers:
+        ws.append_row(expected_headers, value_input_option="RAW")
+        ws_snapshot_invalidate(ws)
+        headers = list(expected_headers)
     for h in expected_headers:
         if h not in headers:
+            header_cache_invalidate(ws)
             raise RuntimeError(f"Falta columna '{h}' en hoja '{ws.title}'. No modifiques headers.")
+    with _header_maps_lock:
+        _header_maps[_ws_key(ws)] = {h: i + 1 for i, h in enumerate(headers)}  # 1-based
 
 
-def build_index(ws, key_cols: List[str]) -> Dict[str, int]:
-    values = ws.get_all_values()
-    if not values:
-        return {}
-    headers = values[0]
-    col_idx = {h: i for i, h in enumerate(headers)}
-    for c in key_cols:
-        if c not in col_idx:
-            raise RuntimeError(f"Falta columna '{c}' en hoja '{ws.title}'")
+def build_index(ws, scan_cols: List[str], key_fn) -> Dict[str, int]:
+    """
+    Índice dedupe_key -> fila leyendo solo las columnas necesarias (un batch_get),
+    no la hoja completa.
+    """
+    _ensure_headers(ws, scan_cols)
+    col_map = _col_index_map(ws)
+    ranges = []
+    for c in scan_cols:
+        letters = re.sub(r"\d+", "", _a1(col_map[c], 1))
+        ranges.append(f"{letters}2:{letters}")
+    cols = ws.batch_get(ranges)
 
+    n_rows = max((len(v) for v in cols), default=0)
     idx: Dict[str, int] = {}
-    for r in range(2, len(values) + 1):
-        row = values[r - 1]
-        parts: List[str] = []
-        for c in key_cols:
-            i = col_idx[c]
-            parts.append(row[i] if i < len(row) else "")
-        k = "|".join(parts).strip()
+    for i in range(n_rows):
+        vals: Dict[str, str] = {}
+        for c, v in zip(scan_cols, cols):
+            cell = v[i] if i < len(v) else []
+            vals[c] = str(cell[0]) if cell else ""
+        if not any(vals.values()):
+            continue
+        k = key_fn(vals)
         if k:
-            idx[k] = r
+            idx[k] = i + 2
     return idx
 
 
@@ -916,11 +2432,17 @@ def row_to_values(row: Dict[str, Any], columns: List[str]) -> List[Any]:
 
 
 def _col_index_map(ws) -> Dict[str, int]:
-    values = ws.get_all_values()
-    if not values:
+    with _header_maps_lock:
+        cached = _header_maps.get(_ws_key(ws))
+    if cached is not None:
+        return dict(cached)
+    headers = ws.row_values(1)
+    if not headers:
         return {}
-    headers = values[0]
-    return {h: i + 1 for i, h in enumerate(headers)}  # 1-based
+    m = {h: i + 1 for i, h in enumerate(headers)}  # 1-based
+    with _header_maps_lock:
+        _header_maps[_ws_key(ws)] = m
+    return dict(m)
 
 
 def _a1(col: int, row: int) -> str:
@@ -932,26 +2454,278 @@ def _a1(col: int, row: int) -> str:
     return f"{letters}{row}"
 
 
-def sheet_upsert(ws, index: Dict[str, int], key: str, row: Dict[str, Any], columns: List[str], key_cols: List[str]):
+def _appended_first_row(resp: Any) -> Optional[int]:
+    """
+    Fila inicial de un append a partir de updates.updatedRange (ej: "'EVIDENCIAS'!A101:I120" -> 101).
+    """
+    try:
+        rng = resp["updates"]["updatedRange"]
+    except Exception:
+        return None
+    m = re.search(r"![A-Z]+(\d+)", str(rng))
+    return int(m.group(1)) if m else None
+
+
+def _guard_indexed_rows(ws, index: Dict[str, int], keys: List[str], scan_cols: List[str], key_fn) -> None:
+    """
+    Antes de escribir sobre filas del índice, confirma que la clave siga ahí (orden/filtro/borrado
+    manual mueven filas): una lectura (batch_get) de las celdas clave de esas filas. Si alguna no
+    coincide, relocaliza el lote con build_index (solo columnas clave) y corrige `index` in place;
+    las claves que ya no existen se quitan (se agregarán como nuevas).
+    """
+    rows = [(k, index[k]) for k in dict.fromkeys(keys) if k in index]
+    if not rows:
+        return
+    col_map = _col_index_map(ws)
+    resp = ws.batch_get([_a1(col_map[c], r) for _k, r in rows for c in scan_cols])
+    cells = iter(resp)
+    moved = []
+    for k, _r in rows:
+        vals = {}
+        for c in scan_cols:
+            vr = next(cells)
+            vals[c] = str(vr[0][0]) if vr and vr[0] else ""
+        if key_fn(vals) != k:
+            moved.append(k)
+    if not moved:
+        return
+    log.warning(f"Sheets: {len(moved)} filas movidas en '{ws.title}' (edición manual); relocalizando el lote.")
+    fresh = build_index(ws, scan_cols, key_fn)
+    for k in dict.fromkeys(keys):
+        r = fresh.get(k)
+        if r is None:
+            index.pop(k, None)
+        else:
+            index[k] = r
+
+
+def sheet_upsert_batch(
+    ws,
+    index: Dict[str, int],
+    items: List[Tuple[int, str, Dict[str, Any]]],
+    columns: List[str],
+    key_cols: List[str],
+    scan_cols: Optional[List[str]] = None,
+    key_fn=None,
+) -> Dict[int, Optional[str]]:
+    """
+    Upsert de varias filas con 3 llamadas como máximo:
+      - guarda: lectura de las celdas clave de las filas indexadas (_guard_indexed_rows)
+      - filas ya indexadas -> un values batch_update
+      - filas nuevas       -> un append_rows (fila asignada según updatedRange)
+    items: [(outbox_id, key, row)]. Retorna {outbox_id: None si OK | error}.
+    """
     _ensure_headers(ws, columns)
     col_map = _col_index_map(ws)
 
     # valida que key_cols existan
     for kc in key_cols:
         if kc not in col_map:
+            header_cache_invalidate(ws)
             raise RuntimeError(f"Falta columna clave '{kc}' en hoja '{ws.title}'")
 
-    values = row_to_values(row, columns)
+    _guard_indexed_rows(ws, index, [k for _i, k, _r in items], scan_cols or key_cols, key_fn or _joined_key(key_cols))
+
+    results: Dict[int, Optional[str]] = {}
+    updates: List[Dict[str, Any]] = []
+    update_ids: List[int] = []
+    appends: List[List[Any]] = []
+    append_items: List[Tuple[int, str]] = []
+    append_pos: Dict[str, int] = {}
+
+    for outbox_id, key, row in items:
+        values = row_to_values(_resolve_if_empty(row), columns)
+        if key in index:
+            r = index[key]
+            updates.append({"range": f"{_a1(1, r)}:{_a1(len(columns), r)}", "values": [values]})
+            update_ids.append(outbox_id)
+        elif key in append_pos:
+            # misma clave nueva dos veces en el lote: gana la última versión
+            appends[append_pos[key]] = values
+            append_items.append((outbox_id, key))
+        else:
+            append_pos[key] = len(appends)
+            appends.append(values)
+            append_items.append((outbox_id, key))
 
-    if key in index:
-        r = index[key]
-        start = _a1(1, r)
-        end = _a1(len(columns), r)
-        ws.update(f"{start}:{end}", [values], value_input_option="RAW")
-    else:
-        ws.append_row(values, value_input_option="RAW")
-        last_row = len(ws.get_all_values())
-        index[key] = last_row
+    if updates:
+        try:
+            ws.batch_update(updates, value_input_option="RAW")
+            for outbox_id in update_ids:
+                results[outbox_id] = None
+        except Exception as e:
+            header_cache_invalidate(ws)
+            for outbox_id in update_ids:
+                results[outbox_id] = str(e)
+
+    if appends:
+        try:
+            resp = ws.append_rows(appends, value_input_option="RAW")
+            first = _appended_first_row(resp)
+            if first is None:
+                # respaldo: solo la columna A, nunca la hoja completa
+                first = len(ws.col_values(1)) - len(appends) + 1
+            for key, n in append_pos.items():
+                index[key] = first + n
+            for outbox_id, _key in append_items:
+                results[outbox_id] = None
+        except Exception as e:
+            header_cache_invalidate(ws)
+            for outbox_id, _key in append_items:
+                results[outbox_id] = str(e)
+
+    if updates or appends:
+        # hojas de configuración (ROUTING/PAIRING) también se leen por snapshot
+        ws_snapshot_invalidate(ws)
+    return results
+
+
+def sheet_append_batch(ws, items: List[Tuple[int, str, Dict[str, Any]]], columns: List[str]) -> Dict[int, Optional[str]]:
+    """
+    Hojas append-only (log inmutable): un solo append_rows, sin índice ni búsquedas.
+    Si la misma clave viene dos veces en el lote se escribe una sola fila (la última).
+    """
+    _ensure_headers(ws, columns)
+    pos: Dict[str, int] = {}
+    values: List[List[Any]] = []
+    for _outbox_id, key, row in items:
+        if key in pos:
+            values[pos[key]] = row_to_values(row, columns)
+        else:
+            pos[key] = len(values)
+            values.append(row_to_values(row, columns))
+    try:
+        ws.append_rows(values, value_input_option="RAW")
+        return {outbox_id: None for outbox_id, _k, _r in items}
+    except Exception as e:
+        header_cache_invalidate(ws)
+        return {outbox_id: str(e) for outbox_id, _k, _r in items}
+
+
+def _read_indexed_rows(ws, index: Dict[str, int], keys: List[str], width: int, scan_cols: List[str], key_fn) -> Dict[str, List[str]]:
+    """
+    Lee las filas completas (hasta `width`) de las claves indexadas en un batch_get y, con los mismos
+    valores, hace la guarda de _guard_indexed_rows: si una clave ya no está en su fila (orden/borrado
+    manual) se relocaliza con build_index, se corrige `index` in place y se releen solo esas filas.
+    """
+    col_map = _col_index_map(ws)
+
+    def read(ks: List[str]) -> Dict[str, List[str]]:
+        if not ks:
+            return {}
+        resp = ws.batch_get([f"{_a1(1, index[k])}:{_a1(width, index[k])}" for k in ks])
+        return {k: (list(vr[0]) if vr else []) for k, vr in zip(ks, resp)}
+
+    def key_of(vals: List[str]) -> str:
+        return key_fn({c: str(vals[col_map[c] - 1]) if col_map[c] - 1 < len(vals) else "" for c in scan_cols})
+
+    rows = read([k for k in dict.fromkeys(keys) if k in index])
+    moved = [k for k, vals in rows.items() if key_of(vals) != k]
+    if not moved:
+        return rows
+    log.warning(f"Sheets: {len(moved)} filas movidas en '{ws.title}' (edición manual); relocalizando el lote.")
+    fresh = build_index(ws, scan_cols, key_fn)
+    for k in moved:
+        rows.pop(k, None)
+        if k in fresh:
+            index[k] = fresh[k]
+        else:
+            index.pop(k, None)
+    rows.update(read([k for k in moved if k in index]))
+    return rows
+
+
+def sheet_patch_batch(
+    ws,
+    index: Dict[str, int],
+    items: List[Tuple[int, str, Dict[str, Any]]],
+    columns: List[str],
+    key_cols: List[str],
+    scan_cols: Optional[List[str]] = None,
+    key_fn=None,
+) -> Dict[int, Optional[str]]:
+    """
+    PATCH por columnas: solo se escriben las celdas del parche, nunca la fila entera, así no se
+    pisan ediciones manuales (p.ej. activo) en la hoja. 3 llamadas como máximo por lote:
+      - filas indexadas -> un batch_get de esas filas (guarda de filas movidas + "_if_empty")
+      - celdas de todas las claves indexadas -> un values batch_update
+      - claves nuevas -> un append_rows con lo que trae cada parche
+    items: [(outbox_id, key, patch)]. Retorna {outbox_id: None si OK | error}.
+    """
+    _ensure_headers(ws, columns)
+    col_map = _col_index_map(ws)
+    width = max(col_map.values())
+
+    # misma clave varias veces en el lote: se combinan en orden
+    patches: Dict[str, Dict[str, Any]] = {}
+    ids: Dict[str, List[int]] = {}
+    for outbox_id, key, patch in items:
+        patches[key] = _merge_patch(patches.get(key) or {}, patch)
+        ids.setdefault(key, []).append(outbox_id)
+
+    current = _read_indexed_rows(ws, index, list(patches), width, scan_cols or key_cols, key_fn or _joined_key(key_cols))
+
+    results: Dict[int, Optional[str]] = {}
+
+    def settle(keys: List[str], err: Optional[str]) -> None:
+        for k in keys:
+            for outbox_id in ids[k]:
+                results[outbox_id] = err
+
+    updates: List[Dict[str, Any]] = []
+    update_cells: Dict[str, Dict[str, Any]] = {}
+    appends: List[List[Any]] = []
+    append_keys: List[str] = []
+    for key, patch in patches.items():
+        cells = {k: v for k, v in patch.items() if k != "_if_empty"}
+        if key not in index:
+            append_keys.append(key)
+            appends.append(row_to_values({**(patch.get("_if_empty") or {}), **cells}, columns))
+            continue
+        vals = current.get(key) or []
+        for k, v in (patch.get("_if_empty") or {}).items():
+            ci = col_map.get(k)
+            if ci is not None and not str(vals[ci - 1] if ci - 1 < len(vals) else "").strip():
+                cells[k] = v
+        if not cells:
+            settle([key], None)
+            continue
+        try:
+            updates.extend(_cell_update_ranges(ws, col_map, index[key], cells))
+            update_cells[key] = cells
+        except Exception as e:
+            settle([key], str(e))
+
+    if updates:
+        try:
+            ws.batch_update(updates, value_input_option="RAW")
+            for key, cells in update_cells.items():
+                _snapshot_patch(ws, index[key], cells)
+            settle(list(update_cells), None)
+        except Exception as e:
+            header_cache_invalidate(ws)
+            ws_snapshot_invalidate(ws)
+            settle(list(update_cells), str(e))
+
+    if appends:
+        try:
+            resp = ws.append_rows(appends, value_input_option="RAW")
+            first = _appended_first_row(resp)
+            if first is not None:
+                for n, key in enumerate(append_keys):
+                    index[key] = first + n
+            settle(append_keys, None)
+        except Exception as e:
+            header_cache_invalidate(ws)
+            settle(append_keys, str(e))
+        ws_snapshot_invalidate(ws)
+    return results
+
+
+def sheet_upsert(ws, index: Dict[str, int], key: str, row: Dict[str, Any], columns: List[str], key_cols: List[str]):
+    err = sheet_upsert_batch(ws, index, [(0, key, row)], columns, key_cols).get(0)
+    if err:
+        raise RuntimeError(err)
 
 
 def _is_permanent_sheet_error(err: str) -> bool:
@@ -983,158 +2757,502 @@ def _parse_int_or_default(v: Any, default: int) -> int:
         return default
 
 
-def _utc_iso_now() -> str:
-    return datetime.now(timezone.utc).isoformat()
+def _utc_iso_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+# =========================
+# Snapshots de hojas de configuración (PAIRING / ROUTING / TECNICOS)
+#   - una descarga (get_all_values) sirve headers, celdas y búsquedas por columna
+#   - las escrituras del bot parchean el snapshot (write-through) y suben la versión
+#   - TTL corto (WS_SNAPSHOT_TTL_SEC) para recoger ediciones manuales
+# =========================
+_ws_snapshots: Dict[Any, Dict[str, Any]] = {}
+_ws_snapshots_lock = threading.Lock()
+_ws_snapshot_seq = {"version": 0}
+
+
+def _next_snapshot_version() -> int:
+    _ws_snapshot_seq["version"] += 1
+    return _ws_snapshot_seq["version"]
+
+
+def ws_snapshot(ws, max_age: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Snapshot de la hoja: {version, fetched_at, values, col, lookup}. Descarga solo si venció.
+    """
+    ttl = WS_SNAPSHOT_TTL_SEC if max_age is None else max_age
+    key = _ws_key(ws)
+    with _ws_snapshots_lock:
+        snap = _ws_snapshots.get(key)
+        if snap is not None and time.monotonic() - snap["fetched_at"] <= ttl:
+            return snap
+
+    return ws_snapshot_install(ws, ws.get_all_values())
+
+
+def ws_snapshot_install(ws, values: List[List[str]]) -> Dict[str, Any]:
+    """
+    Instala como snapshot valores ya descargados por otra vía (p.ej. values_batch_get).
+    """
+    headers = values[0] if values else []
+    snap = {
+        "fetched_at": time.monotonic(),
+        "values": values,
+        "col": {h: i for i, h in enumerate(headers)},
+        "lookup": {},
+    }
+    with _ws_snapshots_lock:
+        snap["version"] = _next_snapshot_version()
+        _ws_snapshots[_ws_key(ws)] = snap
+    return snap
+
+
+def ws_snapshot_invalidate(ws=None) -> None:
+    with _ws_snapshots_lock:
+        if ws is None:
+            _ws_snapshots.clear()
+        else:
+            _ws_snapshots.pop(_ws_key(ws), None)
+
+
+def snapshot_cell(snap: Dict[str, Any], row_index: int, col_name: str) -> str:
+    ci = snap["col"].get(col_name)
+    values = snap["values"]
+    if ci is None or row_index - 1 >= len(values):
+        return ""
+    row = values[row_index - 1]
+    return row[ci] if ci < len(row) else ""
+
+
+def snapshot_find_row(snap: Dict[str, Any], col_name: str, target: str) -> Optional[int]:
+    """
+    Fila (1-based) con col_name == target (primera coincidencia). Índice por columna, perezoso.
+    """
+    ci = snap["col"].get(col_name)
+    if ci is None:
+        return None
+    with _ws_snapshots_lock:
+        lookup = snap["lookup"].get(col_name)
+        if lookup is None:
+            lookup = {}
+            values = snap["values"]
+            for idx in range(len(values), 1, -1):  # de abajo hacia arriba: gana la primera
+                row = values[idx - 1]
+                lookup[str(row[ci] if ci < len(row) else "").strip()] = idx
+            snap["lookup"][col_name] = lookup
+    return lookup.get(str(target).strip())
+
+
+def snapshot_records(snap: Dict[str, Any]) -> List[Dict[str, Any]]:
+    values = snap["values"]
+    if not values or len(values) < 2:
+        return []
+    headers = values[0]
+    out: List[Dict[str, Any]] = []
+    for r in values[1:]:
+        out.append({h: (r[i] if i < len(r) else "") for i, h in enumerate(headers)})
+    return out
+
+
+def _snapshot_patch(ws, row_index: int, updates: Dict[str, Any]) -> None:
+    with _ws_snapshots_lock:
+        snap = _ws_snapshots.get(_ws_key(ws))
+        if snap is None:
+            return
+        values = snap["values"]
+        if not values:
+            _ws_snapshots.pop(_ws_key(ws), None)
+            return
+        width = len(values[0])
+        while len(values) < row_index:
+            values.append([""] * width)
+        row = list(values[row_index - 1]) + [""] * max(0, width - len(values[row_index - 1]))
+        for k, v in updates.items():
+            ci = snap["col"].get(k)
+            if ci is not None:
+                row[ci] = str(v)
+            snap["lookup"].pop(k, None)
+        values[row_index - 1] = row
+        snap["version"] = _next_snapshot_version()
+
+
+def ws_append_row(ws, row: Dict[str, Any], columns: List[str]) -> None:
+    """
+    append_row + parche del snapshot con la fila asignada (updatedRange).
+    """
+    resp = ws.append_row([row.get(c, "") for c in columns], value_input_option="RAW")
+    row_index = _appended_first_row(resp)
+    if row_index is None:
+        ws_snapshot_invalidate(ws)
+        return
+    _snapshot_patch(ws, row_index, {c: row.get(c, "") for c in columns})
+
+
+def _read_all_records(ws) -> List[Dict[str, Any]]:
+    return snapshot_records(ws_snapshot(ws))
+
+
+def _find_row_index_by_column(ws, col_name: str, target: str) -> Optional[int]:
+    """
+    Retorna row_index (1-based) donde col_name == target (desde el snapshot de la hoja).
+    """
+    return snapshot_find_row(ws_snapshot(ws), col_name, target)
+
+
+def _cell_update_ranges(ws, col_map: Dict[str, int], row_index: int, updates: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Rangos de batch_update para celdas {header: value} de una fila: columnas contiguas se agrupan.
+    """
+    cells: Dict[int, Any] = {}
+    for k, v in updates.items():
+        if k not in col_map:
+            raise RuntimeError(f"Falta columna '{k}' en hoja '{ws.title}'")
+        cells[col_map[k]] = v
+
+    data: List[Dict[str, Any]] = []
+    cols = sorted(cells)
+    start = prev = cols[0]
+    for c in cols[1:] + [None]:
+        if c is not None and c == prev + 1:
+            prev = c
+            continue
+        data.append({
+            "range": f"{_a1(start, row_index)}:{_a1(prev, row_index)}",
+            "values": [[cells[i] for i in range(start, prev + 1)]],
+        })
+        if c is not None:
+            start = prev = c
+    return data
+
+
+def _update_cells_by_headers(ws, row_index: int, updates: Dict[str, Any]) -> None:
+    """
+    Actualiza celdas de una fila usando headers; updates: {header: value}
+    Una sola request: columnas contiguas se agrupan en un rango, todo va en un batch_update.
+    """
+    if not updates:
+        return
+    col_map = _col_index_map(ws)
+    if not col_map:
+        raise RuntimeError("Hoja vacía, no puedo actualizar.")
+    data = _cell_update_ranges(ws, col_map, row_index, updates)
+    try:
+        ws.batch_update(data, value_input_option="RAW")
+    except Exception:
+        header_cache_invalidate(ws)
+        ws_snapshot_invalidate(ws)
+        raise
+    _snapshot_patch(ws, row_index, updates)
+
+
+# =========================
+# Sheets config cache loaders
+# =========================
+def load_tecnicos_cache(app: Application) -> None:
+    if not app.bot_data.get("sheets_ready"):
+        return
+    ws = app.bot_data.get("ws_tecnicos")
+    if not ws:
+        return
+    try:
+        _ensure_headers(ws, TECNICOS_COLUMNS)
+        _apply_tecnicos_records(app, _read_all_records(ws))
+    except Exception as e:
+        log.warning(f"TECNICOS cache error: {e}")
+
+
+def _apply_tecnicos_records(app: Application, rows: List[Dict[str, Any]]) -> bool:
+    """
+    Aplica filas de TECNICOS al cache por diferencia: las entradas sin cambios se conservan.
+    Retorna True si el cache cambió.
+    """
+    old = {t["nombre"]: t for t in (app.bot_data.get("tech_cache") or [])}
+    techs: List[Dict[str, Any]] = []
+    for r in rows:
+        nombre = _safe_str(r.get("nombre"))
+        if not nombre:
+            continue
+        activo = _parse_bool01(r.get("activo"))
+        if activo != 1:
+            continue
+        alias = _safe_str(r.get("alias"))
+        orden = _parse_int_or_default(r.get("orden"), 9999)
+        t = {"nombre": nombre, "alias": alias, "orden": orden}
+        techs.append(old[nombre] if old.get(nombre) == t else t)
+    techs.sort(key=lambda x: (x.get("orden", 9999), x.get("nombre", "")))
+    app.bot_data["tech_cache_at"] = time.time()
+    if "tech_cache" in app.bot_data and techs == app.bot_data["tech_cache"]:
+        return False
+    app.bot_data["tech_cache"] = techs
+    app.bot_data.setdefault("config_dirty", set()).add("tech_cache")
+    log.info(f"TECNICOS cache actualizado: {len(techs)} activos.")
+    return True
+
+
+def _routing_overlay_live(m: Dict[int, Dict[str, Any]]) -> None:
+    """
+    Vinculaciones locales aún no escritas en la hoja (outbox ROUTING vivo) ganan.
+    Los PATCH se aplican sobre la ruta conocida; "_if_empty" solo llena celdas vacías.
+    """
+    for r in outbox_live_rows("ROUTING"):
+        origin = _safe_int(r.get("origin_chat_id"))
+        if origin is None:
+            continue
+        merged = dict(m.get(int(origin)) or {})
+        for k, v in (r.get("_if_empty") or {}).items():
+            if not _safe_str(merged.get(k)):
+                merged[k] = v
+        merged.update({k: v for k, v in r.items() if k != "_if_empty"})
+        entry = _routing_entry(merged)
+        if entry:
+            m[entry["origin_chat_id"]] = entry
+
+
+def _routing_entry(r: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    origin = _safe_int(r.get("origin_chat_id"))
+    if origin is None:
+        return None
+    # activo != 1 se guarda igual pero marcado, por si se usa en "ver rutas"
+    return {
+        "origin_chat_id": int(origin),
+        "evidence_chat_id": _safe_str(r.get("evidence_chat_id")),
+        "summary_chat_id": _safe_str(r.get("summary_chat_id")),
+        "alias": _safe_str(r.get("alias")),
+        "activo": 1 if _parse_bool01(r.get("activo")) == 1 else 0,
+        "updated_by": _safe_str(r.get("updated_by")),
+        "updated_at": _safe_str(r.get("updated_at")),
+    }
+
+
+def load_routing_cache(app: Application) -> None:
+    if not app.bot_data.get("sheets_ready"):
+        return
+    ws = app.bot_data.get("ws_routing")
+    if not ws:
+        return
+    try:
+        _ensure_headers(ws, ROUTING_COLUMNS)
+        _apply_routing_records(app, _read_all_records(ws))
+    except Exception as e:
+        log.warning(f"ROUTING cache error: {e}")
+
+
+def _apply_routing_records(app: Application, rows: List[Dict[str, Any]]) -> bool:
+    """
+    Aplica filas de ROUTING al cache por diferencia: las rutas sin cambios se conservan
+    y chat_settings solo se invalida si algo cambió. Retorna True si el cache cambió.
+    """
+    fresh: Dict[int, Dict[str, Any]] = {}
+    for r in rows:
+        entry = _routing_entry(r)
+        if entry:
+            fresh[entry["origin_chat_id"]] = entry
+    _routing_overlay_live(fresh)
+
+    old = app.bot_data.get("routing_cache") or {}
+    m: Dict[int, Dict[str, Any]] = {}
+    changed = 0
+    for origin, entry in fresh.items():
+        if old.get(origin) == entry:
+            m[origin] = old[origin]
+        else:
+            m[origin] = entry
+            changed += 1
+    removed = len(set(old) - set(fresh))
+    app.bot_data["routing_cache_at"] = time.time()
+    if "routing_cache" in app.bot_data and not changed and not removed:
+        return False
+    app.bot_data["routing_cache"] = m
+    app.bot_data.setdefault("config_dirty", set()).add("routing_cache")
+    chat_settings_invalidate()
+    log.info(f"ROUTING cache actualizado: {len(m)} rutas ({changed} nuevas/cambiadas, {removed} eliminadas).")
+    return True
+
+
+async def aload_tecnicos_cache(app: Application) -> None:
+    try:
+        await sheets_call(load_tecnicos_cache, app)
+    except Exception as e:
+        log.warning(f"TECNICOS cache error: {e}")
+    await config_snapshot_flush(app)
+
+
+async def aload_routing_cache(app: Application) -> None:
+    try:
+        await sheets_call(load_routing_cache, app)
+    except Exception as e:
+        log.warning(f"ROUTING cache error: {e}")
+    await config_snapshot_flush(app)
+
+
+# =========================
+# Warm start: copia local (SQLite) de tech_cache / routing_cache
+#   - se guarda cada vez que un cache cambia (marcado en config_dirty)
+#   - se carga de forma síncrona al arrancar, antes de conectar con Google
+# =========================
+def config_snapshot_save(name: str, data: Any) -> None:
+    with db() as conn:
+        conn.execute(
+            """
+            INSERT INTO config_snapshot(name, data_json, saved_at) VALUES(?,?,?)
+            ON CONFLICT(name) DO UPDATE SET data_json=excluded.data_json, saved_at=excluded.saved_at
+            """,
+            (name, json.dumps(data, ensure_ascii=False), _utc_iso_now()),
+        )
+        conn.commit()
+
+
+def config_snapshot_load() -> Dict[str, Tuple[Any, str]]:
+    with db() as conn:
+        rows = conn.execute("SELECT name, data_json, saved_at FROM config_snapshot").fetchall()
+    out: Dict[str, Tuple[Any, str]] = {}
+    for r in rows:
+        try:
+            out[r["name"]] = (json.loads(r["data_json"]), r["saved_at"])
+        except Exception:
+            continue
+    return out
 
 
-def _read_all_records(ws) -> List[Dict[str, Any]]:
-    # get_all_records devuelve dicts con headers como keys
-    try:
-        return ws.get_all_records()
-    except Exception:
-        # fallback más resistente
-        values = ws.get_all_values()
-        if not values or len(values) < 2:
-            return []
-        headers = values[0]
-        out: List[Dict[str, Any]] = []
-        for r in values[1:]:
-            d = {}
-            for i, h in enumerate(headers):
-                d[h] = r[i] if i < len(r) else ""
-            out.append(d)
-        return out
+async def config_snapshot_flush(app: Application) -> None:
+    dirty = app.bot_data.get("config_dirty")
+    while dirty:
+        name = dirty.pop()
+        data = app.bot_data.get(name)
+        if name == "routing_cache":
+            data = list((data or {}).values())
+        try:
+            await db_write(config_snapshot_save, name, data)
+        except Exception as e:
+            log.warning(f"Config snapshot {name} error: {e}")
 
 
-def _find_row_index_by_column(ws, col_name: str, target: str) -> Optional[int]:
+def config_snapshot_warm_start(app: Application) -> None:
     """
-    Retorna row_index (1-based) donde col_name == target, buscando sobre toda la hoja.
+    Carga la última copia local de TECNICOS/ROUTING en bot_data (sin red).
+    Los *_cache_at quedan en 0: el refresco en segundo plano los revalida apenas haya Sheets.
     """
-    values = ws.get_all_values()
-    if not values:
-        return None
-    headers = values[0]
-    try:
-        ci = headers.index(col_name)
-    except ValueError:
-        return None
-    for idx in range(2, len(values) + 1):
-        row = values[idx - 1]
-        val = row[ci] if ci < len(row) else ""
-        if str(val).strip() == str(target).strip():
-            return idx
-    return None
+    snaps = config_snapshot_load()
+    techs = (snaps.get("tech_cache") or ([], ""))[0] or []
+    if techs:
+        app.bot_data["tech_cache"] = techs
+    m: Dict[int, Dict[str, Any]] = {}
+    for r in (snaps.get("routing_cache") or ([], ""))[0] or []:
+        entry = _routing_entry(r)
+        if entry:
+            m[entry["origin_chat_id"]] = entry
+    _routing_overlay_live(m)
+    if m:
+        app.bot_data["routing_cache"] = m
+    if techs or m:
+        saved = max(v[1] for v in snaps.values()) if snaps else "-"
+        log.info(f"Config warm start: {len(techs)} técnicos, {len(m)} rutas (copia local {saved}).")
 
 
-def _update_cells_by_headers(ws, row_index: int, updates: Dict[str, Any]) -> None:
+def _config_probe_ranges(app: Application, tab: str) -> List[str]:
     """
-    Actualiza celdas de una fila usando headers; updates: {header: value}
+    Rangos de la sonda: columna clave + updated_at (cuántas filas hay y cuándo se tocaron),
+    no la pestaña completa.
     """
-    values = ws.get_all_values()
-    if not values:
-        raise RuntimeError("Hoja vacía, no puedo actualizar.")
-    headers = values[0]
-    col_map = {h: i + 1 for i, h in enumerate(headers)}  # 1-based col
-    for k, v in updates.items():
-        if k not in col_map:
-            raise RuntimeError(f"Falta columna '{k}' en hoja '{ws.title}'")
-        ws.update_cell(row_index, col_map[k], v)
-
-
-# =========================
-# Sheets config cache loaders
-# =========================
-def load_tecnicos_cache(app: Application) -> None:
-    if not app.bot_data.get("sheets_ready"):
-        return
-    ws = app.bot_data.get("ws_tecnicos")
-    if not ws:
-        return
-    try:
-        _ensure_headers(ws, TECNICOS_COLUMNS)
-        rows = _read_all_records(ws)
-        techs: List[Dict[str, Any]] = []
-        for r in rows:
-            nombre = _safe_str(r.get("nombre"))
-            if not nombre:
-                continue
-            activo = _parse_bool01(r.get("activo"))
-            if activo != 1:
-                continue
-            alias = _safe_str(r.get("alias"))
-            orden = _parse_int_or_default(r.get("orden"), 9999)
-            techs.append({"nombre": nombre, "alias": alias, "orden": orden})
-        techs.sort(key=lambda x: (x.get("orden", 9999), x.get("nombre", "")))
-        app.bot_data["tech_cache"] = techs
-        app.bot_data["tech_cache_at"] = time.time()
-        log.info(f"TECNICOS cache actualizado: {len(techs)} activos.")
-    except Exception as e:
-        log.warning(f"TECNICOS cache error: {e}")
+    spec = CONFIG_SHEETS[tab]
+    ws = app.bot_data[spec["ws"]]
+    _ensure_headers(ws, spec["probe_cols"])
+    col_map = _col_index_map(ws)
+    out = []
+    for c in spec["probe_cols"]:
+        letters = re.sub(r"\d+", "", _a1(col_map[c], 1))
+        out.append(f"'{tab}'!{letters}2:{letters}")
+    return out
 
 
-def load_routing_cache(app: Application) -> None:
-    if not app.bot_data.get("sheets_ready"):
-        return
-    ws = app.bot_data.get("ws_routing")
-    if not ws:
-        return
-    try:
-        _ensure_headers(ws, ROUTING_COLUMNS)
-        rows = _read_all_records(ws)
-        m: Dict[int, Dict[str, Any]] = {}
-        for r in rows:
-            origin = _safe_int(r.get("origin_chat_id"))
-            if origin is None:
-                continue
-            activo = _parse_bool01(r.get("activo"))
-            if activo != 1:
-                # guardamos igual pero marcado, por si se usa en "ver rutas"
-                m[int(origin)] = {
-                    "origin_chat_id": int(origin),
-                    "evidence_chat_id": _safe_str(r.get("evidence_chat_id")),
-                    "summary_chat_id": _safe_str(r.get("summary_chat_id")),
-                    "alias": _safe_str(r.get("alias")),
-                    "activo": 0,
-                    "updated_by": _safe_str(r.get("updated_by")),
-                    "updated_at": _safe_str(r.get("updated_at")),
-                }
-                continue
+def probe_config_sheets(app: Application, tabs: List[str]) -> Dict[str, bool]:
+    """
+    Sonda de cambios para hojas de configuración: un values_batch_get de las columnas
+    probe_cols de todas las pestañas pedidas y un hash de esos valores. Solo las pestañas
+    cuyo hash cambió (o sin recarga completa en CONFIG_FULL_RELOAD_SEC, por ediciones
+    manuales que no tocan updated_at) se descargan completas con un segundo values_batch_get,
+    se instalan como snapshot y se aplican por diferencia. Retorna {tab: cambió}.
+    """
+    sh = app.bot_data.get("sh")
+    tabs = [t for t in tabs if app.bot_data.get(CONFIG_SHEETS[t]["ws"]) is not None]
+    if not sh or not tabs:
+        return {}
+    ranges = {tab: _config_probe_ranges(app, tab) for tab in tabs}
+    resp = sh.values_batch_get([r for tab in tabs for r in ranges[tab]])
+    vrs = iter(resp.get("valueRanges") or [])
+    hashes = app.bot_data.setdefault("config_hash", {})
+    full_at = app.bot_data.setdefault("config_full_at", {})
+    now_ts = time.time()
+    out: Dict[str, bool] = {}
+    reload: Dict[str, str] = {}
+    for tab in tabs:
+        probe = [(next(vrs, None) or {}).get("values") or [] for _r in ranges[tab]]
+        digest = hashlib.sha1(json.dumps(probe, ensure_ascii=False).encode("utf-8")).hexdigest()
+        if hashes.get(tab) == digest and now_ts - full_at.get(tab, 0) < CONFIG_FULL_RELOAD_SEC:
+            app.bot_data[CONFIG_SHEETS[tab]["at"]] = now_ts
+            out[tab] = False
+        else:
+            reload[tab] = digest
+    if not reload:
+        return out
 
-            m[int(origin)] = {
-                "origin_chat_id": int(origin),
-                "evidence_chat_id": _safe_str(r.get("evidence_chat_id")),
-                "summary_chat_id": _safe_str(r.get("summary_chat_id")),
-                "alias": _safe_str(r.get("alias")),
-                "activo": 1,
-                "updated_by": _safe_str(r.get("updated_by")),
-                "updated_at": _safe_str(r.get("updated_at")),
-            }
-        app.bot_data["routing_cache"] = m
-        app.bot_data["routing_cache_at"] = time.time()
-        log.info(f"ROUTING cache actualizado: {len(m)} rutas.")
-    except Exception as e:
-        log.warning(f"ROUTING cache error: {e}")
+    resp = sh.values_batch_get([f"'{tab}'" for tab in reload])
+    for (tab, digest), vr in zip(reload.items(), resp.get("valueRanges") or []):
+        spec = CONFIG_SHEETS[tab]
+        values = vr.get("values") or []
+        if values:
+            ws_snapshot_install(app.bot_data[spec["ws"]], values)
+        hashes[tab] = digest
+        full_at[tab] = now_ts
+        out[tab] = spec["apply"](app, snapshot_records({"values": values}))
+    return out
+
+
+# Hojas de configuración con sonda de cambios: ws en bot_data, marca de tiempo, columnas de la sonda
+# y aplicador por diferencia
+CONFIG_SHEETS: Dict[str, Dict[str, Any]] = {
+    TECNICOS_TAB: {
+        "ws": "ws_tecnicos",
+        "at": "tech_cache_at",
+        "ttl": TECH_CACHE_TTL_SEC,
+        "probe_cols": ["nombre", "updated_at"],
+        "apply": _apply_tecnicos_records,
+    },
+    ROUTING_TAB: {
+        "ws": "ws_routing",
+        "at": "routing_cache_at",
+        "ttl": ROUTING_CACHE_TTL_SEC,
+        "probe_cols": ["origin_chat_id", "updated_at"],
+        "apply": _apply_routing_records,
+    },
+}
 
 
 async def refresh_config_jobs(context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Job único que refresca TECNICOS + ROUTING según TTL; evita llamadas excesivas.
+    Las pestañas vencidas se sondean juntas (1 lectura angosta) y solo se descarga y
+    reconstruye lo que cambió.
     """
     app = context.application
     if not app.bot_data.get("sheets_ready"):
         return
 
     now_ts = time.time()
-    tech_at = app.bot_data.get("tech_cache_at", 0)
-    routing_at = app.bot_data.get("routing_cache_at", 0)
-
-    if now_ts - tech_at >= TECH_CACHE_TTL_SEC:
-        load_tecnicos_cache(app)
-    if now_ts - routing_at >= ROUTING_CACHE_TTL_SEC:
-        load_routing_cache(app)
+    due = [tab for tab, spec in CONFIG_SHEETS.items() if now_ts - app.bot_data.get(spec["at"], 0) >= spec["ttl"]]
+    if not due:
+        return
+    try:
+        await sheets_call(probe_config_sheets, app, due, priority=5)
+    except Exception as e:
+        log.warning(f"Config refresh error: {e}")
+    await config_snapshot_flush(app)
 
 # =========================
-# Sheets pairing (persistencia en Sheets)
+# Pairing local (SQLite) + auditoría en Sheets vía outbox
+#   - emitir/validar/consumir códigos no toca Google: responde al instante
+#   - filas PAIRING y ROUTING se escriben en Sheets por el outbox (reintentos incluidos)
 # =========================
 def _gen_pair_code() -> str:
     # Corto, fácil de copiar
@@ -1142,46 +3260,99 @@ def _gen_pair_code() -> str:
     return f"PAIR-{raw[:6]}"
 
 
-def pairing_create(app: Application, origin_chat_id: int, purpose: str, created_by: str) -> str:
+def _pairing_sheet_row(r: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "code": r["code"],
+        "origin_chat_id": str(r["origin_chat_id"]),
+        "purpose": r["purpose"],
+        "expires_at": r["expires_at"],
+        "used": "1" if int(r["used"] or 0) == 1 else "0",
+        "created_by": r["created_by"] or "",
+        "created_at": r["created_at"] or "",
+        "used_by": r["used_by"] or "",
+        "used_at": r["used_at"] or "",
+    }
+
+
+def pairing_create(origin_chat_id: int, purpose: str, created_by: str) -> str:
     """
-    Crea fila en PAIRING y retorna code.
+    Crea código en pairing_codes (y su fila PAIRING en el outbox). Retorna code.
     purpose: EVIDENCE | SUMMARY
     """
-    if not app.bot_data.get("sheets_ready"):
-        raise RuntimeError("Sheets no disponible.")
-    ws = app.bot_data.get("ws_pairing")
-    if not ws:
-        raise RuntimeError("Hoja PAIRING no disponible.")
+    expires = (datetime.now(timezone.utc) + timedelta(minutes=PAIRING_TTL_MINUTES)).isoformat()
+    created_at = _utc_iso_now()
+    with db() as conn:
+        # Asegurar unicidad (PK): reintenta pocas veces
+        for _ in range(5):
+            code = _gen_pair_code()
+            try:
+                conn.execute(
+                    """
+                    INSERT INTO pairing_codes(code, origin_chat_id, purpose, expires_at, used, created_by, created_at)
+                    VALUES(?,?,?,?,0,?,?)
+                    """,
+                    (code, int(origin_chat_id), purpose, expires, created_by, created_at),
+                )
+                conn.commit()
+                break
+            except sqlite3.IntegrityError:
+                conn.rollback()
+        else:
+            raise RuntimeError("No pude generar un código único, intenta de nuevo.")
+        row = conn.execute("SELECT * FROM pairing_codes WHERE code=?", (code,)).fetchone()
+    outbox_enqueue("PAIRING", "UPSERT", code, _pairing_sheet_row(row))
+    return code
 
-    _ensure_headers(ws, PAIRING_COLUMNS)
 
-    code = _gen_pair_code()
-    # Asegurar unicidad simple (reintenta pocas veces)
-    for _ in range(3):
-        ri = _find_row_index_by_column(ws, "code", code)
-        if ri is None:
-            break
-        code = _gen_pair_code()
+def pairing_consume(code: str, dest_chat_id: int, used_by: str, purpose_expected: str) -> Dict[str, Any]:
+    """
+    Valida y marca used=1 de forma atómica (un código no se puede usar dos veces).
+    Retorna {origin_chat_id, purpose}.
+    """
+    code = str(code).strip().upper()
+    with db() as conn:
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            r = conn.execute("SELECT * FROM pairing_codes WHERE code=?", (code,)).fetchone()
+            if not r:
+                raise RuntimeError("Código no encontrado.")
+            if int(r["used"] or 0) == 1:
+                raise RuntimeError("Este código ya fue usado.")
+            purpose = _safe_str(r["purpose"]).upper()
+            if purpose not in ("EVIDENCE", "SUMMARY"):
+                raise RuntimeError("Código inválido (purpose).")
+            if purpose_expected and purpose != purpose_expected:
+                raise RuntimeError(f"Este código es para {purpose}, no para {purpose_expected}.")
+            dt_exp = parse_iso(r["expires_at"])
+            if not dt_exp:
+                raise RuntimeError("Código inválido (expires_at).")
+            if datetime.now(timezone.utc) > dt_exp:
+                raise RuntimeError("Este código está vencido. Genera uno nuevo en el grupo ORIGEN.")
 
-    expires = (datetime.now(timezone.utc) + timedelta(minutes=PAIRING_TTL_MINUTES)).isoformat()
-    created_at = _utc_iso_now()
+            conn.execute(
+                "UPDATE pairing_codes SET used=1, used_by=?, used_at=?, dest_chat_id=? WHERE code=?",
+                (used_by, _utc_iso_now(), int(dest_chat_id), code),
+            )
+            row = conn.execute("SELECT * FROM pairing_codes WHERE code=?", (code,)).fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    outbox_enqueue("PAIRING", "UPSERT", code, _pairing_sheet_row(row))
+    return {"origin_chat_id": int(row["origin_chat_id"]), "purpose": purpose}
 
-    row = {
-        "code": code,
-        "origin_chat_id": str(origin_chat_id),
-        "purpose": purpose,
-        "expires_at": expires,
-        "used": "0",
-        "created_by": created_by,
-        "created_at": created_at,
-        "used_by": "",
-        "used_at": "",
-    }
-    ws.append_row([row.get(c, "") for c in PAIRING_COLUMNS], value_input_option="RAW")
-    return code
+
+def pairing_codes_purge(older_than: str) -> int:
+    """
+    Borra códigos vencidos (usados o no) con expires_at < older_than; la auditoría queda en Sheets.
+    """
+    with db() as conn:
+        cur = conn.execute("DELETE FROM pairing_codes WHERE expires_at < ?", (older_than,))
+        conn.commit()
+        return cur.rowcount
 
 
-def pairing_consume_and_upsert_routing(
+async def pairing_consume_and_upsert_routing(
     app: Application,
     code: str,
     dest_chat_id: int,
@@ -1190,125 +3361,47 @@ def pairing_consume_and_upsert_routing(
     dest_kind: str,
 ) -> Dict[str, Any]:
     """
-    Consume PAIRING (marca used=1) y actualiza ROUTING.
+    Consume el código (SQLite) y actualiza la ruta: cache en memoria al instante,
+    parche de columnas ROUTING al outbox (op PATCH).
     dest_kind: 'EVIDENCE' o 'SUMMARY' (destino actual)
     Retorna dict con info: origin_chat_id, purpose, alias
     """
-    if not app.bot_data.get("sheets_ready"):
-        raise RuntimeError("Sheets no disponible.")
-    ws_p = app.bot_data.get("ws_pairing")
-    ws_r = app.bot_data.get("ws_routing")
-    if not ws_p or not ws_r:
-        raise RuntimeError("Hojas de configuración no disponibles.")
+    info = await db_write(pairing_consume, code, dest_chat_id, used_by, purpose_expected)
+    origin_chat_id = int(info["origin_chat_id"])
 
-    _ensure_headers(ws_p, PAIRING_COLUMNS)
-    _ensure_headers(ws_r, ROUTING_COLUMNS)
+    rc = app.bot_data.get("routing_cache") or {}
+    current = dict(rc.get(origin_chat_id) or {})
+    alias = _safe_str(current.get("alias")) or f"ORIGEN {origin_chat_id}"
 
-    code = str(code).strip().upper()
-    row_idx = _find_row_index_by_column(ws_p, "code", code)
-    if row_idx is None:
-        raise RuntimeError("Código no encontrado.")
+    # Solo las columnas que cambian (como antes: destino, activo, updated_*; alias si está vacío).
+    # Nunca la fila completa: no pisa ediciones manuales hechas en ROUTING desde el último refresh.
+    patch: Dict[str, Any] = {
+        "origin_chat_id": str(origin_chat_id),
+        "activo": "1",
+        "updated_by": used_by,
+        "updated_at": _utc_iso_now(),
+        "_if_empty": {"alias": alias},
+    }
+    if dest_kind == "EVIDENCE":
+        patch["evidence_chat_id"] = str(dest_chat_id)
+    else:
+        patch["summary_chat_id"] = str(dest_chat_id)
+    await db_write(outbox_enqueue, "ROUTING", "PATCH", str(origin_chat_id), patch)
 
-    # Leer fila
-    values = ws_p.get_all_values()
-    headers = values[0]
-    row = values[row_idx - 1] if row_idx - 1 < len(values) else []
-    col = {h: i for i, h in enumerate(headers)}
-
-    def get_cell(name: str) -> str:
-        i = col.get(name)
-        if i is None:
-            return ""
-        return row[i] if i < len(row) else ""
-
-    used = _parse_bool01(get_cell("used"))
-    if used == 1:
-        raise RuntimeError("Este código ya fue usado.")
-
-    purpose = _safe_str(get_cell("purpose")).upper()
-    if purpose not in ("EVIDENCE", "SUMMARY"):
-        raise RuntimeError("Código inválido (purpose).")
-    if purpose_expected and purpose != purpose_expected:
-        raise RuntimeError(f"Este código es para {purpose}, no para {purpose_expected}.")
-
-    expires_at = _safe_str(get_cell("expires_at"))
-    dt_exp = parse_iso(expires_at)
-    if not dt_exp:
-        raise RuntimeError("Código inválido (expires_at).")
-    if datetime.now(timezone.utc) > dt_exp:
-        raise RuntimeError("Este código está vencido. Genera uno nuevo en el grupo ORIGEN.")
-
-    origin_chat_id = _safe_int(get_cell("origin_chat_id"))
-    if origin_chat_id is None:
-        raise RuntimeError("Código inválido (origin_chat_id).")
-
-    # Marcar como usado
-    used_at = _utc_iso_now()
-    _update_cells_by_headers(ws_p, row_idx, {"used": "1", "used_by": used_by, "used_at": used_at})
-
-    # Upsert ROUTING: buscar fila por origin_chat_id
-    origin_str = str(origin_chat_id)
-    r_idx = _find_row_index_by_column(ws_r, "origin_chat_id", origin_str)
-
-    alias = ""
-    try:
-        # alias sugerido: si el origen ya está en cache
-        rc = app.bot_data.get("routing_cache") or {}
-        if rc.get(int(origin_chat_id)):
-            alias = _safe_str(rc[int(origin_chat_id)].get("alias"))
-    except Exception:
-        pass
+    row = dict(current)
+    if not _safe_str(row.get("alias")):
+        row["alias"] = alias
+    row.update({k: v for k, v in patch.items() if k != "_if_empty"})
 
-    if not alias:
-        alias = f"ORIGEN {origin_chat_id}"
-
-    upd_by = used_by
-    upd_at = _utc_iso_now()
-
-    if r_idx is None:
-        # Crear fila nueva
-        new_row = {
-            "origin_chat_id": origin_str,
-            "evidence_chat_id": str(dest_chat_id) if dest_kind == "EVIDENCE" else "",
-            "summary_chat_id": str(dest_chat_id) if dest_kind == "SUMMARY" else "",
-            "alias": alias,
-            "activo": "1",
-            "updated_by": upd_by,
-            "updated_at": upd_at,
-        }
-        ws_r.append_row([new_row.get(c, "") for c in ROUTING_COLUMNS], value_input_option="RAW")
-    else:
-        # Actualizar fila existente: set dest, activar, updated_*
-        updates = {
-            "activo": "1",
-            "updated_by": upd_by,
-            "updated_at": upd_at,
-        }
-        if dest_kind == "EVIDENCE":
-            updates["evidence_chat_id"] = str(dest_chat_id)
-        else:
-            updates["summary_chat_id"] = str(dest_chat_id)
-        # Si alias está vacío en la hoja, setear
-        # (leemos de la hoja para decidir)
-        vals_r = ws_r.get_all_values()
-        hdr_r = vals_r[0]
-        try:
-            ci_alias = hdr_r.index("alias")
-        except ValueError:
-            ci_alias = None
-        current_alias = ""
-        if ci_alias is not None and (r_idx - 1) < len(vals_r):
-            rr = vals_r[r_idx - 1]
-            current_alias = rr[ci_alias] if ci_alias < len(rr) else ""
-        if not str(current_alias).strip():
-            updates["alias"] = alias
-
-        _update_cells_by_headers(ws_r, r_idx, updates)
-
-    # refrescar cache routing inmediatamente
-    load_routing_cache(app)
+    # ruta vigente de inmediato (load_routing_cache la respeta mientras siga en el outbox)
+    new_rc = dict(rc)
+    new_rc[origin_chat_id] = _routing_entry(row)
+    app.bot_data["routing_cache"] = new_rc
+    app.bot_data.setdefault("config_dirty", set()).add("routing_cache")
+    chat_settings_invalidate()
+    await config_snapshot_flush(app)
 
-    return {"origin_chat_id": int(origin_chat_id), "purpose": purpose, "alias": alias}
+    return {"origin_chat_id": origin_chat_id, "purpose": info["purpose"], "alias": alias}
 
 # =========================
 # Admin helper
@@ -1364,44 +3457,91 @@ def get_mode_items(mode: str) -> List[Tuple[int, str, int]]:
     return EXTERNA_MENU if mode == "EXTERNA" else INTERNA_MENU
 
 
-def step_status(case_id: int, step_no: int) -> str:
+def get_case_progress(case_id: int) -> Dict[int, Dict[str, Any]]:
+    """
+    Estado de todos los pasos del caso en UNA consulta agrupada (step_state + conteo de media).
+    Retorna {step_no: {"status", "attempt", "submitted_attempt", "approved", "media_count"}}:
+      - attempt / media_count: último intento (enviado o no) y sus archivos
+      - submitted_attempt / approved: último intento enviado a revisión y su resultado
+    """
     with db() as conn:
-        in_prog = conn.execute(
-            "SELECT 1 FROM step_state WHERE case_id=? AND step_no=? AND submitted=0 ORDER BY attempt DESC LIMIT 1",
-            (case_id, step_no),
-        ).fetchone()
-    if in_prog:
-        return "IN_PROGRESS"
+        rows = conn.execute(
+            """
+            SELECT s.step_no, s.attempt, s.submitted, s.approved, COUNT(m.media_id) AS media_count
+            FROM step_state s
+            LEFT JOIN media m
+              ON m.case_id=s.case_id AND m.step_no=s.step_no AND m.attempt=s.attempt
+            WHERE s.case_id=?
+            GROUP BY s.step_no, s.attempt
+            ORDER BY s.step_no ASC, s.attempt ASC
+            """,
+            (case_id,),
+        ).fetchall()
+
+    progress: Dict[int, Dict[str, Any]] = {}
+    for r in rows:
+        p = progress.setdefault(
+            int(r["step_no"]),
+            {"in_progress": False, "attempt": 0, "submitted_attempt": None, "approved": None, "media_count": 0},
+        )
+        p["attempt"] = int(r["attempt"])
+        p["media_count"] = int(r["media_count"] or 0)
+        if int(r["submitted"]) == 1:
+            p["submitted_attempt"] = int(r["attempt"])
+            p["approved"] = r["approved"]
+        else:
+            p["in_progress"] = True
+
+    for p in progress.values():
+        if p.pop("in_progress"):
+            p["status"] = "IN_PROGRESS"
+        elif p["submitted_attempt"] is None:
+            p["status"] = "NOT_STARTED"
+        elif p["approved"] is None:
+            p["status"] = "IN_REVIEW"
+        elif int(p["approved"]) == 1:
+            p["status"] = "DONE"
+        else:
+            p["status"] = "REJECTED"
+    return progress
 
-    last = get_latest_submitted_state(case_id, step_no)
-    if not last:
-        return "NOT_STARTED"
-    if last["approved"] is None:
-        return "IN_REVIEW"
-    if int(last["approved"]) == 1:
-        return "DONE"
-    return "REJECTED"
 
+def progress_status(progress: Dict[int, Dict[str, Any]], step_no: int) -> str:
+    p = progress.get(step_no)
+    return p["status"] if p else "NOT_STARTED"
 
-def compute_next_required_step(case_id: int, mode: str) -> Tuple[int, str, int, str]:
+
+def compute_next_required_step(
+    case_id: int,
+    mode: str,
+    progress: Optional[Dict[int, Dict[str, Any]]] = None,
+) -> Tuple[int, str, int, str]:
+    if progress is None:
+        progress = get_case_progress(case_id)
     items = get_mode_items(mode)
     for num, label, step_no in items:
-        st = step_status(case_id, step_no)
+        st = progress_status(progress, step_no)
         if st != "DONE":
             return (num, label, step_no, st)
     last_num, last_label, last_step = items[-1]
     return (last_num, last_label, last_step, "DONE")
 
 
-def kb_evidence_menu(case_id: int, mode: str) -> InlineKeyboardMarkup:
+def kb_evidence_menu(
+    case_id: int,
+    mode: str,
+    progress: Optional[Dict[int, Dict[str, Any]]] = None,
+) -> InlineKeyboardMarkup:
+    if progress is None:
+        progress = get_case_progress(case_id)
     items = get_mode_items(mode)
-    req_num, req_label, req_step_no, _req_status = compute_next_required_step(case_id, mode)
+    req_num, req_label, req_step_no, _req_status = compute_next_required_step(case_id, mode, progress)
 
     rows: List[List[InlineKeyboardButton]] = []
     rows.append([InlineKeyboardButton("↩️ VOLVER AL MENU ANTERIOR", callback_data="BACK|MODE")])
 
     for num, label, step_no in items:
-        st = step_status(case_id, step_no)
+        st = progress_status(progress, step_no)
 
         if st == "DONE":
             prefix = "🟢"
@@ -1533,7 +3673,7 @@ def prompt_auth_media_step(step_no: int) -> str:
     )
 
 
-async def show_evidence_menu(chat_id: int, context: ContextTypes.DEFAULT_TYPE, case_row: sqlite3.Row):
+async def show_evidence_menu(chat_id: int, context: ContextTypes.DEFAULT_TYPE, case_row: Dict[str, Any]):
     mode = (case_row["install_mode"] or "").strip()
     if mode not in ("EXTERNA", "INTERNA"):
         await context.bot.send_message(chat_id=chat_id, text="Selecciona el tipo de instalación:", reply_markup=kb_install_mode())
@@ -1542,7 +3682,7 @@ async def show_evidence_menu(chat_id: int, context: ContextTypes.DEFAULT_TYPE, c
     await context.bot.send_message(
         chat_id=chat_id,
         text=f"📌 Selecciona la evidencia a cargar ({mode}):",
-        reply_markup=kb_evidence_menu(int(case_row["case_id"]), mode),
+        reply_markup=await db_read(kb_evidence_menu, int(case_row["case_id"]), mode),
     )
 
 
@@ -1602,7 +3742,7 @@ async def config_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     app = context.application
     if app.bot_data.get("sheets_ready"):
         if not app.bot_data.get("routing_cache"):
-            load_routing_cache(app)
+            await aload_routing_cache(app)
 
     await context.bot.send_message(
         chat_id=msg.chat_id,
@@ -1620,15 +3760,15 @@ async def inicio_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = msg.from_user.id
     username = msg.from_user.username or msg.from_user.full_name
 
-    create_or_reset_case(chat_id, user_id, username)
+    await db_write(create_or_reset_case, chat_id, user_id, username)
 
-    approval_required = get_approval_required(chat_id)
+    approval_required = (await aget_chat_settings(context.application, chat_id))["approval_required"]
     extra = "✅ Aprobación: ON (requiere admin)" if approval_required else "⚠️ Aprobación: OFF (auto-aprobación)"
 
     # Asegurar cache técnicos si posible
     app = context.application
     if app.bot_data.get("sheets_ready") and not app.bot_data.get("tech_cache"):
-        load_tecnicos_cache(app)
+        await aload_tecnicos_cache(app)
 
     # Si aún no hay técnicos activos (ni fallback), avisar
     tech_cache = app.bot_data.get("tech_cache") or []
@@ -1654,12 +3794,12 @@ async def cancelar_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if msg is None or msg.from_user is None:
         return
 
-    case_row = get_open_case(msg.chat_id, msg.from_user.id)
+    case_row = await aget_open_case(msg.chat_id, msg.from_user.id)
     if not case_row:
         await context.bot.send_message(chat_id=msg.chat_id, text="No tienes un caso abierto.")
         return
 
-    update_case(int(case_row["case_id"]), status="CANCELLED", phase="CANCELLED", finished_at=now_utc())
+    await db_write(update_case, int(case_row["case_id"]), status="CANCELLED", phase="CANCELLED", finished_at=now_utc())
     await context.bot.send_message(chat_id=msg.chat_id, text="🧾 Caso cancelado. Puedes iniciar otro con /inicio.")
 
 
@@ -1668,14 +3808,26 @@ async def estado_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if msg is None or msg.from_user is None:
         return
 
-    case_row = get_open_case(msg.chat_id, msg.from_user.id)
+    case_row = await aget_open_case(msg.chat_id, msg.from_user.id)
     if not case_row:
         await context.bot.send_message(chat_id=msg.chat_id, text="No tienes un caso abierto. Usa /inicio.")
         return
 
-    approval_required = get_approval_required(msg.chat_id)
+    approval_required = (await aget_chat_settings(context.application, msg.chat_id))["approval_required"]
     approval_txt = "ON ✅" if approval_required else "OFF ⚠️ (auto)"
 
+    mode = (case_row["install_mode"] or "").strip()
+    progress_txt = ""
+    if mode in ("EXTERNA", "INTERNA"):
+        case_id = int(case_row["case_id"])
+        progress = await db_read(get_case_progress, case_id)
+        items = get_mode_items(mode)
+        done = sum(1 for _n, _l, sn in items if progress_status(progress, sn) == "DONE")
+        req_num, req_label, _req_step_no, req_status = compute_next_required_step(case_id, mode, progress)
+        progress_txt = f"• Pasos conformes: {done}/{len(items)}\n"
+        if req_status != "DONE":
+            progress_txt += f"• Siguiente: {req_num}. {req_label} ({req_status})\n"
+
     await context.bot.send_message(
         chat_id=msg.chat_id,
         text=(
@@ -1688,6 +3840,7 @@ async def estado_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"• Técnico: {case_row['technician_name'] or '(pendiente)'}\n"
             f"• Servicio: {case_row['service_type'] or '(pendiente)'}\n"
             f"• Abonado: {case_row['abonado_code'] or '(pendiente)'}\n"
+            f"{progress_txt}"
         ),
     )
 
@@ -1704,16 +3857,17 @@ async def aprobacion_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     args = context.args or []
     if not args:
-        state = "ON ✅" if get_approval_required(msg.chat_id) else "OFF ⚠️ (auto)"
+        settings = await aget_chat_settings(context.application, msg.chat_id)
+        state = "ON ✅" if settings["approval_required"] else "OFF ⚠️ (auto)"
         await context.bot.send_message(chat_id=msg.chat_id, text=f"Estado de aprobación: {state}")
         return
 
     val = args[0].strip().lower()
     if val in ("on", "1", "true", "si", "sí", "activar"):
-        set_approval_required(msg.chat_id, True)
+        await db_write(set_approval_required, msg.chat_id, True)
         await context.bot.send_message(chat_id=msg.chat_id, text="✅ Aprobación ENCENDIDA. Se requiere validación de admins.")
     elif val in ("off", "0", "false", "no", "desactivar"):
-        set_approval_required(msg.chat_id, False)
+        await db_write(set_approval_required, msg.chat_id, False)
         await context.bot.send_message(chat_id=msg.chat_id, text="⚠️ Aprobación APAGADA. Los pasos se auto-aprobarán (APROBACION OFF).")
     else:
         await context.bot.send_message(chat_id=msg.chat_id, text="Uso: /aprobacion on  o  /aprobacion off")
@@ -1721,7 +3875,7 @@ async def aprobacion_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # =========================
 # Sheets writers (enqueue) - historial
 # =========================
-def enqueue_evidencia_row(case_row: sqlite3.Row, step_no: int, attempt: int, file_id: str, file_unique_id: str, tg_message_id: int, grupo_evidencias: Optional[int]):
+def enqueue_evidencia_row(case_row: Dict[str, Any], step_no: int, attempt: int, file_id: str, file_unique_id: str, tg_message_id: int, grupo_evidencias: Optional[int]):
     created_at = now_utc()
     dt = parse_iso(created_at)
     fecha = dt.astimezone(PERU_TZ).strftime("%Y-%m-%d") if dt else ""
@@ -1804,9 +3958,10 @@ def enqueue_caso_row(case_id: int):
     mode = (case_row["install_mode"] or "").strip()
     total_pasos = len(get_mode_items(mode)) if mode in ("EXTERNA", "INTERNA") else ""
 
-    aprob = total_approved_steps_for_case(case_id)
-    rech = total_rejects_for_case(case_id)
-    total_evid = total_media_for_case(case_id)
+    stats = get_case_stats(case_id)
+    aprob = stats["approved_steps"]
+    rech = stats["rejected_steps"]
+    total_evid = stats["total_media"]
     approval_required = get_approval_required(int(case_row["chat_id"]))
 
     row = {
@@ -1845,62 +4000,306 @@ def auto_approve_db_step(case_id: int, db_step_no: int, attempt: int):
     Marca submitted=1 y approved=1, con reviewed_by=0 (sistema) y reviewed_at=now.
     """
     with db() as conn:
-        conn.execute(
-            """
-            UPDATE step_state
-            SET submitted=1, approved=1, reviewed_by=?, reviewed_at=?
-            WHERE case_id=? AND step_no=? AND attempt=?
-            """,
-            (0, now_utc(), case_id, db_step_no, attempt),
+        _set_step_approved(
+            conn, case_id, db_step_no, attempt, 1,
+            "submitted=1, approved=1, reviewed_by=?, reviewed_at=?",
+            (0, now_utc()),
         )
         conn.commit()
 
 # =========================
 # Sheets worker (reintentos) - historial
 # =========================
-async def sheets_worker(context: ContextTypes.DEFAULT_TYPE):
-    if "sheets_ready" not in context.application.bot_data:
-        return
-    if not context.application.bot_data.get("sheets_ready"):
+def _joined_key(cols: List[str]):
+    return lambda v: "|".join(v.get(c, "") for c in cols).strip()
+
+
+def _detalle_pasos_key(v: Dict[str, str]) -> str:
+    # Igual que enqueue_detalle_paso_row: el permiso se distingue por "PERMISO - " en paso_nombre
+    kind = "PERM" if v.get("paso_nombre", "").startswith("PERMISO - ") else "EVID"
+    return f"{v.get('case_id', '')}|{v.get('paso_numero', '')}|{v.get('attempt', '')}|{kind}"
+
+
+HISTORY_SHEETS: Dict[str, Dict[str, Any]] = {
+    "CASOS": {
+        "ws": "ws_casos",
+        "priority": 1,
+        "columns": CASOS_COLUMNS,
+        "key_cols": ["case_id"],
+        "scan_cols": ["case_id"],
+        "key_fn": _joined_key(["case_id"]),
+    },
+    "DETALLE_PASOS": {
+        "ws": "ws_det",
+        "priority": 2,
+        "columns": DETALLE_PASOS_COLUMNS,
+        "key_cols": ["case_id", "paso_numero", "attempt"],
+        "scan_cols": ["case_id", "paso_numero", "attempt", "paso_nombre"],
+        "key_fn": _detalle_pasos_key,
+    },
+    # Configuración escrita por el bot (pairing local): auditoría/ruta en Sheets vía outbox
+    "ROUTING": {
+        "ws": "ws_routing",
+        "priority": 1,
+        "columns": ROUTING_COLUMNS,
+        "key_cols": ["origin_chat_id"],
+        "scan_cols": ["origin_chat_id"],
+        "key_fn": _joined_key(["origin_chat_id"]),
+    },
+    "PAIRING": {
+        "ws": "ws_pairing",
+        "priority": 4,
+        "columns": PAIRING_COLUMNS,
+        "key_cols": ["code"],
+        "scan_cols": ["code"],
+        "key_fn": _joined_key(["code"]),
+    },
+    # Una fila por mensaje de Telegram, nunca se actualiza: sin índice de filas
+    "EVIDENCIAS": {
+        "ws": "ws_evid",
+        "priority": 3,
+        "columns": EVIDENCIAS_COLUMNS,
+        "append_only": True,
+    },
+}
+
+
+async def _outbox_fail(outbox_id: int, sheet_name: str, attempts: int, err: str) -> None:
+    if _is_quota_sheet_error(err):
+        # 429 no es culpa de la fila: no consume intento, reintenta al terminar la pausa
+        wait = max(sheets_quota_wait_sec(), 1.0)
+        retry_at = (datetime.now(timezone.utc) + timedelta(seconds=wait)).isoformat()
+        await db_write(outbox_mark_failed, outbox_id, attempts - 1, err, retry_at=retry_at, owner=OUTBOX_WORKER_ID)
         return
+    dead = _is_permanent_sheet_error(err) or attempts >= 8
+    await db_write(outbox_mark_failed, outbox_id, attempts, err, dead=dead, owner=OUTBOX_WORKER_ID)
+    log.warning(f"Sheets worker error outbox_id={outbox_id} sheet={sheet_name} attempts={attempts}: {err}")
+
+
+# Tamaño de lote adaptativo por carril (AIMD): crece aditivo con ciclos sanos y llenos,
+# se reduce a la mitad ante 429 y un 25% si la latencia supera el objetivo.
+_outbox_batch: Dict[str, int] = {}
+
+
+def _lane_batch_size(sheet_name: str) -> int:
+    return _outbox_batch.setdefault(sheet_name, max(OUTBOX_BATCH_MIN, min(OUTBOX_BATCH_MAX, OUTBOX_BATCH_SIZE)))
+
+
+def _outbox_batch_feedback(sheet_name: str, fetched: int, latency: float, quota_hit: bool, errors: int) -> None:
+    size = _lane_batch_size(sheet_name)
+    if quota_hit:
+        new = size // 2
+    elif latency > SHEETS_LATENCY_TARGET_SEC or errors:
+        new = int(size * 0.75)
+    elif fetched >= size:
+        new = size + OUTBOX_BATCH_STEP
+    else:
+        new = size
+    new = max(OUTBOX_BATCH_MIN, min(OUTBOX_BATCH_MAX, new))
+    if new != size:
+        _outbox_batch[sheet_name] = new
+        log.info(f"Sheets worker {sheet_name}: lote {size} -> {new} (latencia {latency:.1f}s, 429={quota_hit}, errores={errors}).")
+
+
+def _lane_priority(sheet_name: str) -> int:
+    return int(OUTBOX_LANE_PRIORITY.get(sheet_name, HISTORY_SHEETS[sheet_name].get("priority", 9)))
+
+
+async def sheets_flush_once(app: Application, sheet_name: str) -> Tuple[int, int]:
+    """
+    Un ciclo de envío del carril `sheet_name`. Retorna (filas leídas, filas resueltas SENT/FAILED/DEAD).
+    """
+    if not app.bot_data.get("sheets_ready"):
+        return 0, 0
+    if sheets_quota_wait_sec() > 0:
+        return 0, 0
 
-    ws_casos = context.application.bot_data["ws_casos"]
-    ws_det = context.application.bot_data["ws_det"]
-    ws_evid = context.application.bot_data["ws_evid"]
-    idx_casos = context.application.bot_data["idx_casos"]
-    idx_det = context.application.bot_data["idx_det"]
-    idx_evid = context.application.bot_data["idx_evid"]
+    spec = HISTORY_SHEETS[sheet_name]
+    if not spec.get("append_only") and sheet_name not in (app.bot_data.get("sheet_index_seeded") or set()):
+        # sin índice sembrado no sabemos qué filas existen (duplicaría); espera a la verificación
+        return 0, 0
 
-    batch = outbox_fetch_batch(limit=20)
+    bot_data = app.bot_data
+    batch = await db_write(outbox_claim_batch, _lane_batch_size(sheet_name), sheet_name, OUTBOX_WORKER_ID)
     if not batch:
-        return
+        return 0, 0
 
-    for item in batch:
-        outbox_id = int(item["outbox_id"])
-        sheet_name = item["sheet_name"]
-        dedupe_key = item["dedupe_key"]
-        attempts = int(item["attempts"]) + 1
-        row_json = item["row_json"]
+    resolved = 0
+    attempts_by_id = {int(it["outbox_id"]): int(it["attempts"]) + 1 for it in batch}
+    items: List[Tuple[int, str, Dict[str, Any]]] = []
+    for it in batch:
+        outbox_id = int(it["outbox_id"])
+        try:
+            items.append((outbox_id, it["dedupe_key"], json.loads(it["row_json"])))
+        except Exception as e:
+            await _outbox_fail(outbox_id, sheet_name, attempts_by_id[outbox_id], f"row_json inválido: {e}")
+            resolved += 1
+    if not items:
+        return len(batch), resolved
+
+    priority = _lane_priority(sheet_name)
+    t0 = time.monotonic()
+    if spec.get("append_only"):
+        try:
+            results = await sheets_call_settled(
+                sheet_append_batch, bot_data[spec["ws"]], items, spec["columns"], priority=priority
+            )
+        except Exception as e:
+            results = {outbox_id: str(e) for outbox_id, _k, _r in items}
+    else:
+        async with _sheet_lock(sheet_name):
+            results = {}
+            patch_ids = {int(it["outbox_id"]) for it in batch if it["op_type"] == "PATCH"}
+            for fn, group in (
+                (sheet_upsert_batch, [it for it in items if it[0] not in patch_ids]),
+                (sheet_patch_batch, [it for it in items if it[0] in patch_ids]),
+            ):
+                if not group:
+                    continue
+                try:
+                    index = await db_read(sheet_row_index_get, sheet_name, [k for _i, k, _r in group])
+                    known = dict(index)
+                    results.update(
+                        await sheets_call_settled(
+                            fn,
+                            bot_data[spec["ws"]],
+                            index,
+                            group,
+                            spec["columns"],
+                            spec["key_cols"],
+                            scan_cols=spec["scan_cols"],
+                            key_fn=spec["key_fn"],
+                            priority=priority,
+                        )
+                    )
+                    await db_write(sheet_row_index_put, sheet_name, {k: r for k, r in index.items() if known.get(k) != r})
+                except Exception as e:
+                    results.update({outbox_id: str(e) for outbox_id, _k, _r in group})
+    latency = time.monotonic() - t0
+
+    errors = 0
+    quota_hit = False
+    sent = [outbox_id for outbox_id, err in results.items() if err is None]
+    await db_write(outbox_mark_sent, sent, OUTBOX_WORKER_ID)
+    for outbox_id, err in results.items():
+        if err is not None:
+            errors += 1
+            quota_hit = quota_hit or _is_quota_sheet_error(err)
+            await _outbox_fail(outbox_id, sheet_name, attempts_by_id[outbox_id], err)
+    resolved += len(results)
+    if sent:
+        log.info(f"Sheets worker: {len(sent)} filas sincronizadas en {sheet_name}.")
+
+    _outbox_batch_feedback(sheet_name, len(batch), latency, quota_hit, errors)
+    return len(batch), resolved
+
+
+async def sheets_lane_loop(app: Application, sheet_name: str) -> None:
+    """
+    Carril del outbox para una hoja, dirigido por eventos:
+      - outbox_enqueue despierta al carril (outbox_notify) y tras OUTBOX_COALESCE_SEC se envía el lote
+      - si el lote salió lleno, sigue de inmediato (drenar backlog)
+      - si no hay nada pendiente duerme sin límite; si hay FAILED, hasta su next_retry_at
+    Los carriles corren en paralelo; la prioridad decide quién toma la cuota primero.
+    """
+    event = asyncio.Event()
+    _outbox_wakeup["events"][sheet_name] = event
+    event.set()  # primer ciclo: lo que haya quedado pendiente antes del arranque
 
+    while True:
         try:
-            row = json.loads(row_json)
-            if sheet_name == "CASOS":
-                sheet_upsert(ws_casos, idx_casos, dedupe_key, row, CASOS_COLUMNS, ["case_id"])
-            elif sheet_name == "DETALLE_PASOS":
-                sheet_upsert(ws_det, idx_det, dedupe_key, row, DETALLE_PASOS_COLUMNS, ["case_id", "paso_numero", "attempt"])
-            elif sheet_name == "EVIDENCIAS":
-                sheet_upsert(ws_evid, idx_evid, dedupe_key, row, EVIDENCIAS_COLUMNS, ["case_id", "paso_numero", "attempt", "mensaje_telegram_id"])
-            else:
-                raise RuntimeError(f"Hoja desconocida: {sheet_name}")
+            wait = await db_read(outbox_next_due_sec, sheet_name)
+        except Exception as e:
+            # error transitorio de SQLite (p.ej. database is locked): reintentar, no matar el carril
+            log.warning(f"Sheets worker {sheet_name} error leyendo el outbox: {e}")
+            wait = OUTBOX_STALL_RECHECK_SEC
+        if wait is None or wait > 0:
+            try:
+                await asyncio.wait_for(event.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+        event.clear()
+        await asyncio.sleep(OUTBOX_COALESCE_SEC)
+
+        try:
+            fetched, resolved = await sheets_flush_once(app, sheet_name)
+        except Exception as e:
+            log.warning(f"Sheets worker {sheet_name} error: {e}")
+            fetched, resolved = 0, 0
+
+        if fetched and fetched >= _lane_batch_size(sheet_name) and resolved:
+            event.set()
+            continue
+        if not resolved and (fetched or wait == 0):
+            # había trabajo pero no avanzó (pausa por cuota / índice sin sembrar): no girar en vacío
+            pause = sheets_quota_wait_sec() or OUTBOX_STALL_RECHECK_SEC
+            try:
+                await asyncio.wait_for(event.wait(), timeout=pause)
+            except asyncio.TimeoutError:
+                pass
+            event.set()
+
+
+async def sheets_worker_start(context: ContextTypes.DEFAULT_TYPE) -> None:
+    app = context.application
+    if app.bot_data.get("sheets_worker_tasks"):
+        return
+    dead = await db_write(outbox_fail_unknown_sheets, list(HISTORY_SHEETS.keys()))
+    if dead:
+        log.warning(f"Sheets worker: {dead} filas con hoja desconocida marcadas DEAD.")
+    if OUTBOX_WORKER_ID_FIXED:
+        # id propio y fijo: lo que quedó en vuelo con él es de una ejecución anterior de este worker
+        released = await db_write(outbox_release_leases, OUTBOX_WORKER_ID)
+        if released:
+            log.info(f"Sheets worker: {released} filas en vuelo de la ejecución anterior devueltas a la cola.")
+
+    loop = asyncio.get_running_loop()
+    _outbox_wakeup["loop"] = loop
+    lanes = sorted(HISTORY_SHEETS.keys(), key=_lane_priority)
+    app.bot_data["sheets_worker_tasks"] = [loop.create_task(sheets_lane_loop(app, name)) for name in lanes]
+    log.info(f"Sheets worker: carriles {', '.join(f'{n}(p{_lane_priority(n)})' for n in lanes)} iniciados.")
+
+
+async def sheets_worker_stop(app: Application) -> None:
+    tasks = app.bot_data.pop("sheets_worker_tasks", None) or []
+    _outbox_wakeup["loop"] = None
+    _outbox_wakeup["events"].clear()
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
 
-            outbox_mark_sent(outbox_id)
 
+async def sheet_index_verify_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Job: siembra (primera vez) y verifica sheet_row_index contra las columnas clave de cada hoja.
+    Corrige drift si alguien editó, borró u ordenó filas a mano.
+    """
+    app = context.application
+    if not app.bot_data.get("sheets_ready"):
+        return
+    seeded = app.bot_data.setdefault("sheet_index_seeded", set())
+    for sheet_name, spec in HISTORY_SHEETS.items():
+        if spec.get("append_only"):
+            continue
+        ws = app.bot_data.get(spec["ws"])
+        if not ws:
+            continue
+        try:
+            async with _sheet_lock(sheet_name):
+                index = await sheets_call(build_index, ws, spec["scan_cols"], spec["key_fn"], priority=9)
+                changed, removed = await db_write(sheet_row_index_sync, sheet_name, index)
+            if sheet_name not in seeded:
+                seeded.add(sheet_name)
+                outbox_notify(sheet_name)  # sus filas pendientes ya pueden enviarse
+                log.info(f"Índice {sheet_name}: sembrado con {len(index)} filas.")
+            elif changed or removed:
+                log.warning(f"Índice {sheet_name}: drift corregido ({changed} filas movidas/nuevas, {removed} eliminadas).")
         except Exception as e:
-            err = str(e)
-            dead = _is_permanent_sheet_error(err) or attempts >= 8
-            outbox_mark_failed(outbox_id, attempts, err, dead=dead)
-            log.warning(f"Sheets worker error outbox_id={outbox_id} sheet={sheet_name} attempts={attempts}: {err}")
-            await context.application.bot.loop.run_in_executor(None, time.sleep, 0.2)
+            log.warning(f"Índice {sheet_name}: verificación falló: {e}")
 
 # =========================
 # Callbacks
@@ -1941,7 +4340,7 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if len(parts) >= 3 and parts[1] == "ROUTE" and parts[2] == "STATUS":
             app = context.application
             if app.bot_data.get("sheets_ready") and not app.bot_data.get("routing_cache"):
-                load_routing_cache(app)
+                await aload_routing_cache(app)
 
             rc = app.bot_data.get("routing_cache") or {}
             # Si este chat es ORIGEN
@@ -1988,10 +4387,6 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
 
             app = context.application
-            if not app.bot_data.get("sheets_ready"):
-                await safe_q_answer(q, "Sheets no disponible.", show_alert=True)
-                await safe_edit_message_text(q, "⚠️ Sheets no está disponible. Revisa credenciales / conexión.", reply_markup=kb_back_to_config())
-                return
 
             # Heurística:
             # - Si el chat actual está como ORIGEN (en ROUTING) o si el admin quiere iniciar desde ORIGEN,
@@ -2000,8 +4395,8 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Para hacerlo más intuitivo: si el admin está en un chat que NO es ORIGEN, asumimos DESTINO.
 
             # Asegurar cache routing
-            if not app.bot_data.get("routing_cache"):
-                load_routing_cache(app)
+            if app.bot_data.get("sheets_ready") and not app.bot_data.get("routing_cache"):
+                await aload_routing_cache(app)
 
             rc = app.bot_data.get("routing_cache") or {}
             is_origin = int(chat_id) in rc  # ya registrado como ORIGEN
@@ -2013,7 +4408,12 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             #     2) Si es ORIGEN: generar
             if is_origin:
                 try:
-                    code = pairing_create(app, origin_chat_id=int(chat_id), purpose=purpose, created_by=q.from_user.full_name)
+                    code = await db_write(
+                        pairing_create,
+                        origin_chat_id=int(chat_id),
+                        purpose=purpose,
+                        created_by=q.from_user.full_name,
+                    )
                     expires_dt = datetime.now(PERU_TZ) + timedelta(minutes=PAIRING_TTL_MINUTES)
                     expires_txt = expires_dt.strftime("%H:%M")
                     label = "EVIDENCIAS" if purpose == "EVIDENCE" else "RESUMEN"
@@ -2034,7 +4434,7 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 # Consumir (DESTINO): pedimos código por texto
                 kind = "PAIR_CODE_EVID" if purpose == "EVIDENCE" else "PAIR_CODE_SUM"
-                set_pending_input(chat_id=chat_id, user_id=user_id, kind=kind, case_id=0, step_no=0, attempt=0, reply_to_message_id=q.message.message_id)
+                await db_write(set_pending_input, chat_id=chat_id, user_id=user_id, kind=kind, case_id=0, step_no=0, attempt=0, reply_to_message_id=q.message.message_id)
                 label = "EVIDENCIAS" if purpose == "EVIDENCE" else "RESUMEN"
                 txt = (
                     f"🔗 Vincular {label}\n"
@@ -2052,11 +4452,11 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # FLUJO ORIGINAL (casos/evidencias)
     # -------------------------
     if data == "BACK|MODE":
-        case_row = get_open_case(chat_id, user_id)
+        case_row = await aget_open_case(chat_id, user_id)
         if not case_row:
             await safe_q_answer(q, "No tienes un caso abierto.", show_alert=True)
             return
-        update_case(int(case_row["case_id"]), phase="MENU_INST", pending_step_no=None)
+        await db_write(update_case, int(case_row["case_id"]), phase="MENU_INST", pending_step_no=None)
         await safe_q_answer(q, "Volviendo…", show_alert=False)
         await context.bot.send_message(
             chat_id=chat_id,
@@ -2066,7 +4466,7 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data.startswith("TECH|"):
-        case_row = get_open_case(chat_id, user_id)
+        case_row = await aget_open_case(chat_id, user_id)
         if not case_row:
             await safe_q_answer(q, "No tienes un caso abierto. Usa /inicio.", show_alert=True)
             return
@@ -2075,13 +4475,13 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         name = data.split("|", 1)[1]
-        update_case(int(case_row["case_id"]), technician_name=name, step_index=1, phase="WAIT_SERVICE")
+        await db_write(update_case, int(case_row["case_id"]), technician_name=name, step_index=1, phase="WAIT_SERVICE")
         await safe_q_answer(q, "✅ Técnico registrado", show_alert=False)
         await context.bot.send_message(chat_id=chat_id, text="PASO 2 - TIPO DE SERVICIO", reply_markup=kb_services())
         return
 
     if data.startswith("SERV|"):
-        case_row = get_open_case(chat_id, user_id)
+        case_row = await aget_open_case(chat_id, user_id)
         if not case_row:
             await safe_q_answer(q, "No tienes un caso abierto. Usa /inicio.", show_alert=True)
             return
@@ -2094,13 +4494,13 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_q_answer(q, "PROCESO AUN NO GENERADO", show_alert=True)
             return
 
-        update_case(int(case_row["case_id"]), service_type=service, step_index=2, phase="WAIT_ABONADO")
+        await db_write(update_case, int(case_row["case_id"]), service_type=service, step_index=2, phase="WAIT_ABONADO")
         await safe_q_answer(q, "✅ Servicio registrado", show_alert=False)
         await context.bot.send_message(chat_id=chat_id, text=prompt_step3())
         return
 
     if data.startswith("MODE|"):
-        case_row = get_open_case(chat_id, user_id)
+        case_row = await aget_open_case(chat_id, user_id)
         if not case_row:
             await safe_q_answer(q, "No tienes un caso abierto. Usa /inicio.", show_alert=True)
             return
@@ -2113,9 +4513,9 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_q_answer(q, "Modo inválido.", show_alert=True)
             return
 
-        update_case(int(case_row["case_id"]), install_mode=mode, phase="MENU_EVID", pending_step_no=None)
+        await db_write(update_case, int(case_row["case_id"]), install_mode=mode, phase="MENU_EVID", pending_step_no=None)
         await safe_q_answer(q, f"✅ {mode}", show_alert=False)
-        case_row2 = get_case(int(case_row["case_id"]))
+        case_row2 = await aget_case(int(case_row["case_id"]))
         await show_evidence_menu(chat_id, context, case_row2)
         return
 
@@ -2128,7 +4528,7 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_q_answer(q, "Callback inválido", show_alert=True)
             return
 
-        case_row = get_open_case(chat_id, user_id)
+        case_row = await aget_open_case(chat_id, user_id)
         if not case_row:
             await safe_q_answer(q, "No tienes un caso abierto. Usa /inicio.", show_alert=True)
             return
@@ -2138,19 +4538,20 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         case_id = int(case_row["case_id"])
 
-        req_num, req_label, req_step_no, req_status = compute_next_required_step(case_id, mode)
+        progress = await db_read(get_case_progress, case_id)
+        req_num, req_label, req_step_no, req_status = compute_next_required_step(case_id, mode, progress)
 
         if req_status == "DONE":
             await safe_q_answer(q, "✅ Caso ya completado.", show_alert=True)
             return
 
         if step_no != req_step_no:
-            latest = get_latest_submitted_state(case_id, step_no)
-            if latest and latest["approved"] is not None and int(latest["approved"]) == 1:
+            latest = progress.get(step_no) or {}
+            if latest.get("approved") is not None and int(latest["approved"]) == 1:
                 await safe_q_answer(q, "✅ Este paso ya está conforme.", show_alert=True)
                 return
 
-            st = step_status(case_id, step_no)
+            st = progress_status(progress, step_no)
             if st == "IN_REVIEW":
                 await safe_q_answer(q, "⏳ Este paso está en revisión de admin.", show_alert=True)
                 return
@@ -2162,7 +4563,7 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_q_answer(q, "⏳ Este paso está en revisión de admin. Espera validación.", show_alert=True)
             return
 
-        update_case(case_id, phase="EVID_ACTION", pending_step_no=step_no)
+        await db_write(update_case, case_id, phase="EVID_ACTION", pending_step_no=step_no)
         await safe_q_answer(q, "Continuar…", show_alert=False)
         label = STEP_MEDIA_DEFS.get(step_no, (f"PASO {step_no}", ""))[0]
 
@@ -2182,7 +4583,7 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_q_answer(q, "Callback inválido", show_alert=True)
             return
 
-        case_row = get_case(case_id)
+        case_row = await aget_case(case_id)
         if not case_row or case_row["status"] != "OPEN":
             await safe_q_answer(q, "Caso no válido o cerrado.", show_alert=True)
             return
@@ -2191,7 +4592,7 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         if action == "PERMISO":
-            update_case(case_id, phase="AUTH_MODE", pending_step_no=step_no)
+            await db_write(update_case, case_id, phase="AUTH_MODE", pending_step_no=step_no)
             await safe_q_answer(q, "Permiso…", show_alert=False)
             await context.bot.send_message(
                 chat_id=chat_id,
@@ -2201,7 +4602,7 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         if action == "FOTO":
-            update_case(case_id, phase="STEP_MEDIA", pending_step_no=step_no)
+            await db_write(update_case, case_id, phase="STEP_MEDIA", pending_step_no=step_no)
             await safe_q_answer(q, "Cargar foto…", show_alert=False)
             await context.bot.send_message(chat_id=chat_id, text=prompt_media_step(step_no))
             return
@@ -2218,7 +4619,7 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_q_answer(q, "Callback inválido", show_alert=True)
             return
 
-        case_row = get_case(case_id)
+        case_row = await aget_case(case_id)
         if not case_row or case_row["status"] != "OPEN":
             await safe_q_answer(q, "Caso no válido o cerrado.", show_alert=True)
             return
@@ -2227,13 +4628,13 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         if mode == "TEXT":
-            update_case(case_id, phase="AUTH_TEXT_WAIT", pending_step_no=step_no)
+            await db_write(update_case, case_id, phase="AUTH_TEXT_WAIT", pending_step_no=step_no)
             await safe_q_answer(q, "Envía el texto…", show_alert=False)
             await context.bot.send_message(chat_id=chat_id, text="Envía el texto de la autorización (en un solo mensaje).")
             return
 
         if mode == "MEDIA":
-            update_case(case_id, phase="AUTH_MEDIA", pending_step_no=step_no)
+            await db_write(update_case, case_id, phase="AUTH_MEDIA", pending_step_no=step_no)
             await safe_q_answer(q, "Carga evidencias…", show_alert=False)
             await context.bot.send_message(
                 chat_id=chat_id,
@@ -2258,7 +4659,7 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_q_answer(q, "Callback inválido", show_alert=True)
             return
 
-        case_row = get_case(case_id)
+        case_row = await aget_case(case_id)
         if not case_row or case_row["status"] != "OPEN":
             await safe_q_answer(q, "Caso no válido o cerrado.", show_alert=True)
             return
@@ -2267,7 +4668,7 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         auth_step_no = -step_no
-        st = ensure_step_state(case_id, auth_step_no)
+        st = await db_write(ensure_step_state, case_id, auth_step_no)
         attempt = int(st["attempt"])
 
         if int(st["submitted"]) == 1 and st["approved"] is None:
@@ -2277,25 +4678,25 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_q_answer(q, "✅ Esta autorización ya está aprobada.", show_alert=True)
             return
 
-        count = media_count(case_id, auth_step_no, attempt)
+        count = await db_read(media_count, case_id, auth_step_no, attempt)
         if count <= 0:
             await safe_q_answer(q, "⚠️ Debes cargar al menos 1 archivo.", show_alert=True)
             return
 
-        approval_required = get_approval_required(int(case_row["chat_id"]))
+        approval_required = (await aget_chat_settings(context.application, int(case_row["chat_id"])))["approval_required"]
 
         if not approval_required:
-            auto_approve_db_step(case_id, auth_step_no, attempt)
-            enqueue_detalle_paso_row(case_id, step_no, attempt, "APROBADO", "APROBACION OFF", "", kind="PERM")
+            await db_write(auto_approve_db_step, case_id, auth_step_no, attempt)
+            await db_write(enqueue_detalle_paso_row, case_id, step_no, attempt, "APROBADO", "APROBACION OFF", "", kind="PERM")
 
             await safe_q_answer(q, "✅ Autorización aprobada (OFF)", show_alert=False)
             await safe_edit_message_text(q, "✅ Autorización aprobada automáticamente (APROBACION OFF). Continuando a CARGAR FOTO…")
 
-            update_case(case_id, phase="STEP_MEDIA", pending_step_no=step_no)
+            await db_write(update_case, case_id, phase="STEP_MEDIA", pending_step_no=step_no)
             await context.bot.send_message(chat_id=chat_id, text=prompt_media_step(step_no))
             return
 
-        mark_submitted(case_id, auth_step_no, attempt)
+        await db_write(mark_submitted, case_id, auth_step_no, attempt)
         await safe_q_answer(q, "📨 Enviado a revisión", show_alert=False)
 
         await context.bot.send_message(
@@ -2329,18 +4730,14 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_q_answer(q, "Solo Administradores del grupo pueden validar", show_alert=True)
             return
 
-        case_row = get_case(case_id)
+        case_row = await aget_case(case_id)
         if not case_row or case_row["status"] != "OPEN":
             await safe_q_answer(q, "Caso no válido o cerrado.", show_alert=True)
             return
 
         auth_step_no = -step_no
 
-        with db() as conn:
-            row = conn.execute(
-                "SELECT approved FROM step_state WHERE case_id=? AND step_no=? AND attempt=?",
-                (case_id, auth_step_no, attempt),
-            ).fetchone()
+        row = await db_read(get_step_state, case_id, auth_step_no, attempt)
         if not row:
             await safe_q_answer(q, "No encontré la autorización para revisar.", show_alert=True)
             return
@@ -2352,8 +4749,8 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         admin_name = q.from_user.full_name
 
         if action == "AUT_OK":
-            set_review(case_id, auth_step_no, attempt, approved=1, reviewer_id=user_id)
-            enqueue_detalle_paso_row(case_id, step_no, attempt, "APROBADO", admin_name, "", kind="PERM")
+            await db_write(set_review, case_id, auth_step_no, attempt, approved=1, reviewer_id=user_id)
+            await db_write(enqueue_detalle_paso_row, case_id, step_no, attempt, "APROBADO", admin_name, "", kind="PERM")
 
             await safe_q_answer(q, "✅ Autorizado", show_alert=False)
             await safe_edit_message_text(q, "✅ Autorizado. Continuando a CARGAR FOTO…")
@@ -2364,13 +4761,14 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 parse_mode="HTML",
             )
 
-            update_case(case_id, phase="STEP_MEDIA", pending_step_no=step_no)
+            await db_write(update_case, case_id, phase="STEP_MEDIA", pending_step_no=step_no)
             await context.bot.send_message(chat_id=chat_id, text=prompt_media_step(step_no))
             return
 
         await safe_q_answer(q, "Escribe el motivo del rechazo.", show_alert=False)
 
-        set_pending_input(
+        await db_write(
+            set_pending_input,
             chat_id=chat_id,
             user_id=user_id,
             kind="AUTH_REJECT_REASON",
@@ -2407,7 +4805,7 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_q_answer(q, "Callback inválido", show_alert=True)
             return
 
-        case_row = get_case(case_id)
+        case_row = await aget_case(case_id)
         if not case_row or case_row["status"] != "OPEN":
             await safe_q_answer(q, "Caso no válido o cerrado.", show_alert=True)
             return
@@ -2415,7 +4813,7 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_q_answer(q, "Solo el técnico del caso puede marcar evidencias completas.", show_alert=True)
             return
 
-        st = ensure_step_state(case_id, step_no)
+        st = await db_write(ensure_step_state, case_id, step_no)
         attempt = int(st["attempt"])
 
         if int(st["submitted"]) == 1 and st["approved"] is None:
@@ -2425,19 +4823,19 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_q_answer(q, "✅ Este paso ya está aprobado.", show_alert=True)
             return
 
-        count = media_count(case_id, step_no, attempt)
+        count = await db_read(media_count, case_id, step_no, attempt)
         if count <= 0:
             await safe_q_answer(q, "⚠️ Debes cargar al menos 1 foto.", show_alert=True)
             return
 
         title = STEP_MEDIA_DEFS.get(step_no, (f"PASO {step_no}",))[0]
-        approval_required = get_approval_required(int(case_row["chat_id"]))
+        approval_required = (await aget_chat_settings(context.application, int(case_row["chat_id"])))["approval_required"]
         mode = (case_row["install_mode"] or "EXTERNA").strip()
         tech_id = int(case_row["user_id"])
 
         if not approval_required:
-            auto_approve_db_step(case_id, step_no, attempt)
-            enqueue_detalle_paso_row(case_id, step_no, attempt, "APROBADO", "APROBACION OFF", "", kind="EVID")
+            await db_write(auto_approve_db_step, case_id, step_no, attempt)
+            await db_write(enqueue_detalle_paso_row, case_id, step_no, attempt, "APROBADO", "APROBACION OFF", "", kind="EVID")
 
             await safe_q_answer(q, "✅ Aprobado (OFF)", show_alert=False)
             await safe_edit_message_text(q, "✅ Aprobado automáticamente (APROBACION OFF).")
@@ -2457,17 +4855,18 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             if is_last_step(mode, step_no):
                 finished_at = now_utc()
-                update_case(case_id, status="CLOSED", phase="CLOSED", finished_at=finished_at, pending_step_no=None)
+                await db_write(update_case, case_id, status="CLOSED", phase="CLOSED", finished_at=finished_at, pending_step_no=None)
 
-                enqueue_caso_row(case_id)
+                await db_write(enqueue_caso_row, case_id)
 
-                # routing desde Sheets cache
-                route = get_route_for_chat_cached(context.application, int(case_row["chat_id"]))
+                # routing desde settings del chat (cache)
+                route = await aget_chat_settings(context.application, int(case_row["chat_id"]))
                 dest_summary = route.get("summary")
                 if dest_summary:
                     created_at = case_row["created_at"] or "-"
-                    total_evid = total_media_for_case(case_id)
-                    total_rej = total_rejects_for_case(case_id)
+                    stats = await db_read(get_case_stats, case_id)
+                    total_evid = stats["total_media"]
+                    total_rej = stats["rejected_steps"]
                     dur = duration_minutes(created_at, finished_at)
                     dur_txt = f"{dur} min" if dur is not None else "-"
 
@@ -2492,13 +4891,13 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await context.bot.send_message(chat_id=chat_id, text="🧾 Caso COMPLETADO y cerrado.")
                 return
 
-            update_case(case_id, phase="MENU_EVID", pending_step_no=None)
-            case_row2 = get_case(case_id)
+            await db_write(update_case, case_id, phase="MENU_EVID", pending_step_no=None)
+            case_row2 = await aget_case(case_id)
             await context.bot.send_message(chat_id=chat_id, text="➡️ Continúa con el siguiente paso.")
             await show_evidence_menu(chat_id, context, case_row2)
             return
 
-        mark_submitted(case_id, step_no, attempt)
+        await db_write(mark_submitted, case_id, step_no, attempt)
         await safe_q_answer(q, "📨 Enviado a revisión", show_alert=False)
 
         await context.bot.send_message(
@@ -2531,16 +4930,12 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_q_answer(q, "Solo Administradores del grupo pueden validar", show_alert=True)
             return
 
-        case_row = get_case(case_id)
+        case_row = await aget_case(case_id)
         if not case_row or case_row["status"] != "OPEN":
             await safe_q_answer(q, "Caso no válido o cerrado.", show_alert=True)
             return
 
-        with db() as conn:
-            row = conn.execute(
-                "SELECT approved FROM step_state WHERE case_id=? AND step_no=? AND attempt=?",
-                (case_id, step_no, attempt),
-            ).fetchone()
+        row = await db_read(get_step_state, case_id, step_no, attempt)
         if not row:
             await safe_q_answer(q, "No encontré el paso para revisar.", show_alert=True)
             return
@@ -2554,13 +4949,13 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         title = STEP_MEDIA_DEFS.get(step_no, (f"PASO {step_no}",))[0]
 
         if action == "REV_OK":
-            set_review(case_id, step_no, attempt, approved=1, reviewer_id=user_id)
-            enqueue_detalle_paso_row(case_id, step_no, attempt, "APROBADO", admin_name, "", kind="EVID")
+            await db_write(set_review, case_id, step_no, attempt, approved=1, reviewer_id=user_id)
+            await db_write(enqueue_detalle_paso_row, case_id, step_no, attempt, "APROBADO", admin_name, "", kind="EVID")
 
             await safe_q_answer(q, "✅ Conforme", show_alert=False)
             await safe_edit_message_text(q, "✅ Conforme.")
 
-            evids = media_count(case_id, step_no, attempt)
+            evids = await db_read(media_count, case_id, step_no, attempt)
             await context.bot.send_message(
                 chat_id=chat_id,
                 text=(
@@ -2576,16 +4971,17 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             if is_last_step(mode, step_no):
                 finished_at = now_utc()
-                update_case(case_id, status="CLOSED", phase="CLOSED", finished_at=finished_at, pending_step_no=None)
+                await db_write(update_case, case_id, status="CLOSED", phase="CLOSED", finished_at=finished_at, pending_step_no=None)
 
-                enqueue_caso_row(case_id)
+                await db_write(enqueue_caso_row, case_id)
 
-                route = get_route_for_chat_cached(context.application, int(case_row["chat_id"]))
+                route = await aget_chat_settings(context.application, int(case_row["chat_id"]))
                 dest_summary = route.get("summary")
                 if dest_summary:
                     created_at = case_row["created_at"] or "-"
-                    total_evid = total_media_for_case(case_id)
-                    total_rej = total_rejects_for_case(case_id)
+                    stats = await db_read(get_case_stats, case_id)
+                    total_evid = stats["total_media"]
+                    total_rej = stats["rejected_steps"]
                     dur = duration_minutes(created_at, finished_at)
                     dur_txt = f"{dur} min" if dur is not None else "-"
 
@@ -2610,15 +5006,16 @@ async def on_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await context.bot.send_message(chat_id=chat_id, text="🧾 Caso COMPLETADO y cerrado.")
                 return
 
-            update_case(case_id, phase="MENU_EVID", pending_step_no=None)
-            case_row2 = get_case(case_id)
+            await db_write(update_case, case_id, phase="MENU_EVID", pending_step_no=None)
+            case_row2 = await aget_case(case_id)
             await context.bot.send_message(chat_id=chat_id, text="➡️ Continúa con el siguiente paso.")
             await show_evidence_menu(chat_id, context, case_row2)
             return
 
         await safe_q_answer(q, "Escribe el motivo del rechazo.", show_alert=False)
 
-        set_pending_input(
+        await db_write(
+            set_pending_input,
             chat_id=chat_id,
             user_id=user_id,
             kind="EVID_REJECT_REASON",
@@ -2650,10 +5047,14 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if msg is None or msg.from_user is None:
         return
 
+    # Un solo lookup en memoria para todos los textos esperados (códigos / motivos)
+    pending = await apop_pending_input(msg.chat_id, msg.from_user.id, PENDING_TEXT_KINDS)
+    pending_kind = pending["kind"] if pending else ""
+
     # -------------------------
     # Pairing: pegar código (admin-only)
     # -------------------------
-    pending_pair_e = pop_pending_input(msg.chat_id, msg.from_user.id, "PAIR_CODE_EVID")
+    pending_pair_e = pending if pending_kind == "PAIR_CODE_EVID" else None
     if pending_pair_e:
         if not await is_admin_of_chat(context, msg.chat_id, msg.from_user.id):
             await context.bot.send_message(chat_id=msg.chat_id, text="⚠️ Solo administradores pueden vincular.")
@@ -2661,10 +5062,10 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         code = (msg.text or "").strip().upper()
         if not re.match(r"^PAIR-[A-Z0-9]{6}$", code):
             await context.bot.send_message(chat_id=msg.chat_id, text="⚠️ Código inválido. Ejemplo válido: PAIR-ABC123")
-            set_pending_input(msg.chat_id, msg.from_user.id, "PAIR_CODE_EVID", 0, 0, 0)
+            await db_write(set_pending_input, msg.chat_id, msg.from_user.id, "PAIR_CODE_EVID", 0, 0, 0)
             return
         try:
-            info = pairing_consume_and_upsert_routing(
+            info = await pairing_consume_and_upsert_routing(
                 context.application,
                 code=code,
                 dest_chat_id=msg.chat_id,
@@ -2686,7 +5087,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await context.bot.send_message(chat_id=msg.chat_id, text=f"⚠️ No pude vincular: {e}", reply_markup=kb_back_to_config())
         return
 
-    pending_pair_s = pop_pending_input(msg.chat_id, msg.from_user.id, "PAIR_CODE_SUM")
+    pending_pair_s = pending if pending_kind == "PAIR_CODE_SUM" else None
     if pending_pair_s:
         if not await is_admin_of_chat(context, msg.chat_id, msg.from_user.id):
             await context.bot.send_message(chat_id=msg.chat_id, text="⚠️ Solo administradores pueden vincular.")
@@ -2694,10 +5095,10 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         code = (msg.text or "").strip().upper()
         if not re.match(r"^PAIR-[A-Z0-9]{6}$", code):
             await context.bot.send_message(chat_id=msg.chat_id, text="⚠️ Código inválido. Ejemplo válido: PAIR-ABC123")
-            set_pending_input(msg.chat_id, msg.from_user.id, "PAIR_CODE_SUM", 0, 0, 0)
+            await db_write(set_pending_input, msg.chat_id, msg.from_user.id, "PAIR_CODE_SUM", 0, 0, 0)
             return
         try:
-            info = pairing_consume_and_upsert_routing(
+            info = await pairing_consume_and_upsert_routing(
                 context.application,
                 code=code,
                 dest_chat_id=msg.chat_id,
@@ -2722,12 +5123,13 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # -------------------------
     # Rechazos autorización/evidencia (admin)
     # -------------------------
-    pending_auth = pop_pending_input(msg.chat_id, msg.from_user.id, "AUTH_REJECT_REASON")
+    pending_auth = pending if pending_kind == "AUTH_REJECT_REASON" else None
     if pending_auth:
         reason = (msg.text or "").strip()
         if not reason:
             await context.bot.send_message(chat_id=msg.chat_id, text="⚠️ Envía un texto válido como motivo.")
-            set_pending_input(
+            await db_write(
+                set_pending_input,
                 chat_id=msg.chat_id,
                 user_id=msg.from_user.id,
                 kind="AUTH_REJECT_REASON",
@@ -2744,14 +5146,14 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         attempt = int(pending_auth["attempt"])
         auth_step_no = -step_no
 
-        case_db = get_case(case_id)
+        case_db = await aget_case(case_id)
         if not case_db or case_db["status"] != "OPEN":
             await context.bot.send_message(chat_id=msg.chat_id, text="⚠️ Caso no válido o ya cerrado.")
             return
 
-        set_review(case_id, auth_step_no, attempt, approved=0, reviewer_id=msg.from_user.id)
-        set_reject_reason(case_id, auth_step_no, attempt, reason, msg.from_user.id)
-        enqueue_detalle_paso_row(case_id, step_no, attempt, "RECHAZADO", msg.from_user.full_name, reason, kind="PERM")
+        await db_write(set_review, case_id, auth_step_no, attempt, approved=0, reviewer_id=msg.from_user.id)
+        await db_write(set_reject_reason, case_id, auth_step_no, attempt, reason, msg.from_user.id)
+        await db_write(enqueue_detalle_paso_row, case_id, step_no, attempt, "RECHAZADO", msg.from_user.full_name, reason, kind="PERM")
 
         tech_id = int(pending_auth["tech_user_id"]) if pending_auth["tech_user_id"] is not None else None
         reply_to = int(pending_auth["reply_to_message_id"]) if pending_auth["reply_to_message_id"] is not None else None
@@ -2771,16 +5173,17 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_to_message_id=reply_to if reply_to else None,
         )
 
-        update_case(case_id, phase="EVID_ACTION", pending_step_no=step_no)
+        await db_write(update_case, case_id, phase="EVID_ACTION", pending_step_no=step_no)
         await context.bot.send_message(chat_id=msg.chat_id, text="Elige una opción:", reply_markup=kb_action_menu(case_id, step_no))
         return
 
-    pending_evid = pop_pending_input(msg.chat_id, msg.from_user.id, "EVID_REJECT_REASON")
+    pending_evid = pending if pending_kind == "EVID_REJECT_REASON" else None
     if pending_evid:
         reason = (msg.text or "").strip()
         if not reason:
             await context.bot.send_message(chat_id=msg.chat_id, text="⚠️ Envía un texto válido como motivo.")
-            set_pending_input(
+            await db_write(
+                set_pending_input,
                 chat_id=msg.chat_id,
                 user_id=msg.from_user.id,
                 kind="EVID_REJECT_REASON",
@@ -2796,20 +5199,20 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         step_no = int(pending_evid["step_no"])
         attempt = int(pending_evid["attempt"])
 
-        case_db = get_case(case_id)
+        case_db = await aget_case(case_id)
         if not case_db or case_db["status"] != "OPEN":
             await context.bot.send_message(chat_id=msg.chat_id, text="⚠️ Caso no válido o ya cerrado.")
             return
 
-        set_review(case_id, step_no, attempt, approved=0, reviewer_id=msg.from_user.id)
-        set_reject_reason(case_id, step_no, attempt, reason, msg.from_user.id)
+        await db_write(set_review, case_id, step_no, attempt, approved=0, reviewer_id=msg.from_user.id)
+        await db_write(set_reject_reason, case_id, step_no, attempt, reason, msg.from_user.id)
 
         tech_id = int(pending_evid["tech_user_id"]) if pending_evid["tech_user_id"] is not None else None
         reply_to = int(pending_evid["reply_to_message_id"]) if pending_evid["reply_to_message_id"] is not None else None
         title = STEP_MEDIA_DEFS.get(step_no, (f"PASO {step_no}",))[0]
         mention = mention_user_html(tech_id) if tech_id else "Técnico"
 
-        enqueue_detalle_paso_row(case_id, step_no, attempt, "RECHAZADO", msg.from_user.full_name, reason, kind="EVID")
+        await db_write(enqueue_detalle_paso_row, case_id, step_no, attempt, "RECHAZADO", msg.from_user.full_name, reason, kind="EVID")
 
         await context.bot.send_message(
             chat_id=msg.chat_id,
@@ -2823,14 +5226,14 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_to_message_id=reply_to if reply_to else None,
         )
 
-        update_case(case_id, phase="EVID_ACTION", pending_step_no=step_no)
+        await db_write(update_case, case_id, phase="EVID_ACTION", pending_step_no=step_no)
         await context.bot.send_message(chat_id=msg.chat_id, text="Elige una opción:", reply_markup=kb_action_menu(case_id, step_no))
         return
 
     # -------------------------
     # Flujo técnico normal
     # -------------------------
-    case_row = get_open_case(msg.chat_id, msg.from_user.id)
+    case_row = await aget_open_case(msg.chat_id, msg.from_user.id)
     if not case_row:
         return
 
@@ -2850,18 +5253,18 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         case_id = int(case_row["case_id"])
         auth_step_no = -step_no
-        st = ensure_step_state(case_id, auth_step_no)
+        st = await db_write(ensure_step_state, case_id, auth_step_no)
         attempt = int(st["attempt"])
 
-        save_auth_text(case_id, auth_step_no, attempt, text, msg.message_id)
+        await db_write(save_auth_text, case_id, auth_step_no, attempt, text, msg.message_id)
 
-        approval_required = get_approval_required(int(case_row["chat_id"]))
+        approval_required = (await aget_chat_settings(context.application, int(case_row["chat_id"])))["approval_required"]
 
         if not approval_required:
-            auto_approve_db_step(case_id, auth_step_no, attempt)
-            enqueue_detalle_paso_row(case_id, step_no, attempt, "APROBADO", "APROBACION OFF", "", kind="PERM")
+            await db_write(auto_approve_db_step, case_id, auth_step_no, attempt)
+            await db_write(enqueue_detalle_paso_row, case_id, step_no, attempt, "APROBADO", "APROBACION OFF", "", kind="PERM")
 
-            update_case(case_id, phase="STEP_MEDIA", pending_step_no=step_no)
+            await db_write(update_case, case_id, phase="STEP_MEDIA", pending_step_no=step_no)
 
             await context.bot.send_message(
                 chat_id=msg.chat_id,
@@ -2873,8 +5276,8 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await context.bot.send_message(chat_id=msg.chat_id, text=prompt_media_step(step_no))
             return
 
-        mark_submitted(case_id, auth_step_no, attempt)
-        update_case(case_id, phase="AUTH_REVIEW", pending_step_no=step_no)
+        await db_write(mark_submitted, case_id, auth_step_no, attempt)
+        await db_write(update_case, case_id, phase="AUTH_REVIEW", pending_step_no=step_no)
 
         await context.bot.send_message(
             chat_id=msg.chat_id,
@@ -2901,7 +5304,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(chat_id=msg.chat_id, text="⚠️ Envía el código de abonado como texto.")
         return
 
-    update_case(int(case_row["case_id"]), abonado_code=text, step_index=3, phase="WAIT_LOCATION")
+    await db_write(update_case, int(case_row["case_id"]), abonado_code=text, step_index=3, phase="WAIT_LOCATION")
     await context.bot.send_message(chat_id=msg.chat_id, text=f"✅ Código de abonado registrado: {text}\n\n{prompt_step4()}")
 
 # =========================
@@ -2912,7 +5315,7 @@ async def on_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if msg is None or msg.from_user is None:
         return
 
-    case_row = get_open_case(msg.chat_id, msg.from_user.id)
+    case_row = await aget_open_case(msg.chat_id, msg.from_user.id)
     if not case_row:
         return
 
@@ -2923,7 +5326,8 @@ async def on_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(chat_id=msg.chat_id, text="⚠️ Envía tu ubicación usando 📎 → Ubicación → ubicación actual.")
         return
 
-    update_case(
+    await db_write(
+        update_case,
         int(case_row["case_id"]),
         location_lat=msg.location.latitude,
         location_lon=msg.location.longitude,
@@ -2949,7 +5353,7 @@ async def on_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if msg is None or msg.from_user is None:
         return
 
-    case_row = get_open_case(msg.chat_id, msg.from_user.id)
+    case_row = await aget_open_case(msg.chat_id, msg.from_user.id)
     if not case_row:
         return
 
@@ -2988,7 +5392,7 @@ async def on_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
         controls_kb = kb_media_controls(case_id, pending_step_no)
         label = "EVIDENCIA"
 
-    st = ensure_step_state(case_id, step_no_to_store)
+    st = await db_write(ensure_step_state, case_id, step_no_to_store)
     attempt = int(st["attempt"])
 
     if int(st["submitted"]) == 1 and st["approved"] is None:
@@ -2998,7 +5402,7 @@ async def on_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(chat_id=msg.chat_id, text="✅ Ya está aprobado. Continúa con el menú.")
         return
 
-    current = media_count(case_id, step_no_to_store, attempt)
+    current = await db_read(media_count, case_id, step_no_to_store, attempt)
     if current >= MAX_MEDIA_PER_STEP:
         await context.bot.send_message(
             chat_id=msg.chat_id,
@@ -3028,7 +5432,8 @@ async def on_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "file_type": file_type,
     }
 
-    add_media(
+    await db_write(
+        add_media,
         case_id=case_id,
         step_no=step_no_to_store,
         attempt=attempt,
@@ -3039,8 +5444,8 @@ async def on_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
         meta=meta,
     )
 
-    # Routing por Sheets cache
-    route = get_route_for_chat_cached(context.application, msg.chat_id)
+    # Routing desde settings del chat (cache)
+    route = await aget_chat_settings(context.application, msg.chat_id)
     caption = (
         f"📌 {label} ({STEP_MEDIA_DEFS.get(pending_step_no, (f'PASO {pending_step_no}',))[0]})\n"
         f"Técnico: {case_row['technician_name'] or '-'}\n"
@@ -3052,7 +5457,7 @@ async def on_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await maybe_copy_to_group(context, route.get("evidence"), file_type, file_id, caption)
 
     if phase != "AUTH_MEDIA" and file_type == "photo":
-        enqueue_evidencia_row(case_row, pending_step_no, attempt, file_id, file_unique_id, msg.message_id, route.get("evidence"))
+        await db_write(enqueue_evidencia_row, case_row, pending_step_no, attempt, file_id, file_unique_id, msg.message_id, route.get("evidence"))
 
     new_count = current + 1
     remaining2 = MAX_MEDIA_PER_STEP - new_count
@@ -3070,6 +5475,13 @@ async def on_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=controls_kb,
         )
 
+# =========================
+# Métricas de caches (log periódico)
+# =========================
+async def cache_stats_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    st = open_case_cache_stats()
+    log.info(f"Cache casos OPEN: hits={st['hits']} misses={st['misses']} size={st['size']}")
+
 # =========================
 # Error handler
 # =========================
@@ -3079,14 +5491,115 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
 # =========================
 # Main
 # =========================
+# Intento de conexión vigente: un intento abandonado (timeout) no puede publicar su estado
+_sheets_connect_state: Dict[str, Any] = {"attempt": 0, "lock": threading.Lock()}
+
+
+def _sheets_connect_begin() -> int:
+    with _sheets_connect_state["lock"]:
+        _sheets_connect_state["attempt"] += 1
+        return _sheets_connect_state["attempt"]
+
+
+def _sheets_connect_abandon(app: Application, attempt: int) -> None:
+    with _sheets_connect_state["lock"]:
+        if _sheets_connect_state["attempt"] == attempt:
+            _sheets_connect_state["attempt"] += 1
+            app.bot_data["sheets_ready"] = False
+
+
+def sheets_connect(app: Application, attempt: int) -> bool:
+    """
+    Conecta con Google, valida headers y recarga TECNICOS/ROUTING. Corre en el pool de Sheets.
+    Publica cliente/hojas en bot_data solo si `attempt` sigue vigente; retorna False si quedó obsoleto.
+    """
+    sh = sheets_client()
+
+    # Historial
+    ws_casos = sh.worksheet("CASOS")
+    ws_det = sh.worksheet("DETALLE_PASOS")
+    ws_evid = sh.worksheet("EVIDENCIAS")
+
+    _ensure_headers(ws_casos, CASOS_COLUMNS)
+    _ensure_headers(ws_det, DETALLE_PASOS_COLUMNS)
+    _ensure_headers(ws_evid, EVIDENCIAS_COLUMNS)
+
+    # Config pro
+    ws_tecnicos = sh.worksheet(TECNICOS_TAB)
+    ws_routing = sh.worksheet(ROUTING_TAB)
+    ws_pairing = sh.worksheet(PAIRING_TAB)
+
+    _ensure_headers(ws_tecnicos, TECNICOS_COLUMNS)
+    _ensure_headers(ws_routing, ROUTING_COLUMNS)
+    _ensure_headers(ws_pairing, PAIRING_COLUMNS)
+    seeded = sheet_index_seeded_sheets()
+
+    with _sheets_connect_state["lock"]:
+        if _sheets_connect_state["attempt"] != attempt:
+            log.info(f"Sheets: intento de conexión {attempt} obsoleto, se descarta.")
+            return False
+        app.bot_data["sh"] = sh
+
+        # Historial refs
+        app.bot_data["ws_casos"] = ws_casos
+        app.bot_data["ws_det"] = ws_det
+        app.bot_data["ws_evid"] = ws_evid
+        app.bot_data["sheet_index_seeded"] = seeded
+
+        # Config refs
+        app.bot_data["ws_tecnicos"] = ws_tecnicos
+        app.bot_data["ws_routing"] = ws_routing
+        app.bot_data["ws_pairing"] = ws_pairing
+        app.bot_data["sheets_ready"] = True
+
+    # Revalidar caches (por diferencia sobre la copia local)
+    load_tecnicos_cache(app)
+    load_routing_cache(app)
+    return True
+
+
+async def sheets_connect_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Job: conexión inicial con Sheets fuera del arranque; reintenta si Google no responde.
+    """
+    app = context.application
+    attempt = _sheets_connect_begin()
+    try:
+        if not await sheets_call(sheets_connect, app, attempt, timeout=SHEETS_CONNECT_TIMEOUT_SEC):
+            return
+    except Exception as e:
+        # el hilo abandonado (SheetsCallTimeout) ya no envía requests ni puede publicar su estado
+        _sheets_connect_abandon(app, attempt)
+        log.warning(f"Sheets deshabilitado ({e}); reintento en {SHEETS_CONNECT_RETRY_SEC}s, config desde copia local.")
+        context.job_queue.run_once(sheets_connect_job, when=SHEETS_CONNECT_RETRY_SEC)
+        return
+    await config_snapshot_flush(app)
+
+    # Worker de outbox historial (por eventos)
+    await sheets_worker_start(context)
+    # Siembra/verificación del índice de filas (fuera del arranque)
+    context.job_queue.run_repeating(sheet_index_verify_job, interval=SHEET_INDEX_VERIFY_SEC, first=15)
+    # Refresh config (TECNICOS + ROUTING)
+    context.job_queue.run_repeating(refresh_config_jobs, interval=30, first=10)
+
+    log.info("Sheets: conectado. Worker iniciado. Config cache (TECNICOS/ROUTING) habilitado.")
+
+
 def main():
+    if "--db-maintenance" in sys.argv[1:]:
+        # Mantenimiento único de la DB (bot detenido): migraciones + VACUUM pendiente
+        init_db(maintenance=True)
+        db_close_all()
+        return
+
     if not BOT_TOKEN:
         raise RuntimeError("Falta BOT_TOKEN. Configura la variable BOT_TOKEN con el token de BotFather.")
 
     init_db()
+    load_pending_inputs()
 
     request = HTTPXRequest(connect_timeout=10, read_timeout=25, write_timeout=25, pool_timeout=10)
-    app = Application.builder().token(BOT_TOKEN).request(request).build()
+    app = Application.builder().token(BOT_TOKEN).request(request).post_stop(sheets_worker_stop).build()
 
     # Commands
     app.add_handler(CommandHandler("start", start_cmd))
@@ -3107,66 +5620,33 @@ def main():
 
     app.add_error_handler(error_handler)
 
-    # Sheets init + indices + worker (reintentos) + config tabs
-    try:
-        sh = sheets_client()
-
-        # Historial
-        ws_casos = sh.worksheet("CASOS")
-        ws_det = sh.worksheet("DETALLE_PASOS")
-        ws_evid = sh.worksheet("EVIDENCIAS")
-
-        _ensure_headers(ws_casos, CASOS_COLUMNS)
-        _ensure_headers(ws_det, DETALLE_PASOS_COLUMNS)
-        _ensure_headers(ws_evid, EVIDENCIAS_COLUMNS)
-
-        idx_casos = build_index(ws_casos, ["case_id"])
-        idx_det = build_index(ws_det, ["case_id", "paso_numero", "attempt"])
-        idx_evid = build_index(ws_evid, ["case_id", "paso_numero", "attempt", "mensaje_telegram_id"])
-
-        # Config pro
-        ws_tecnicos = sh.worksheet(TECNICOS_TAB)
-        ws_routing = sh.worksheet(ROUTING_TAB)
-        ws_pairing = sh.worksheet(PAIRING_TAB)
-
-        _ensure_headers(ws_tecnicos, TECNICOS_COLUMNS)
-        _ensure_headers(ws_routing, ROUTING_COLUMNS)
-        _ensure_headers(ws_pairing, PAIRING_COLUMNS)
-
-        app.bot_data["sheets_ready"] = True
-        app.bot_data["sh"] = sh
-
-        # Historial refs
-        app.bot_data["ws_casos"] = ws_casos
-        app.bot_data["ws_det"] = ws_det
-        app.bot_data["ws_evid"] = ws_evid
-        app.bot_data["idx_casos"] = idx_casos
-        app.bot_data["idx_det"] = idx_det
-        app.bot_data["idx_evid"] = idx_evid
-
-        # Config refs
-        app.bot_data["ws_tecnicos"] = ws_tecnicos
-        app.bot_data["ws_routing"] = ws_routing
-        app.bot_data["ws_pairing"] = ws_pairing
-
-        # Pre-cargar caches
-        load_tecnicos_cache(app)
-        load_routing_cache(app)
+    if app.job_queue:
+        app.job_queue.run_repeating(cache_stats_job, interval=CACHE_STATS_LOG_SEC, first=CACHE_STATS_LOG_SEC)
+        app.job_queue.run_repeating(outbox_retention_job, interval=OUTBOX_RETENTION_INTERVAL_SEC, first=60)
+        if ARCHIVE_DB_PATH:
+            app.job_queue.run_repeating(archive_cases_job, interval=ARCHIVE_INTERVAL_SEC, first=300)
 
-        # Jobs
-        if app.job_queue:
-            # Worker de outbox historial
-            app.job_queue.run_repeating(sheets_worker, interval=20, first=5)
-            # Refresh config (TECNICOS + ROUTING)
-            app.job_queue.run_repeating(refresh_config_jobs, interval=30, first=10)
+    # Config desde la copia local: teclados y rutas listos antes de hablar con Google
+    app.bot_data["sheets_ready"] = False
+    config_snapshot_warm_start(app)
 
-        log.info("Sheets: conectado. Worker iniciado. Config cache (TECNICOS/ROUTING) habilitado.")
-    except Exception as e:
-        app.bot_data["sheets_ready"] = False
-        log.warning(f"Sheets deshabilitado: {e}")
+    # Sheets init + indices + worker (reintentos) + config tabs, en segundo plano
+    if app.job_queue:
+        app.job_queue.run_once(sheets_connect_job, when=0)
+    else:
+        try:
+            sheets_connect(app, _sheets_connect_begin())
+        except Exception as e:
+            app.bot_data["sheets_ready"] = False
+            log.warning(f"Sheets deshabilitado: {e}")
 
     log.info("Bot corriendo...")
-    app.run_polling(close_loop=False)
+    try:
+        app.run_polling(close_loop=False)
+    finally:
+        sheets_executor_shutdown()
+        db_executors_shutdown()
+        db_close_all()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,272 @@
+import itertools
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# El módulo lee la configuración al importarse: DB temporal y sin archivo frío
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bot_fotos_tests_"), "import.sqlite3")
+os.environ["ARCHIVE_DB_PATH"] = ""
+
+import bot_fotos3 as bot  # noqa: E402
+
+
+def _reset_db(monkeypatch, path: Path):
+    bot.db_close_all()
+    monkeypatch.setattr(bot, "DB_PATH", str(path))
+    monkeypatch.setattr(bot, "ARCHIVE_DB_PATH", "")
+    with bot._open_cases_lock:
+        bot._open_cases.clear()
+        bot._open_case_keys.clear()
+    with bot._pending_lock:
+        bot._pending.clear()
+    bot.chat_settings_invalidate()
+
+
+@pytest.fixture
+def bot_db(tmp_path, monkeypatch):
+    """Módulo con una DB SQLite nueva y migrada (solo en el hilo del test)."""
+    _reset_db(monkeypatch, tmp_path / "bot.sqlite3")
+    bot.init_db(maintenance=False)
+    yield bot
+    bot.db_close_all()
+
+
+def add_step(conn, case_id: int, step_no: int, attempt: int, submitted: int, approved=None, media: int = 0):
+    """Inserta un intento en step_state (y `media` archivos) directamente."""
+    conn.execute(
+        """
+        INSERT INTO step_state(case_id, step_no, attempt, submitted, approved, created_at)
+        VALUES(?,?,?,?,?,?)
+        """,
+        (case_id, step_no, attempt, submitted, approved, bot.now_utc()),
+    )
+    for i in range(media):
+        conn.execute(
+            """
+            INSERT INTO media(case_id, step_no, attempt, file_type, file_id, file_unique_id, tg_message_id, meta_json, created_at)
+            VALUES(?,?,?,?,?,?,?,?,?)
+            """,
+            (case_id, step_no, attempt, "photo", f"f{step_no}-{attempt}-{i}", "", 1000 + i, "{}", bot.now_utc()),
+        )
+
+
+# Esquema que creaba init_db() antes de las migraciones versionadas (user_version = 0)
+BASELINE_SCHEMA = """
+CREATE TABLE cases (
+    case_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    created_at TEXT NOT NULL,
+    finished_at TEXT,
+    status TEXT NOT NULL,
+    step_index INTEGER NOT NULL,
+    phase TEXT,
+    pending_step_no INTEGER,
+    technician_name TEXT,
+    service_type TEXT,
+    abonado_code TEXT,
+    location_lat REAL,
+    location_lon REAL,
+    location_at TEXT,
+    install_mode TEXT
+);
+CREATE INDEX idx_cases_open ON cases(chat_id, user_id, status);
+CREATE TABLE chat_config (
+    chat_id INTEGER PRIMARY KEY,
+    approval_required INTEGER NOT NULL DEFAULT 1,
+    updated_at TEXT
+);
+CREATE TABLE step_state (
+    case_id INTEGER NOT NULL,
+    step_no INTEGER NOT NULL,
+    attempt INTEGER NOT NULL DEFAULT 1,
+    submitted INTEGER NOT NULL DEFAULT 0,
+    approved INTEGER,
+    reviewed_by INTEGER,
+    reviewed_at TEXT,
+    created_at TEXT NOT NULL,
+    reject_reason TEXT,
+    reject_reason_by INTEGER,
+    reject_reason_at TEXT,
+    PRIMARY KEY(case_id, step_no, attempt),
+    FOREIGN KEY(case_id) REFERENCES cases(case_id)
+);
+CREATE TABLE media (
+    media_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    case_id INTEGER NOT NULL,
+    step_no INTEGER NOT NULL,
+    attempt INTEGER NOT NULL,
+    file_type TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    file_unique_id TEXT,
+    tg_message_id INTEGER NOT NULL,
+    meta_json TEXT,
+    created_at TEXT NOT NULL,
+    FOREIGN KEY(case_id) REFERENCES cases(case_id)
+);
+CREATE INDEX idx_media_case_step ON media(case_id, step_no, attempt);
+CREATE TABLE auth_text (
+    auth_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    case_id INTEGER NOT NULL,
+    step_no INTEGER NOT NULL,
+    attempt INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    tg_message_id INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    FOREIGN KEY(case_id) REFERENCES cases(case_id)
+);
+CREATE INDEX idx_auth_text_case_step ON auth_text(case_id, step_no, attempt);
+CREATE TABLE pending_inputs (
+    pending_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    case_id INTEGER NOT NULL,
+    step_no INTEGER NOT NULL,
+    attempt INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    reply_to_message_id INTEGER,
+    tech_user_id INTEGER
+);
+CREATE INDEX idx_pending_inputs ON pending_inputs(chat_id, user_id, kind);
+CREATE TABLE sheet_outbox (
+    outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sheet_name TEXT NOT NULL,
+    op_type TEXT NOT NULL,
+    dedupe_key TEXT NOT NULL,
+    row_json TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'PENDING',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_retry_at TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT
+);
+CREATE INDEX idx_outbox_pending ON sheet_outbox(status, next_retry_at);
+CREATE INDEX idx_outbox_key ON sheet_outbox(sheet_name, dedupe_key);
+"""
+
+T0 = "2024-01-01T00:00:00+00:00"
+
+
+@pytest.fixture
+def legacy_db(tmp_path, monkeypatch):
+    """
+    DB con el esquema base (sin migrar) y datos: caso 1 con paso 0, dos pasos aprobados,
+    uno rechazado y media; caso 2 sin pasos. Devuelve (módulo, ruta); el test llama init_db.
+    """
+    path = tmp_path / "legacy.sqlite3"
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany(
+        "INSERT INTO cases(case_id, chat_id, user_id, username, created_at, status, step_index) VALUES(?,?,?,?,?,?,?)",
+        [(1, 10, 20, "tec", T0, "OPEN", 0), (2, 10, 21, "otro", T0, "CLOSED", 0)],
+    )
+    conn.executemany(
+        "INSERT INTO step_state(case_id, step_no, attempt, submitted, approved, created_at) VALUES(?,?,?,?,?,?)",
+        [(1, 0, 1, 1, 1, T0), (1, 1, 1, 1, 1, T0), (1, 2, 1, 1, 0, T0), (1, 2, 2, 1, 1, T0), (1, 3, 1, 1, None, T0)],
+    )
+    conn.executemany(
+        "INSERT INTO media(case_id, step_no, attempt, file_type, file_id, tg_message_id, created_at) VALUES(?,?,?,?,?,?,?)",
+        [(1, 0, 1, "photo", "m0", 1, T0), (1, 1, 1, "photo", "m1", 2, T0), (1, 2, 2, "photo", "m2", 3, T0)],
+    )
+    conn.execute(
+        "INSERT INTO sheet_outbox(sheet_name, op_type, dedupe_key, row_json, created_at) VALUES(?,?,?,?,?)",
+        ("CASOS", "UPSERT", "1", "{}", T0),
+    )
+    conn.commit()
+    conn.close()
+    _reset_db(monkeypatch, path)
+    yield bot, path
+    bot.db_close_all()
+
+
+_ws_ids = itertools.count(1)
+
+
+def _col_no(letters: str) -> int:
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n
+
+
+class FakeWorksheet:
+    """
+    Hoja en memoria con lo que usan build_index / _guard_indexed_rows / sheet_*_batch: row_values(1),
+    batch_get de rangos de columna ("A2:A"), de fila ("A2:G2") o celdas sueltas ("B7"),
+    batch_update y append_rows. Cuenta las llamadas.
+    """
+
+    def __init__(self, title: str, rows):
+        self.title = title
+        self.id = f"fake-{next(_ws_ids)}"
+        self.rows = [list(r) for r in rows]
+        self.batch_gets = 0
+        self.batch_updates = 0
+        self.appends = 0
+
+    def _set(self, row_no: int, col_no: int, value) -> None:
+        while len(self.rows) < row_no:
+            self.rows.append([])
+        row = self.rows[row_no - 1]
+        while len(row) < col_no:
+            row.append("")
+        row[col_no - 1] = str(value)
+
+    def batch_update(self, data, value_input_option=None):
+        self.batch_updates += 1
+        for d in data:
+            m = re.fullmatch(r"([A-Z]+)(\d+)(?::[A-Z]+\d+)?", d["range"])
+            for j, v in enumerate(d["values"][0]):
+                self._set(int(m.group(2)), _col_no(m.group(1)) + j, v)
+
+    def append_rows(self, values, value_input_option=None):
+        self.appends += 1
+        first = len(self.rows) + 1
+        for v in values:
+            self.rows.append([str(x) for x in v])
+        return {"updates": {"updatedRange": f"'{self.title}'!A{first}:Z{len(self.rows)}"}}
+
+    def row_values(self, row_no: int):
+        return list(self.rows[row_no - 1]) if row_no <= len(self.rows) else []
+
+    def _cell(self, row_no: int, col_no: int) -> str:
+        if row_no > len(self.rows) or col_no > len(self.rows[row_no - 1]):
+            return ""
+        return str(self.rows[row_no - 1][col_no - 1])
+
+    def batch_get(self, ranges):
+        self.batch_gets += 1
+        out = []
+        for rng in ranges:
+            m = re.fullmatch(r"([A-Z]+)(\d+):([A-Z]+)", rng)
+            if m:
+                col = _col_no(m.group(1))
+                vals = [[self._cell(r, col)] if self._cell(r, col) else [] for r in range(int(m.group(2)), len(self.rows) + 1)]
+                while vals and not vals[-1]:
+                    vals.pop()  # la API recorta las filas vacías del final
+                out.append(vals)
+                continue
+            m = re.fullmatch(r"([A-Z]+)(\d+):([A-Z]+)(\d+)", rng)
+            if m:
+                r = int(m.group(2))
+                vals = [self._cell(r, c) for c in range(_col_no(m.group(1)), _col_no(m.group(3)) + 1)]
+                while vals and not vals[-1]:
+                    vals.pop()
+                out.append([vals] if vals else [])
+                continue
+            m = re.fullmatch(r"([A-Z]+)(\d+)", rng)
+            v = self._cell(int(m.group(2)), _col_no(m.group(1)))
+            out.append([[v]] if v else [])
+        return out
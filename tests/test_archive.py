@@ -0,0 +1,97 @@
+import pytest
+
+from conftest import _reset_db, add_step
+
+OLD = "2000-01-01T00:00:00+00:00"
+CUTOFF = "2001-01-01T00:00:00+00:00"
+
+
+@pytest.fixture
+def archive_db(tmp_path, monkeypatch):
+    import bot_fotos3 as bot
+
+    _reset_db(monkeypatch, tmp_path / "bot.sqlite3")
+    monkeypatch.setattr(bot, "ARCHIVE_DB_PATH", str(tmp_path / "bot_archive.sqlite3"))
+    bot.init_db(maintenance=False)
+    yield bot
+    bot.db_close_all()
+
+
+def _finished_case(bot, user_id, status="CLOSED", finished_at=OLD):
+    case_id = int(bot.create_or_reset_case(10, user_id, "tec")["case_id"])
+    with bot.db() as conn:
+        add_step(conn, case_id, 1, 1, 1, 1, media=2)
+        conn.execute(
+            "INSERT INTO auth_text(case_id, step_no, attempt, text, tg_message_id, created_at) VALUES(?,?,?,?,?,?)",
+            (case_id, -1, 1, "ok", 1, OLD),
+        )
+        conn.execute(
+            "INSERT INTO case_stats(case_id, approved_steps, rejected_steps, total_media) VALUES(?,1,0,2)",
+            (case_id,),
+        )
+        conn.commit()
+    bot.update_case(case_id, status=status, finished_at=finished_at)
+    return case_id
+
+
+def _counts(bot, schema, case_id):
+    with bot.db() as conn:
+        return {
+            t: conn.execute(f"SELECT COUNT(*) FROM {schema}.{t} WHERE case_id=?", (case_id,)).fetchone()[0]
+            for t in bot.ARCHIVE_TABLES
+        }
+
+
+def test_moves_old_finished_cases_with_their_rows(archive_db):
+    bot = archive_db
+    done = _finished_case(bot, 20)
+    cancelled = _finished_case(bot, 21, status="CANCELLED")
+    recent = _finished_case(bot, 22, finished_at="2099-01-01T00:00:00+00:00")
+    open_case = int(bot.create_or_reset_case(10, 23, "tec")["case_id"])
+
+    assert bot.archive_finished_cases(CUTOFF, 10) == 2
+    full = {"cases": 1, "step_state": 1, "media": 2, "auth_text": 1, "case_stats": 1}
+    for case_id in (done, cancelled):
+        assert _counts(bot, "main", case_id) == dict.fromkeys(full, 0)
+        assert _counts(bot, "archive", case_id) == full
+    for case_id in (recent, open_case):
+        assert _counts(bot, "archive", case_id)["cases"] == 0
+        assert _counts(bot, "main", case_id)["cases"] == 1
+
+    # reportes: las vistas *_all siguen viendo todo
+    with bot.db() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM cases_all").fetchone()[0] == 4
+        assert conn.execute("SELECT COUNT(*) FROM media_all WHERE case_id=?", (done,)).fetchone()[0] == 2
+    assert bot.archive_finished_cases(CUTOFF, 10) == 0
+
+
+def test_batches_respect_limit(archive_db):
+    bot = archive_db
+    ids = [_finished_case(bot, 30 + i) for i in range(3)]
+    assert bot.archive_finished_cases(CUTOFF, 2) == 2
+    assert bot.archive_finished_cases(CUTOFF, 2) == 1
+    assert all(_counts(bot, "archive", i)["cases"] == 1 for i in ids)
+
+
+def test_rerun_after_crash_between_copy_and_delete(archive_db):
+    bot = archive_db
+    case_id = _finished_case(bot, 20)
+    # caída tras el commit de la copia y antes del borrado: filas en ambos lados
+    with bot.db() as conn:
+        for table in bot.ARCHIVE_TABLES:
+            conn.execute(f"INSERT INTO archive.{table} SELECT * FROM main.{table} WHERE case_id=?", (case_id,))
+        conn.commit()
+
+    assert bot.archive_finished_cases(CUTOFF, 10) == 1
+    assert _counts(bot, "main", case_id) == dict.fromkeys(bot.ARCHIVE_TABLES, 0)
+    assert _counts(bot, "archive", case_id) == {"cases": 1, "step_state": 1, "media": 2, "auth_text": 1, "case_stats": 1}
+
+
+def test_get_case_of_archived_case_is_none(archive_db):
+    bot = archive_db
+    case_id = _finished_case(bot, 20)
+    assert bot.get_case(case_id)["status"] == "CLOSED"
+    bot.archive_finished_cases(CUTOFF, 10)
+    assert bot.get_case(case_id) is None
+    with bot.db() as conn:
+        assert conn.execute("SELECT status FROM cases_all WHERE case_id=?", (case_id,)).fetchone()[0] == "CLOSED"
@@ -0,0 +1,46 @@
+from conftest import FakeWorksheet
+
+
+def test_casos_lookups(bot_db):
+    bot = bot_db
+    spec = bot.HISTORY_SHEETS["CASOS"]
+    ws = FakeWorksheet("CASOS", [
+        spec["columns"],
+        ["10"],
+        [],          # fila vacía: se salta pero cuenta para el número de fila
+        ["12"],
+        ["", "x"],   # sin clave
+        ["10"],      # duplicada: gana la última
+    ])
+    index = bot.build_index(ws, spec["scan_cols"], spec["key_fn"])
+    assert index == {"10": 6, "12": 4}
+    assert ws.batch_gets == 1
+
+
+def test_detalle_pasos_key_and_non_first_columns(bot_db):
+    bot = bot_db
+    spec = bot.HISTORY_SHEETS["DETALLE_PASOS"]
+    cols = spec["columns"]
+    pos = {c: i for i, c in enumerate(cols)}
+
+    def row(case_id, paso, attempt, nombre):
+        r = [""] * len(cols)
+        r[pos["case_id"]], r[pos["paso_numero"]], r[pos["attempt"]], r[pos["paso_nombre"]] = case_id, paso, attempt, nombre
+        return r
+
+    ws = FakeWorksheet("DETALLE_PASOS", [
+        cols,
+        row("7", "1", "1", "Foto fachada"),
+        row("7", "1", "1", "PERMISO - Foto fachada"),
+        row("7", "1", "2", "Foto fachada"),
+        row("8", "3", "1", "Foto equipo"),
+    ])
+    index = bot.build_index(ws, spec["scan_cols"], spec["key_fn"])
+    assert index == {"7|1|1|EVID": 2, "7|1|1|PERM": 3, "7|1|2|EVID": 4, "8|3|1|EVID": 5}
+
+
+def test_empty_sheet(bot_db):
+    bot = bot_db
+    spec = bot.HISTORY_SHEETS["CASOS"]
+    ws = FakeWorksheet("CASOS", [spec["columns"]])
+    assert bot.build_index(ws, spec["scan_cols"], spec["key_fn"]) == {}
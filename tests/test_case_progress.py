@@ -0,0 +1,91 @@
+from conftest import add_step
+
+
+def _old_step_status(conn, case_id: int, step_no: int) -> str:
+    """step_status() previo a get_case_progress (dos consultas por paso)."""
+    in_prog = conn.execute(
+        "SELECT 1 FROM step_state WHERE case_id=? AND step_no=? AND submitted=0 ORDER BY attempt DESC LIMIT 1",
+        (case_id, step_no),
+    ).fetchone()
+    if in_prog:
+        return "IN_PROGRESS"
+    last = conn.execute(
+        "SELECT * FROM step_state WHERE case_id=? AND step_no=? AND submitted=1 ORDER BY attempt DESC LIMIT 1",
+        (case_id, step_no),
+    ).fetchone()
+    if not last:
+        return "NOT_STARTED"
+    if last["approved"] is None:
+        return "IN_REVIEW"
+    if int(last["approved"]) == 1:
+        return "DONE"
+    return "REJECTED"
+
+
+def _old_next_required(conn, case_id: int, mode: str, items):
+    for num, label, step_no in items:
+        st = _old_step_status(conn, case_id, step_no)
+        if st != "DONE":
+            return (num, label, step_no, st)
+    last_num, last_label, last_step = items[-1]
+    return (last_num, last_label, last_step, "DONE")
+
+
+def _seed(bot, steps):
+    case_id = int(bot.create_or_reset_case(10, 20, "tec")["case_id"])
+    with bot.db() as conn:
+        for step_no, attempt, submitted, approved, media in steps:
+            add_step(conn, case_id, step_no, attempt, submitted, approved, media)
+        conn.commit()
+    return case_id
+
+
+def test_progress_matches_old_step_status(bot_db):
+    bot = bot_db
+    items = bot.get_mode_items("EXTERNA")
+    step_nos = [sn for _n, _l, sn in items]
+    case_id = _seed(bot, [
+        (step_nos[0], 1, 1, 1, 2),     # DONE
+        (step_nos[1], 1, 1, 0, 1),     # rechazado y reintentando
+        (step_nos[1], 2, 0, None, 3),  # -> IN_PROGRESS
+        (step_nos[2], 1, 1, None, 1),  # IN_REVIEW
+        (step_nos[3], 1, 1, 1, 1),     # aprobado y luego rechazado en el reintento
+        (step_nos[3], 2, 1, 0, 1),     # -> REJECTED
+    ])
+
+    progress = bot.get_case_progress(case_id)
+    conn = bot.db()
+    for step_no in step_nos:
+        assert bot.progress_status(progress, step_no) == _old_step_status(conn, case_id, step_no)
+
+    assert progress[step_nos[1]]["attempt"] == 2
+    assert progress[step_nos[1]]["media_count"] == 3
+    assert progress[step_nos[1]]["submitted_attempt"] == 1
+    assert progress[step_nos[3]]["submitted_attempt"] == 2
+
+
+def test_next_required_step_matches_old_computation(bot_db):
+    bot = bot_db
+    for mode in ("EXTERNA", "INTERNA"):
+        items = bot.get_mode_items(mode)
+        step_nos = [sn for _n, _l, sn in items]
+        case_id = _seed(bot, [(sn, 1, 1, 1, 1) for sn in step_nos[:2]] + [(step_nos[2], 1, 1, None, 1)])
+        conn = bot.db()
+        assert bot.compute_next_required_step(case_id, mode) == _old_next_required(conn, case_id, mode, items)
+
+        # todo conforme -> último paso, DONE
+        with bot.db() as c:
+            c.execute("UPDATE step_state SET approved=1 WHERE case_id=?", (case_id,))
+            for sn in step_nos[3:]:
+                add_step(c, case_id, sn, 1, 1, 1, 1)
+            c.commit()
+        assert bot.compute_next_required_step(case_id, mode) == _old_next_required(conn, case_id, mode, items)
+        assert bot.compute_next_required_step(case_id, mode)[3] == "DONE"
+        bot.update_case(case_id, status="CLOSED")
+
+
+def test_progress_of_empty_case(bot_db):
+    bot = bot_db
+    case_id = _seed(bot, [])
+    assert bot.get_case_progress(case_id) == {}
+    assert bot.progress_status({}, 1) == "NOT_STARTED"
@@ -0,0 +1,66 @@
+from conftest import add_step
+
+
+def _case(bot, user_id=20):
+    return int(bot.create_or_reset_case(10, user_id, "tec")["case_id"])
+
+
+def test_counters_follow_media_and_reviews(bot_db):
+    bot = bot_db
+    case_id = _case(bot)
+    assert bot.get_case_stats(case_id) == {"approved_steps": 0, "rejected_steps": 0, "total_media": 0}
+
+    for step_no in (1, 2):
+        bot.ensure_step_state(case_id, step_no)
+        bot.add_media(case_id, step_no, 1, "photo", f"f{step_no}", None, 100 + step_no, {})
+    bot.add_media(case_id, 2, 1, "photo", "f2b", None, 200, {})
+    assert bot.get_case_stats(case_id)["total_media"] == 3
+
+    bot.set_review(case_id, 1, 1, 1, 99)
+    bot.set_review(case_id, 2, 1, 0, 99)
+    assert bot.get_case_stats(case_id) == {"approved_steps": 1, "rejected_steps": 1, "total_media": 3}
+
+    # cambio de veredicto: se mueve el contador, no se suma
+    bot.set_review(case_id, 2, 1, 1, 99)
+    bot.set_review(case_id, 2, 1, 1, 99)
+    assert bot.get_case_stats(case_id) == {"approved_steps": 2, "rejected_steps": 0, "total_media": 3}
+
+
+def test_step_zero_is_not_counted(bot_db):
+    bot = bot_db
+    case_id = _case(bot)
+    bot.ensure_step_state(case_id, 0)
+    bot.add_media(case_id, 0, 1, "photo", "f0", None, 1, {})
+    bot.set_review(case_id, 0, 1, 1, 99)
+    assert bot.get_case_stats(case_id) == {"approved_steps": 0, "rejected_steps": 0, "total_media": 0}
+
+
+def test_counters_are_per_case(bot_db):
+    bot = bot_db
+    a = _case(bot, 20)
+    b = _case(bot, 21)
+    bot.ensure_step_state(a, 1)
+    bot.add_media(a, 1, 1, "photo", "fa", None, 1, {})
+    bot.set_review(a, 1, 1, 1, 99)
+    assert bot.get_case_stats(b) == {"approved_steps": 0, "rejected_steps": 0, "total_media": 0}
+
+
+def test_migration_backfills_existing_cases(legacy_db):
+    bot, _path = legacy_db
+    bot.init_db(maintenance=False)
+    # caso 1: pasos 1 y 2 (intento 2) aprobados, paso 2 intento 1 rechazado, paso 0 fuera
+    assert bot.get_case_stats(1) == {"approved_steps": 2, "rejected_steps": 1, "total_media": 2}
+    assert bot.get_case_stats(2) == {"approved_steps": 0, "rejected_steps": 0, "total_media": 0}
+    with bot.db() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM case_stats").fetchone()[0] == 2
+
+
+def test_backfill_runs_only_once(legacy_db):
+    bot, _path = legacy_db
+    bot.init_db(maintenance=False)
+    with bot.db() as conn:
+        add_step(conn, 1, 4, 1, 1, 1, 1)  # fila escrita por fuera de los contadores
+        conn.execute("PRAGMA user_version=1;")
+        conn.commit()
+    bot.init_db(maintenance=False)
+    assert bot.get_case_stats(1) == {"approved_steps": 2, "rejected_steps": 1, "total_media": 2}
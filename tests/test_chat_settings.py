@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+
+
+def _app(routes=None):
+    return SimpleNamespace(bot_data={"routing_cache": routes or {}})
+
+
+def _config_rows(bot):
+    with bot.db() as conn:
+        return conn.execute("SELECT COUNT(*) FROM chat_config").fetchone()[0]
+
+
+def test_chat_without_config_row_defaults_to_approval_on(bot_db):
+    bot = bot_db
+    s = bot.get_chat_settings(_app(), -100)
+    assert s["approval_required"] is True
+    assert s["evidence"] is None and s["summary"] is None
+    assert _config_rows(bot) == 0  # leer no inserta fila
+
+
+def test_set_approval_invalidates_that_chat(bot_db):
+    bot = bot_db
+    app = _app()
+    assert bot.get_chat_settings(app, -100)["approval_required"] is True
+    assert bot.get_chat_settings(app, -200)["approval_required"] is True
+
+    bot.set_approval_required(-100, False)
+    assert bot.get_chat_settings(app, -100)["approval_required"] is False
+    assert -200 in bot._chat_settings  # el otro chat sigue cacheado
+
+    bot.set_approval_required(-100, True)
+    assert bot.get_chat_settings(app, -100)["approval_required"] is True
+
+
+def test_settings_are_cached_until_invalidated(bot_db):
+    bot = bot_db
+    app = _app({-100: {"origin_chat_id": -100, "evidence_chat_id": "-1", "summary_chat_id": "-2", "alias": "Obra", "activo": 1}})
+    s = bot.get_chat_settings(app, -100)
+    assert (s["evidence"], s["summary"], s["alias"]) == (-1, -2, "Obra")
+
+    app.bot_data["routing_cache"][-100]["evidence_chat_id"] = "-9"
+    assert bot.get_chat_settings(app, -100)["evidence"] == -1  # cacheado
+
+    bot.chat_settings_invalidate()  # lo hace _apply_routing_records cuando ROUTING cambia
+    assert bot.get_chat_settings(app, -100)["evidence"] == -9
+
+
+def test_routing_change_invalidates_all_chats(bot_db):
+    bot = bot_db
+    app = _app()
+    app.bot_data["routing_cache"] = {}
+    bot.get_chat_settings(app, -100)
+    rows = [dict(zip(bot.ROUTING_COLUMNS, ["-100", "-7", "", "Obra", "1", "x", "t"]))]
+    assert bot._apply_routing_records(app, rows) is True
+    assert bot.get_chat_settings(app, -100)["evidence"] == -7
+
+
+def test_inactive_route_is_ignored(bot_db):
+    bot = bot_db
+    app = _app({-100: {"origin_chat_id": -100, "evidence_chat_id": "-1", "summary_chat_id": "", "alias": "", "activo": 0}})
+    assert bot.get_chat_settings(app, -100)["evidence"] is None
@@ -0,0 +1,83 @@
+import re
+from types import SimpleNamespace
+
+from conftest import FakeWorksheet, _col_no
+
+
+class FakeSpreadsheet:
+    """values_batch_get sobre FakeWorksheet por título; registra los rangos pedidos."""
+
+    def __init__(self, *sheets):
+        self.sheets = {ws.title: ws for ws in sheets}
+        self.calls = []
+
+    def values_batch_get(self, ranges):
+        self.calls.append(list(ranges))
+        out = []
+        for rng in ranges:
+            m = re.fullmatch(r"'([^']+)'(?:!([A-Z]+)(\d+):([A-Z]+))?", rng)
+            ws = self.sheets[m.group(1)]
+            if m.group(2) is None:
+                out.append({"range": rng, "values": [list(r) for r in ws.rows]})
+                continue
+            col = _col_no(m.group(2))
+            vals = [[ws._cell(r, col)] if ws._cell(r, col) else [] for r in range(int(m.group(3)), len(ws.rows) + 1)]
+            while vals and not vals[-1]:
+                vals.pop()
+            out.append({"range": rng, "values": vals})
+        return {"valueRanges": out}
+
+
+def _app(bot):
+    tec = FakeWorksheet(bot.TECNICOS_TAB, [bot.TECNICOS_COLUMNS, ["Ana", "1", "1", "", "t1"], ["Beto", "1", "2", "", "t1"]])
+    rout = FakeWorksheet(bot.ROUTING_TAB, [bot.ROUTING_COLUMNS, ["-100", "-200", "-300", "Obra", "1", "x", "t1"]])
+    sh = FakeSpreadsheet(tec, rout)
+    app = SimpleNamespace(bot_data={"sh": sh, "ws_tecnicos": tec, "ws_routing": rout, "sheets_ready": True})
+    return app, sh, tec, rout
+
+
+def _full_reads(sh):
+    return [r for call in sh.calls for r in call if "!" not in r]
+
+
+def test_unchanged_tabs_are_not_downloaded(bot_db):
+    bot = bot_db
+    app, sh, _tec, _rout = _app(bot)
+    tabs = [bot.TECNICOS_TAB, bot.ROUTING_TAB]
+
+    assert bot.probe_config_sheets(app, tabs) == {bot.TECNICOS_TAB: True, bot.ROUTING_TAB: True}
+    assert [t["nombre"] for t in app.bot_data["tech_cache"]] == ["Ana", "Beto"]
+    assert list(app.bot_data["routing_cache"]) == [-100]
+
+    sh.calls.clear()
+    assert bot.probe_config_sheets(app, tabs) == {bot.TECNICOS_TAB: False, bot.ROUTING_TAB: False}
+    # una sola lectura: clave + updated_at de cada pestaña, nada completo
+    assert sh.calls == [["'TECNICOS'!A2:A", "'TECNICOS'!E2:E", "'ROUTING'!A2:A", "'ROUTING'!G2:G"]]
+
+
+def test_only_changed_tab_is_reloaded(bot_db):
+    bot = bot_db
+    app, sh, tec, _rout = _app(bot)
+    tabs = [bot.TECNICOS_TAB, bot.ROUTING_TAB]
+    bot.probe_config_sheets(app, tabs)
+
+    tec.rows[2] = ["Beto", "0", "2", "", "t2"]
+    sh.calls.clear()
+    assert bot.probe_config_sheets(app, tabs) == {bot.TECNICOS_TAB: True, bot.ROUTING_TAB: False}
+    assert _full_reads(sh) == ["'TECNICOS'"]
+    assert [t["nombre"] for t in app.bot_data["tech_cache"]] == ["Ana"]
+
+
+def test_periodic_full_reload_catches_edits_without_updated_at(bot_db, monkeypatch):
+    bot = bot_db
+    app, sh, tec, _rout = _app(bot)
+    bot.probe_config_sheets(app, [bot.TECNICOS_TAB])
+
+    tec.rows[1][3] = "Anita"  # edición manual sin tocar updated_at
+    sh.calls.clear()
+    assert bot.probe_config_sheets(app, [bot.TECNICOS_TAB]) == {bot.TECNICOS_TAB: False}
+    assert _full_reads(sh) == []
+
+    monkeypatch.setattr(bot, "CONFIG_FULL_RELOAD_SEC", 0)
+    assert bot.probe_config_sheets(app, [bot.TECNICOS_TAB]) == {bot.TECNICOS_TAB: True}
+    assert app.bot_data["tech_cache"][0]["alias"] == "Anita"
@@ -0,0 +1,25 @@
+import asyncio
+
+
+def test_pool_threads_reconnect_after_close_all(bot_db):
+    bot = bot_db
+
+    def count():
+        return bot.db().execute("SELECT COUNT(*) FROM cases").fetchone()[0]
+
+    async def run():
+        first = await bot.db_write(count)
+        await bot.db_read(count)
+        bot.db_close_all()
+        # el hilo escritor (único) tenía una conexión ya cerrada: debe abrir otra
+        return first, await bot.db_write(count), await bot.db_read(count)
+
+    assert asyncio.run(run()) == (0, 0, 0)
+
+
+def test_connection_is_reused_within_a_thread(bot_db):
+    bot = bot_db
+    conn = bot.db()
+    assert bot.db() is conn
+    bot.db_close_all()
+    assert bot.db() is not conn
@@ -0,0 +1,67 @@
+def _version(conn):
+    return int(conn.execute("PRAGMA user_version;").fetchone()[0])
+
+
+def _tables(conn):
+    return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()}
+
+
+def _maintenance(conn):
+    return {r["step"]: r["status"] for r in conn.execute("SELECT step, status FROM db_maintenance").fetchall()}
+
+
+def test_upgrade_from_baseline_keeps_data(legacy_db):
+    bot, _path = legacy_db
+    bot.init_db(maintenance=False)
+    with bot.db() as conn:
+        assert _version(conn) == bot.MIGRATIONS[-1][0]
+        assert {"case_stats", "sheet_outbox_archive", "sheet_row_index", "sheet_index_meta",
+                "pairing_codes", "config_snapshot", "db_maintenance"} <= _tables(conn)
+        assert conn.execute("SELECT COUNT(*) FROM cases").fetchone()[0] == 2
+        assert conn.execute("SELECT COUNT(*) FROM step_state").fetchone()[0] == 5
+        assert conn.execute("SELECT COUNT(*) FROM media").fetchone()[0] == 3
+
+        # outbox: columnas de lease agregadas sin perder la fila existente
+        row = conn.execute("SELECT * FROM sheet_outbox").fetchone()
+        assert row["dedupe_key"] == "1" and row["status"] == "PENDING"
+        assert row["lease_owner"] is None and row["lease_until"] is None
+
+        # índices viejos del outbox reemplazados por los parciales
+        idx = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'").fetchall()}
+        assert "idx_outbox_pending" not in idx and "idx_outbox_key" not in idx
+        assert {"idx_outbox_live", "idx_outbox_live_key", "idx_outbox_inflight"} <= idx
+
+
+def test_upgrade_is_idempotent(legacy_db):
+    bot, _path = legacy_db
+    bot.init_db(maintenance=False)
+    bot.init_db(maintenance=False)
+    with bot.db() as conn:
+        assert _version(conn) == bot.MIGRATIONS[-1][0]
+        assert conn.execute("SELECT COUNT(*) FROM case_stats").fetchone()[0] == 2
+
+
+def test_auto_vacuum_conversion_stays_pending_without_maintenance(legacy_db):
+    bot, _path = legacy_db
+    bot.init_db(maintenance=False)
+    with bot.db() as conn:
+        assert int(conn.execute("PRAGMA auto_vacuum;").fetchone()[0]) == 0
+        assert _maintenance(conn) == {"auto_vacuum_incremental": "PENDING"}
+
+
+def test_auto_vacuum_conversion_runs_with_maintenance(legacy_db):
+    bot, _path = legacy_db
+    bot.init_db(maintenance=False)
+    bot.init_db(maintenance=True)
+    with bot.db() as conn:
+        assert int(conn.execute("PRAGMA auto_vacuum;").fetchone()[0]) == 2
+        assert _maintenance(conn) == {"auto_vacuum_incremental": "DONE"}
+        assert conn.execute("SELECT COUNT(*) FROM cases").fetchone()[0] == 2
+
+
+def test_new_db_starts_incremental(bot_db):
+    bot = bot_db
+    with bot.db() as conn:
+        assert _version(conn) == bot.MIGRATIONS[-1][0]
+        assert int(conn.execute("PRAGMA auto_vacuum;").fetchone()[0]) == 2
+        assert _maintenance(conn) == {"auto_vacuum_incremental": "DONE"}
@@ -0,0 +1,148 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+
+def _rows(bot, sheet="CASOS"):
+    with bot.db() as conn:
+        return {
+            int(r["outbox_id"]): dict(r)
+            for r in conn.execute("SELECT * FROM sheet_outbox WHERE sheet_name=? ORDER BY outbox_id", (sheet,)).fetchall()
+        }
+
+
+def _ago(sec):
+    return (datetime.now(timezone.utc) - timedelta(seconds=sec)).isoformat()
+
+
+def test_claim_marks_in_flight_with_lease(bot_db):
+    bot = bot_db
+    bot.outbox_enqueue("CASOS", "UPSERT", "1", {"case_id": 1})
+    bot.outbox_enqueue("CASOS", "UPSERT", "2", {"case_id": 2})
+    bot.outbox_enqueue("DETALLE_PASOS", "UPSERT", "1|1|1|EVID", {"case_id": 1})
+
+    claimed = bot.outbox_claim_batch(10, "CASOS", "w1")
+    assert [r["dedupe_key"] for r in claimed] == ["1", "2"]
+    now = datetime.now(timezone.utc)
+    for r in claimed:
+        assert r["status"] == "IN_FLIGHT" and r["lease_owner"] == "w1"
+        left = (bot.parse_iso(r["lease_until"]) - now).total_seconds()
+        assert bot.OUTBOX_LEASE_SEC - 5 < left <= bot.OUTBOX_LEASE_SEC
+
+    # ya en vuelo: nadie más los reclama; la otra hoja sigue en su carril
+    assert bot.outbox_claim_batch(10, "CASOS", "w2") == []
+    assert len(bot.outbox_claim_batch(10, "DETALLE_PASOS", "w2")) == 1
+
+
+def test_key_in_flight_is_not_claimed_twice(bot_db):
+    bot = bot_db
+    bot.outbox_enqueue("CASOS", "UPSERT", "1", {"case_id": 1, "estado": "A"})
+    first = bot.outbox_claim_batch(10, "CASOS", "w1")
+    # nueva versión de la misma clave mientras la anterior está en vuelo
+    bot.outbox_enqueue("CASOS", "UPSERT", "1", {"case_id": 1, "estado": "B"})
+    bot.outbox_enqueue("CASOS", "UPSERT", "2", {"case_id": 2})
+    assert [r["dedupe_key"] for r in bot.outbox_claim_batch(10, "CASOS", "w2")] == ["2"]
+
+    bot.outbox_mark_sent([int(first[0]["outbox_id"])], "w1")
+    again = bot.outbox_claim_batch(10, "CASOS", "w2")
+    assert [r["dedupe_key"] for r in again] == ["1"] and '"B"' in again[0]["row_json"]
+
+
+def test_expired_lease_is_reclaimed(bot_db):
+    bot = bot_db
+    bot.outbox_enqueue("CASOS", "UPSERT", "1", {"case_id": 1})
+    (row,) = bot.outbox_claim_batch(10, "CASOS", "w1")
+    assert bot.outbox_claim_batch(10, "CASOS", "w2") == []
+
+    with bot.db() as conn:
+        conn.execute("UPDATE sheet_outbox SET lease_until=? WHERE outbox_id=?", (_ago(1), int(row["outbox_id"])))
+        conn.commit()
+    assert bot.outbox_next_due_sec("CASOS") == 0.0
+    (taken,) = bot.outbox_claim_batch(10, "CASOS", "w2")
+    assert taken["outbox_id"] == row["outbox_id"] and taken["lease_owner"] == "w2"
+
+    # el dueño anterior ya no puede cerrar la fila
+    bot.outbox_mark_sent([int(row["outbox_id"])], "w1")
+    bot.outbox_mark_failed(int(row["outbox_id"]), 1, "tarde", owner="w1")
+    assert _rows(bot)[int(row["outbox_id"])]["status"] == "IN_FLIGHT"
+    bot.outbox_mark_sent([int(row["outbox_id"])], "w2")
+    r = _rows(bot)[int(row["outbox_id"])]
+    assert r["status"] == "SENT" and r["lease_owner"] is None and r["lease_until"] is None
+
+
+def test_release_leases_requeues_own_rows(bot_db):
+    bot = bot_db
+    for k in ("1", "2", "3"):
+        bot.outbox_enqueue("CASOS", "UPSERT", k, {"case_id": k})
+    mine = bot.outbox_claim_batch(2, "CASOS", "w1")
+    bot.outbox_claim_batch(10, "CASOS", "w2")
+    with bot.db() as conn:
+        conn.execute("UPDATE sheet_outbox SET attempts=1 WHERE outbox_id=?", (int(mine[1]["outbox_id"]),))
+        conn.commit()
+
+    assert bot.outbox_release_leases("w1") == 2
+    rows = _rows(bot)
+    assert rows[int(mine[0]["outbox_id"])]["status"] == "PENDING"
+    assert rows[int(mine[1]["outbox_id"])]["status"] == "FAILED"
+    assert all(rows[int(r["outbox_id"])]["lease_owner"] is None for r in mine)
+    assert [r["status"] for r in rows.values()].count("IN_FLIGHT") == 1
+    assert [r["dedupe_key"] for r in bot.outbox_claim_batch(10, "CASOS", "w3")] == ["1", "2"]
+
+
+def test_failed_rows_wait_for_retry_time(bot_db):
+    bot = bot_db
+    bot.outbox_enqueue("CASOS", "UPSERT", "1", {"case_id": 1})
+    (row,) = bot.outbox_claim_batch(10, "CASOS", "w1")
+    bot.outbox_mark_failed(int(row["outbox_id"]), 1, "error", owner="w1")
+    assert bot.outbox_claim_batch(10, "CASOS", "w1") == []
+    with bot.db() as conn:
+        conn.execute("UPDATE sheet_outbox SET next_retry_at=? WHERE outbox_id=?", (_ago(1), int(row["outbox_id"])))
+        conn.commit()
+    assert len(bot.outbox_claim_batch(10, "CASOS", "w1")) == 1
+
+
+def test_default_worker_id_is_unique_per_process(bot_db):
+    bot = bot_db
+    if bot.OUTBOX_WORKER_ID_FIXED:
+        return
+    host, pid, nonce = bot.OUTBOX_WORKER_ID.rsplit(":", 2)
+    assert host and int(pid) == os.getpid() and len(nonce) == 8
+
+
+def _start_workers(bot, monkeypatch):
+    async def direct(fn, *args):
+        return fn(*args)
+
+    async def idle_lane(app, sheet_name):
+        return None
+
+    monkeypatch.setattr(bot, "db_write", direct)
+    monkeypatch.setattr(bot, "sheets_lane_loop", idle_lane)
+    app = SimpleNamespace(bot_data={})
+
+    async def run():
+        await bot.sheets_worker_start(SimpleNamespace(application=app))
+        await bot.sheets_worker_stop(app)
+
+    asyncio.run(run())
+
+
+def test_start_keeps_leases_of_other_processes(bot_db, monkeypatch):
+    bot = bot_db
+    bot.outbox_enqueue("CASOS", "UPSERT", "1", {"case_id": 1})
+    bot.outbox_claim_batch(10, "CASOS", "otro-proceso")
+    monkeypatch.setattr(bot, "OUTBOX_WORKER_ID_FIXED", "")
+    monkeypatch.setattr(bot, "OUTBOX_WORKER_ID", "otro-proceso")  # aun si coincidiera, sin id fijo no se libera
+    _start_workers(bot, monkeypatch)
+    assert [r["status"] for r in _rows(bot).values()] == ["IN_FLIGHT"]
+
+
+def test_start_releases_leases_of_fixed_worker_id(bot_db, monkeypatch):
+    bot = bot_db
+    bot.outbox_enqueue("CASOS", "UPSERT", "1", {"case_id": 1})
+    bot.outbox_claim_batch(10, "CASOS", "w1")
+    monkeypatch.setattr(bot, "OUTBOX_WORKER_ID_FIXED", "w1")
+    monkeypatch.setattr(bot, "OUTBOX_WORKER_ID", "w1")
+    _start_workers(bot, monkeypatch)
+    assert [r["status"] for r in _rows(bot).values()] == ["PENDING"]
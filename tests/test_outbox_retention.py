@@ -0,0 +1,48 @@
+def _plan(conn, sql, params):
+    return " ".join(r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall())
+
+
+def test_archive_moves_sent_and_dead_rows(bot_db):
+    bot = bot_db
+    for k in ("1", "2", "3", "4"):
+        bot.outbox_enqueue("CASOS", "UPSERT", k, {"case_id": k})
+    rows = bot.outbox_claim_batch(10, "CASOS", "w1")
+    ids = [int(r["outbox_id"]) for r in rows]
+    bot.outbox_mark_sent(ids[:1], "w1")
+    bot.outbox_mark_failed(ids[1], 8, "sin remedio", dead=True, owner="w1")
+    bot.outbox_mark_failed(ids[2], 1, "reintentar", owner="w1")
+    with bot.db() as conn:
+        conn.execute("UPDATE sheet_outbox SET updated_at='2000-01-01T00:00:00+00:00'")
+        conn.commit()
+
+    assert bot.outbox_archive_done("2001-01-01T00:00:00+00:00", 1) == 1
+    assert bot.outbox_archive_done("2001-01-01T00:00:00+00:00", 10) == 1
+    assert bot.outbox_archive_done("2001-01-01T00:00:00+00:00", 10) == 0
+    with bot.db() as conn:
+        left = {r["status"] for r in conn.execute("SELECT status FROM sheet_outbox").fetchall()}
+        archived = {r["status"] for r in conn.execute("SELECT status FROM sheet_outbox_archive").fetchall()}
+    assert left == {"FAILED", "IN_FLIGHT"}
+    assert archived == {"SENT", "DEAD"}
+
+
+def test_history_and_live_queries_use_partial_indexes(bot_db):
+    bot = bot_db
+    with bot.db() as conn:
+        assert "idx_outbox_done" in _plan(
+            conn,
+            "SELECT outbox_id FROM sheet_outbox WHERE status IN ('SENT','DEAD') AND updated_at < ? ORDER BY updated_at ASC LIMIT ?",
+            ("x", 10),
+        )
+        assert "idx_outbox_open_sheet" in _plan(
+            conn,
+            "SELECT row_json FROM sheet_outbox WHERE sheet_name=? AND status IN ('PENDING','FAILED','IN_FLIGHT') ORDER BY created_at ASC",
+            ("ROUTING",),
+        )
+
+
+def test_live_rows_include_in_flight(bot_db):
+    bot = bot_db
+    bot.outbox_enqueue("ROUTING", "UPSERT", "-1", {"origin_chat_id": "-1"})
+    bot.outbox_claim_batch(10, "ROUTING", "w1")
+    bot.outbox_enqueue("ROUTING", "PATCH", "-2", {"origin_chat_id": "-2", "alias": "x"})
+    assert [r["origin_chat_id"] for r in bot.outbox_live_rows("ROUTING")] == ["-1", "-2"]
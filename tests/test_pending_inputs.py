@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+
+def _db_ids(bot):
+    with bot.db() as conn:
+        return sorted(int(r[0]) for r in conn.execute("SELECT pending_id FROM pending_inputs").fetchall())
+
+
+def _age(bot, chat_id, user_id, kind, minutes):
+    """Envejece un pendiente en memoria y en SQLite."""
+    old = (datetime.now(timezone.utc) - timedelta(minutes=minutes)).isoformat()
+    entry = bot._pending[(chat_id, user_id)][kind]
+    entry["created_at"] = old
+    with bot.db() as conn:
+        conn.execute("UPDATE pending_inputs SET created_at=? WHERE pending_id=?", (old, entry["pending_id"]))
+        conn.commit()
+    return int(entry["pending_id"])
+
+
+def _pop(bot, chat_id, user_id, kinds):
+    return asyncio.run(bot.apop_pending_input(chat_id, user_id, kinds))
+
+
+def test_pop_follows_kind_order_and_deletes_the_row(bot_db):
+    bot = bot_db
+    bot.set_pending_input(1, 2, "EVID_REJECT_REASON", 10, 3, 1)
+    bot.set_pending_input(1, 2, "PAIR_CODE_EVID", 10, 0, 1)
+    assert len(_db_ids(bot)) == 2
+
+    entry = _pop(bot, 1, 2, bot.PENDING_TEXT_KINDS)
+    assert entry["kind"] == "PAIR_CODE_EVID"
+    entry = _pop(bot, 1, 2, ["EVID_REJECT_REASON", "PAIR_CODE_EVID"])
+    assert entry["kind"] == "EVID_REJECT_REASON" and entry["step_no"] == 3
+    assert _db_ids(bot) == []
+    assert _pop(bot, 1, 2, bot.PENDING_TEXT_KINDS) is None
+    assert (1, 2) not in bot._pending
+
+
+def test_same_kind_replaces_previous(bot_db):
+    bot = bot_db
+    bot.set_pending_input(1, 2, "AUTH_REJECT_REASON", 10, 1, 1)
+    bot.set_pending_input(1, 2, "AUTH_REJECT_REASON", 10, 2, 1)
+    assert len(_db_ids(bot)) == 1
+    assert _pop(bot, 1, 2, ["AUTH_REJECT_REASON"])["step_no"] == 2
+
+
+def test_kinds_not_asked_for_are_kept(bot_db):
+    bot = bot_db
+    bot.set_pending_input(1, 2, "PAIR_CODE_SUM", 10, 0, 1)
+    assert _pop(bot, 1, 2, ["PAIR_CODE_EVID"]) is None
+    assert _pop(bot, 1, 2, ["PAIR_CODE_SUM"])["kind"] == "PAIR_CODE_SUM"
+    assert _pop(bot, 1, 3, ["PAIR_CODE_SUM"]) is None  # otro usuario
+
+
+def test_expired_entry_is_skipped_and_deleted(bot_db):
+    bot = bot_db
+    bot.set_pending_input(1, 2, "PAIR_CODE_EVID", 10, 0, 1)
+    bot.set_pending_input(1, 2, "AUTH_REJECT_REASON", 10, 4, 1)
+    expired = _age(bot, 1, 2, "PAIR_CODE_EVID", bot.PENDING_INPUT_TTL_MIN + 1)
+
+    entry = _pop(bot, 1, 2, bot.PENDING_TEXT_KINDS)
+    assert entry["kind"] == "AUTH_REJECT_REASON"  # el vencido no gana aunque vaya primero
+    assert expired not in _db_ids(bot) and _db_ids(bot) == []
+
+
+def test_only_expired_returns_none(bot_db):
+    bot = bot_db
+    bot.set_pending_input(1, 2, "EVID_REJECT_REASON", 10, 3, 1)
+    _age(bot, 1, 2, "EVID_REJECT_REASON", bot.PENDING_INPUT_TTL_MIN + 1)
+    assert _pop(bot, 1, 2, bot.PENDING_TEXT_KINDS) is None
+    assert _db_ids(bot) == []
+
+
+def test_load_drops_expired_rows(bot_db):
+    bot = bot_db
+    bot.set_pending_input(1, 2, "PAIR_CODE_EVID", 10, 0, 1)
+    bot.set_pending_input(5, 6, "PAIR_CODE_SUM", 11, 0, 1)
+    expired = _age(bot, 1, 2, "PAIR_CODE_EVID", bot.PENDING_INPUT_TTL_MIN + 1)
+    bot._pending.clear()
+
+    bot.load_pending_inputs()
+    assert list(bot._pending) == [(5, 6)]
+    assert expired not in _db_ids(bot) and len(_db_ids(bot)) == 1
+    assert _pop(bot, 5, 6, bot.PENDING_TEXT_KINDS)["case_id"] == 11
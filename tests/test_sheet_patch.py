@@ -0,0 +1,106 @@
+from conftest import FakeWorksheet
+
+
+def _routing_ws(bot):
+    return FakeWorksheet("ROUTING", [
+        bot.ROUTING_COLUMNS,
+        ["-1", "", "", "", "1", "a", "t0"],
+        ["-2", "-20", "", "Obra B", "0", "a", "t0"],  # activo=0 editado a mano
+        ["-3", "", "", "", "1", "a", "t0"],
+    ])
+
+
+def _patch(bot, ws, index, items):
+    spec = bot.HISTORY_SHEETS["ROUTING"]
+    return bot.sheet_patch_batch(ws, index, items, spec["columns"], spec["key_cols"], spec["scan_cols"], spec["key_fn"])
+
+
+def test_patches_go_in_one_read_and_one_write(bot_db):
+    bot = bot_db
+    ws = _routing_ws(bot)
+    index = {"-1": 2, "-2": 3, "-3": 4}
+    res = _patch(bot, ws, index, [
+        (1, "-1", {"evidence_chat_id": "-10", "_if_empty": {"alias": "Obra A"}}),
+        (2, "-2", {"summary_chat_id": "-21", "updated_at": "t1", "_if_empty": {"alias": "pisaría"}}),
+        (3, "-3", {"evidence_chat_id": "-30"}),
+        (4, "-1", {"summary_chat_id": "-11"}),
+    ])
+    assert res == {1: None, 2: None, 3: None, 4: None}
+    assert (ws.batch_gets, ws.batch_updates, ws.appends) == (1, 1, 0)
+    assert ws.rows[1] == ["-1", "-10", "-11", "Obra A", "1", "a", "t0"]
+    assert ws.rows[2] == ["-2", "-20", "-21", "Obra B", "0", "a", "t1"]  # activo manual intacto
+    assert ws.rows[3] == ["-3", "-30", "", "", "1", "a", "t0"]
+
+
+def test_new_keys_are_appended_together(bot_db):
+    bot = bot_db
+    ws = _routing_ws(bot)
+    index = {"-1": 2}
+    res = _patch(bot, ws, index, [
+        (1, "-7", {"origin_chat_id": "-7", "evidence_chat_id": "-70", "_if_empty": {"alias": "Nueva"}}),
+        (2, "-8", {"origin_chat_id": "-8", "summary_chat_id": "-80"}),
+        (3, "-1", {"activo": "1"}),
+    ])
+    assert res == {1: None, 2: None, 3: None}
+    assert (ws.batch_updates, ws.appends) == (1, 1)
+    assert index["-7"] == 5 and index["-8"] == 6
+    assert ws.rows[4][:4] == ["-7", "-70", "", "Nueva"]
+
+
+def test_moved_rows_are_relocated_before_writing(bot_db):
+    bot = bot_db
+    ws = _routing_ws(bot)
+    ws.rows[1], ws.rows[3] = ws.rows[3], ws.rows[1]  # orden manual: -3 arriba, -1 abajo
+    index = {"-1": 2, "-3": 4}
+    assert _patch(bot, ws, index, [(1, "-1", {"evidence_chat_id": "-10"})]) == {1: None}
+    assert index["-1"] == 4
+    assert ws.rows[3][:2] == ["-1", "-10"] and ws.rows[1][:2] == ["-3", ""]
+
+
+def test_write_error_fails_only_the_written_keys(bot_db):
+    bot = bot_db
+    ws = _routing_ws(bot)
+
+    def boom(data, value_input_option=None):
+        raise RuntimeError("HTTP 500")
+
+    ws.batch_update = boom
+    res = _patch(bot, ws, {"-1": 2}, [
+        (1, "-1", {"evidence_chat_id": "-10"}),
+        (2, "-9", {"origin_chat_id": "-9"}),
+    ])
+    assert res[1] == "HTTP 500" and res[2] is None
+
+
+def _live(bot, key):
+    import json
+
+    with bot.db() as conn:
+        r = conn.execute(
+            "SELECT op_type, row_json FROM sheet_outbox WHERE sheet_name='ROUTING' AND dedupe_key=?", (key,)
+        ).fetchone()
+    return r["op_type"], json.loads(r["row_json"])
+
+
+def test_patch_merged_into_pending_upsert_resolves_if_empty(bot_db):
+    bot = bot_db
+    bot.outbox_enqueue("ROUTING", "UPSERT", "-5", {"origin_chat_id": "-5", "alias": "", "activo": "1"})
+    bot.outbox_enqueue("ROUTING", "PATCH", "-5", {"evidence_chat_id": "-50", "_if_empty": {"alias": "Obra", "activo": "0"}})
+    assert _live(bot, "-5") == ("UPSERT", {"origin_chat_id": "-5", "alias": "Obra", "activo": "1", "evidence_chat_id": "-50"})
+
+
+def test_patch_over_patch_keeps_if_empty(bot_db):
+    bot = bot_db
+    bot.outbox_enqueue("ROUTING", "PATCH", "-6", {"evidence_chat_id": "-60", "_if_empty": {"alias": "A"}})
+    bot.outbox_enqueue("ROUTING", "PATCH", "-6", {"summary_chat_id": "-61", "_if_empty": {"alias": "B"}})
+    op, row = _live(bot, "-6")
+    assert op == "PATCH" and row["_if_empty"] == {"alias": "A"} and row["summary_chat_id"] == "-61"
+
+
+def test_upsert_writes_if_empty_values(bot_db):
+    bot = bot_db
+    ws = _routing_ws(bot)
+    spec = bot.HISTORY_SHEETS["ROUTING"]
+    row = {"origin_chat_id": "-9", "evidence_chat_id": "-90", "_if_empty": {"alias": "Obra"}}
+    assert bot.sheet_upsert_batch(ws, {}, [(1, "-9", row)], spec["columns"], spec["key_cols"]) == {1: None}
+    assert ws.rows[-1][:4] == ["-9", "-90", "", "Obra"]
@@ -0,0 +1,56 @@
+from conftest import FakeWorksheet
+
+COLS = ["case_id", "estado"]
+
+
+def _key(v):
+    return v.get("case_id", "").strip()
+
+
+def test_put_get_sync(bot_db):
+    bot = bot_db
+    bot.sheet_row_index_put("CASOS", {"1": 2, "2": 3, "3": 4})
+    bot.sheet_row_index_put("DETALLE_PASOS", {"1": 9})
+    assert bot.sheet_row_index_get("CASOS", ["1", "3", "1", "9"]) == {"1": 2, "3": 4}
+
+    bot.sheet_row_index_put("CASOS", {"3": 7})
+    assert bot.sheet_row_index_get("CASOS", ["3"]) == {"3": 7}
+
+    # sync deja el índice igual a la hoja: cambia 1, borra 2, agrega 4, no toca 3
+    assert bot.sheet_row_index_sync("CASOS", {"1": 5, "3": 7, "4": 8}) == (2, 1)
+    assert bot.sheet_row_index_get("CASOS", ["1", "2", "3", "4"]) == {"1": 5, "3": 7, "4": 8}
+    assert bot.sheet_row_index_get("DETALLE_PASOS", ["1"]) == {"1": 9}
+    assert "CASOS" in bot.sheet_index_seeded_sheets()
+
+
+def test_get_many_keys(bot_db):
+    bot = bot_db
+    bot.sheet_row_index_put("CASOS", {str(i): i + 2 for i in range(1200)})
+    got = bot.sheet_row_index_get("CASOS", [str(i) for i in range(1200)])
+    assert len(got) == 1200 and got["1199"] == 1201
+
+
+def test_guard_keeps_index_when_rows_did_not_move(bot_db):
+    bot = bot_db
+    ws = FakeWorksheet("CASOS", [COLS, ["1", "a"], ["2", "b"], ["3", "c"]])
+    index = {"1": 2, "3": 4}
+    bot._guard_indexed_rows(ws, index, ["1", "3", "5"], ["case_id"], _key)
+    assert index == {"1": 2, "3": 4}
+    assert ws.batch_gets == 1  # solo las celdas clave, sin re-escanear
+
+
+def test_guard_relocates_after_manual_sort(bot_db):
+    bot = bot_db
+    ws = FakeWorksheet("CASOS", [COLS, ["3", "c"], ["2", "b"], ["1", "a"]])
+    index = {"1": 2, "2": 3, "3": 4}
+    bot._guard_indexed_rows(ws, index, ["1", "3"], ["case_id"], _key)
+    assert index == {"1": 4, "2": 3, "3": 2}
+    assert ws.batch_gets == 2
+
+
+def test_guard_drops_deleted_rows(bot_db):
+    bot = bot_db
+    ws = FakeWorksheet("CASOS", [COLS, ["2", "b"], ["3", "c"]])  # la fila del caso 1 se borró a mano
+    index = {"1": 2, "3": 4}
+    bot._guard_indexed_rows(ws, index, ["1", "3"], ["case_id"], _key)
+    assert index == {"3": 3}
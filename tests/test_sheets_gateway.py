@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import bot_fotos3
+
+
+@pytest.fixture
+def pool(bot_db, monkeypatch):
+    """Pool de Sheets propio del test (SHEETS_WORKERS=2), detenido al final."""
+    bot = bot_db
+    monkeypatch.setattr(bot, "SHEETS_WORKERS", 2)
+    ex = bot._PriorityExecutor(bot._sheets_pool_size, thread_name_prefix="test-sheets")
+    monkeypatch.setattr(bot, "_sheets_executor", ex)
+    yield ex
+    ex.shutdown(cancel_futures=True)
+
+
+def _wait_cancel(seen):
+    """Llamada bloqueante que coopera con el token de cancelación (como el limitador)."""
+    seen["priority"] = bot_fotos3._sheets_priority.value
+    seen["cancelled"] = bot_fotos3._sheets_priority.cancel.wait(5)
+    return "terminado"
+
+
+def test_timeout_raises_and_sets_cancel(bot_db, pool):
+    bot = bot_db
+    seen = {}
+
+    async def run():
+        t0 = time.monotonic()
+        with pytest.raises(bot.SheetsCallTimeout) as exc:
+            await bot.sheets_call(_wait_cancel, seen, timeout=0.05, priority=3)
+        waited = time.monotonic() - t0
+        result = await exc.value.pending  # el hilo termina apenas ve la cancelación
+        return waited, result
+
+    waited, result = asyncio.run(run())
+    assert waited < 1.0
+    assert result == "terminado"
+    assert seen == {"priority": 3, "cancelled": True}
+
+
+def test_settled_returns_the_real_result(bot_db, pool, monkeypatch):
+    bot = bot_db
+    monkeypatch.setattr(bot, "SHEETS_CALL_TIMEOUT_SEC", 0.05)
+    seen = {}
+    assert asyncio.run(bot.sheets_call_settled(_wait_cancel, seen, priority=1)) == "terminado"
+    assert seen["cancelled"] is True
+
+
+def test_cancel_stops_waiting_for_quota(bot_db):
+    bot = bot_db
+    bucket = bot._TokenBucket(60)
+    bucket.pause(30)
+    cancel = threading.Event()
+    threading.Timer(0.05, cancel.set).start()
+    t0 = time.monotonic()
+    with pytest.raises(bot.SheetsCallCancelled):
+        bucket.acquire(1, cancel)
+    assert time.monotonic() - t0 < 1.0
+    assert bucket.waiting == {1: 0}
+
+
+def test_pool_never_exceeds_sheets_workers(bot_db, pool):
+    bot = bot_db
+    release = threading.Event()
+    names = set()
+    running = []
+    lock = threading.Lock()
+
+    def job():
+        with lock:
+            names.add(threading.current_thread().name)
+            running.append(1)
+        release.wait(5)
+        with lock:
+            running.pop()
+
+    futs = [pool.submit(1, job) for _ in range(6)]
+    time.sleep(0.1)
+    assert len(running) == 2 and len(pool._threads) == 2
+    release.set()
+    for f in futs:
+        f.result(timeout=5)
+    assert len(names) == 2
+
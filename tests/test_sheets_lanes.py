@@ -0,0 +1,40 @@
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+
+def test_lane_survives_transient_db_error(bot_db, monkeypatch):
+    bot = bot_db
+    calls = {"due": 0, "flush": 0}
+
+    async def fake_db_read(fn, *args):
+        calls["due"] += 1
+        if calls["due"] == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return 0.0 if calls["flush"] < 2 else None
+
+    async def fake_flush(app, sheet_name):
+        calls["flush"] += 1
+        return 1, 1
+
+    monkeypatch.setattr(bot, "db_read", fake_db_read)
+    monkeypatch.setattr(bot, "sheets_flush_once", fake_flush)
+    monkeypatch.setattr(bot, "OUTBOX_COALESCE_SEC", 0)
+    monkeypatch.setattr(bot, "OUTBOX_STALL_RECHECK_SEC", 0.01)
+
+    async def run():
+        task = asyncio.ensure_future(bot.sheets_lane_loop(SimpleNamespace(bot_data={}), "CASOS"))
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if calls["flush"] >= 2:
+                break
+        assert not task.done()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        bot._outbox_wakeup["events"].clear()
+
+    asyncio.run(run())
+    assert calls["due"] >= 3 and calls["flush"] >= 2
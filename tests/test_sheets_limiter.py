@@ -0,0 +1,150 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        headers = {"Retry-After": str(retry_after)} if retry_after is not None else {}
+        self.response = SimpleNamespace(status_code=status, headers=headers)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def limited(bot_db, monkeypatch, clock):
+    """Cliente falso con el limitador instalado y buckets con reloj inyectado."""
+    bot = bot_db
+    monkeypatch.setitem(bot._sheets_buckets, "read", bot._TokenBucket(60, clock=clock))
+    monkeypatch.setitem(bot._sheets_buckets, "write", bot._TokenBucket(60, clock=clock))
+    replies = []
+    sent = []
+
+    def request(method, *args, **kwargs):
+        sent.append(method)
+        r = replies.pop(0) if replies else "ok"
+        if isinstance(r, Exception):
+            raise r
+        return r
+
+    gc = SimpleNamespace(http_client=SimpleNamespace(request=request))
+    bot._install_sheets_limiter(gc)
+    return gc.http_client.request, replies, sent
+
+
+def test_bucket_refills_with_time(bot_db, clock):
+    bot = bot_db
+    bucket = bot._TokenBucket(60, clock=clock)  # 1 token/s, ráfaga de 15
+    assert bucket.capacity == 15
+    for _ in range(15):
+        bucket.acquire()
+    assert bucket.tokens < 1.0
+
+    clock.now += 2.0
+    bucket.acquire()
+    assert bucket.tokens == pytest.approx(1.0)
+
+    clock.now += 3600
+    bucket.acquire()
+    assert bucket.tokens == pytest.approx(14.0)  # nunca más que la capacidad
+
+
+def test_429_pauses_for_retry_after(bot_db, limited, clock):
+    bot = bot_db
+    request, replies, sent = limited
+    replies.append(FakeAPIError(429, retry_after=7))
+    with pytest.raises(bot.SheetsQuotaError) as exc:
+        request("post", "https://sheets/values:batchUpdate")
+    assert bot._is_quota_sheet_error(str(exc.value))
+    write = bot._sheets_buckets["write"]
+    assert write.pause_remaining() == pytest.approx(7.0)
+    assert write.tokens == 0.0
+    assert bot._sheets_buckets["read"].pause_remaining() == 0.0
+    assert bot.sheets_quota_wait_sec() == pytest.approx(7.0)
+
+    clock.now += 7.5
+    assert write.pause_remaining() == 0.0
+    assert request("post", "https://sheets/values:batchUpdate") == "ok"
+    assert sent == ["post", "post"]
+
+
+def test_429_without_retry_after_uses_default_backoff(bot_db, limited):
+    bot = bot_db
+    request, replies, _sent = limited
+    replies.append(FakeAPIError(429))
+    with pytest.raises(bot.SheetsQuotaError):
+        request("get", "https://sheets/values")
+    assert bot._sheets_buckets["read"].pause_remaining() == pytest.approx(bot.SHEETS_QUOTA_BACKOFF_SEC)
+
+
+def test_other_errors_pass_through(bot_db, limited):
+    bot = bot_db
+    request, replies, _sent = limited
+    replies.append(FakeAPIError(500))
+    with pytest.raises(FakeAPIError):
+        request("post", "https://sheets/A429:B429")
+    assert bot.sheets_quota_wait_sec() == 0.0
+
+
+def test_batch_size_aimd(bot_db, monkeypatch):
+    bot = bot_db
+    monkeypatch.setattr(bot, "_outbox_batch", {})
+    monkeypatch.setattr(bot, "OUTBOX_BATCH_SIZE", 200)
+    monkeypatch.setattr(bot, "OUTBOX_BATCH_MIN", 20)
+    monkeypatch.setattr(bot, "OUTBOX_BATCH_MAX", 300)
+    monkeypatch.setattr(bot, "OUTBOX_BATCH_STEP", 50)
+    monkeypatch.setattr(bot, "SHEETS_LATENCY_TARGET_SEC", 5.0)
+    lane = "CASOS"
+    assert bot._lane_batch_size(lane) == 200
+
+    bot._outbox_batch_feedback(lane, 200, 1.0, False, 0)  # lote lleno y sano: +step
+    assert bot._lane_batch_size(lane) == 250
+    bot._outbox_batch_feedback(lane, 250, 1.0, False, 0)
+    assert bot._lane_batch_size(lane) == 300  # tope
+    bot._outbox_batch_feedback(lane, 10, 1.0, False, 0)  # lote corto: igual
+    assert bot._lane_batch_size(lane) == 300
+    bot._outbox_batch_feedback(lane, 300, 9.0, False, 0)  # lento: -25%
+    assert bot._lane_batch_size(lane) == 225
+    bot._outbox_batch_feedback(lane, 225, 1.0, False, 2)  # errores: -25%
+    assert bot._lane_batch_size(lane) == 168
+    bot._outbox_batch_feedback(lane, 168, 1.0, True, 0)  # 429: a la mitad
+    assert bot._lane_batch_size(lane) == 84
+    for _ in range(5):
+        bot._outbox_batch_feedback(lane, 84, 1.0, True, 0)
+    assert bot._lane_batch_size(lane) == 20  # piso
+    assert bot._lane_batch_size("EVIDENCIAS") == 200  # por carril
+
+
+def _outbox_row(bot, outbox_id):
+    with bot.db() as conn:
+        return dict(conn.execute("SELECT * FROM sheet_outbox WHERE outbox_id=?", (outbox_id,)).fetchone())
+
+
+def test_quota_failure_does_not_consume_an_attempt(bot_db, monkeypatch):
+    bot = bot_db
+    monkeypatch.setattr(bot, "OUTBOX_WORKER_ID", "w1")
+    bot.outbox_enqueue("CASOS", "UPSERT", "1", {"case_id": 1})
+    bot.outbox_enqueue("CASOS", "UPSERT", "2", {"case_id": 2})
+    a, b = (int(r["outbox_id"]) for r in bot.outbox_claim_batch(10, "CASOS", "w1"))
+
+    async def run():
+        await bot._outbox_fail(a, "CASOS", 1, f"{bot._QUOTA_ERR_PREFIX} write: HTTP 429")
+        await bot._outbox_fail(b, "CASOS", 1, "HTTP 500")
+
+    asyncio.run(run())
+    quota, other = _outbox_row(bot, a), _outbox_row(bot, b)
+    assert quota["status"] == "FAILED" and quota["attempts"] == 0 and quota["next_retry_at"]
+    assert other["status"] == "FAILED" and other["attempts"] == 1
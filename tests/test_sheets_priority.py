@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import bot_fotos3
+from conftest import FakeWorksheet
+
+
+def test_high_priority_waiter_takes_the_token_first(bot_db):
+    bot = bot_db
+    bucket = bot._TokenBucket(6)  # 0.1 token/s: tras el único token no llega otro durante el test
+    with bucket.lock:
+        bucket.tokens = 1.0
+        bucket.paused_until = time.monotonic() + 0.3  # pausa por cuota: ambos quedan esperando
+    got = []
+    cancel_low = threading.Event()
+
+    def waiter(priority, cancel=None):
+        try:
+            bucket.acquire(priority, cancel)
+            got.append(priority)
+        except bot.SheetsCallCancelled:
+            got.append(f"cancelado-{priority}")
+
+    low = threading.Thread(target=waiter, args=(3, cancel_low))  # EVIDENCIAS, llegó primero
+    low.start()
+    time.sleep(0.05)
+    high = threading.Thread(target=waiter, args=(1,))  # CASOS
+    high.start()
+    high.join(5)
+    assert got == [1]
+    cancel_low.set()
+    low.join(5)
+    assert got == [1, "cancelado-3"]
+    assert bucket.waiting == {3: 0, 1: 0}
+
+
+def test_pool_queue_runs_higher_priority_first(bot_db, monkeypatch):
+    bot = bot_db
+    monkeypatch.setattr(bot, "SHEETS_WORKERS", 1)
+    pool = bot._PriorityExecutor(bot._sheets_pool_size, thread_name_prefix="test-prio")
+    try:
+        gate = threading.Event()
+        order = []
+        blocker = pool.submit(0, gate.wait, 5)  # ocupa el único hilo
+        time.sleep(0.05)
+        futs = [pool.submit(p, order.append, p) for p in (3, 3, 2, 1, 0)]
+        gate.set()
+        for f in [blocker] + futs:
+            f.result(timeout=5)
+        assert order == [0, 1, 2, 3, 3]
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def test_lane_priority_override(bot_db, monkeypatch):
+    bot = bot_db
+    assert [bot._lane_priority(n) for n in ("CASOS", "DETALLE_PASOS", "EVIDENCIAS")] == [1, 2, 3]
+    monkeypatch.setattr(bot, "OUTBOX_LANE_PRIORITY", {"EVIDENCIAS": 0})
+    assert bot._lane_priority("EVIDENCIAS") == 0 and bot._lane_priority("CASOS") == 1
+
+
+def test_flush_runs_with_the_lane_priority(bot_db, monkeypatch):
+    bot = bot_db
+    monkeypatch.setattr(bot, "OUTBOX_LANE_PRIORITY", {"EVIDENCIAS": 5})
+    monkeypatch.setattr(bot, "OUTBOX_WORKER_ID", "w1")
+    spec = bot.HISTORY_SHEETS["EVIDENCIAS"]
+    ws = FakeWorksheet("EVIDENCIAS", [spec["columns"]])
+    seen = []
+    append_rows = ws.append_rows
+
+    def spy(values, value_input_option=None):
+        seen.append(bot_fotos3._sheets_priority.value)
+        return append_rows(values, value_input_option)
+
+    ws.append_rows = spy
+    app = SimpleNamespace(bot_data={"sheets_ready": True, spec["ws"]: ws})
+    bot.outbox_enqueue("EVIDENCIAS", "UPSERT", "m1", {"case_id": "1"})
+    assert asyncio.run(bot.sheets_flush_once(app, "EVIDENCIAS")) == (1, 1)
+    assert seen == [5]
+    assert len(ws.rows) == 2